@@ -12,59 +12,86 @@ from typing import Dict, List, Any, Union
 import logging
 import math
 import re
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from urllib.error import HTTPError
 from pathlib import Path
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from dateutil import relativedelta
 import bs4
 import requests
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
 import mdi_thesis.constants as constants
 import mdi_thesis.base.utils as utils
+import mdi_thesis.base.budget as budget
+import mdi_thesis.base.git_backend as git_backend
+import mdi_thesis.base.logs as logs
+import mdi_thesis.base.sampling as sampling
+
+# Branches with their head commit and latest pull request
+BRANCH_REFS_QUERY = """
+query($id: ID!, $after: String) {
+  node(id: $id) {
+    ... on Repository {
+      defaultBranchRef { name }
+      refs(refPrefix: "refs/heads/", first: 100, after: $after) {
+        pageInfo { hasNextPage endCursor }
+        nodes {
+          name
+          target {
+            ... on Commit {
+              oid
+              author { name email date }
+              committer { name email date }
+            }
+          }
+          associatedPullRequests(
+              first: 1, orderBy: {field: UPDATED_AT, direction: DESC}) {
+            nodes { state isDraft }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+# Count of dependent repositories in the selected tab of a dependents page
+DEPENDENTS_COUNT_PATTERN = re.compile(
+    rb'class="btn-link selected"(?:(?!</a>).)*?([\d,]+)\s+Repositor', re.S)
 
 
 def get_logger(name: str) -> logging.Logger:
     """
-    Getting logger with log settings.
+    Getting logger with log settings. Records are written
+    asynchronously to the console and the log file, see logs.LogQueue.
     :param name: Logger name.
     :return: logger object with adjusted settings.
     """
-    logger = logging.getLogger(name)
-    if not logger.handlers:
-        console = logging.StreamHandler()
-        logger.addHandler(console)
-        log_formatting = ("%(asctime)s - %(levelname)s " +
-                          "- line: " +
-                          "%(lineno)s - %(funcName)s - " +
-                          "%(module)s - %(message)s")
-        formatter = logging.Formatter(log_formatting)
-        console.setFormatter(formatter)
-        logger.setLevel(logging.DEBUG)
-        curr_path = Path(os.path.dirname(__file__))
-        log_path = curr_path.parents[1]
-        file_name = datetime.now().strftime('logger_%Y%m%d_%H_%M')
-        file_path = os.path.join("outputs/logs/", file_name)
-        file_handler = logging.FileHandler(f"{log_path}/{file_path}.log")
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
-
-    return logger
+    return logs.get_logger(
+        name, log_levels=getattr(constants, "LOG_LEVELS", None))
 
 
 class Request:
     """
     Class for GitHub Request
     """
-    def __init__(self, filter_date) -> None:
-        self.token = constants.API_TOKEN
+    def __init__(self, filter_date,
+                 request_budget: Union[budget.RequestBudget, None] = None
+                 ) -> None:
+        """
+        :param filter_date: Start date for filters in functions
+        :param request_budget: Session, tokens and rate limiters shared
+        with other requests, a new budget is created if not set.
+        """
         self.results_per_page = 100
-        self.headers = {"Authorization": "token " + self.token}
-        self.session = requests.Session()
-        retry = Retry(total=3, backoff_factor=0.5)  
-        adapter = HTTPAdapter(max_retries=retry)
-        self.session.mount('http://', adapter)
-        self.session.mount('https://', adapter)
+        self.owns_budget = request_budget is None
+        if request_budget is None:
+            tokens = getattr(constants, "API_TOKENS", [constants.API_TOKEN])
+            request_budget = budget.RequestBudget(tokens=tokens)
+        self.request_budget = request_budget
+        self.session = request_budget.session
+        self.limiters = request_budget.limiters
+        self.progress = request_budget.progress
 
         self.response = requests.Response()
         self.selected_repos_dict = {}  # type: dict[int, dict]
@@ -77,12 +104,76 @@ class Request:
         self.output_path = os.path.join(curr_path.parents[1],
                                         "outputs/data/", )
         self.filter_date = filter_date
+        # Time slicing of large lists, see get_time_sliced_data
+        self.slice_page_threshold = 10
+        self.pages_per_slice = 5
+        self.slice_workers = 4
+        # Sharded search, see get_sharded_search
+        self.search_result_cap = 1000
+        self.search_workers = 3
+        # Seconds paused before each feature of query_repository
+        # and between the stale and active branch queries
+        self.feature_pause = 60
+        self.branch_pause = 300
+        # Advisories of the global advisory database indexed by
+        # repository, kept per source for repeated joins
+        self.advisory_cache = {}  # type: dict[str, dict[str, list]]
+        # Objects per repository with queried subfeatures,
+        # see get_single_object and sampling.ObjectSampler
+        self.sampling_policy = "first"
+        self.sample_size = 100
+        # Seconds per repository and query, after which the repository
+        # is left with partial data, 0 for no limit, see unit_deadline
+        self.unit_time_budget = 0
+        self.partial_repos = set()  # type: set[int]
+        # Local clones for commits and branches, see get_git_data
+        self.git_backend = git_backend.GitBackend(
+            clone_path=os.path.join(curr_path.parents[1], "outputs",
+                                    "clones"),
+            logger=self.logger)
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        """
+        Request headers with the next token of the token pool.
+        """
+        return {"Authorization":
+                "token " + self.request_budget.tokens.next_token()}
+
+    def unit_deadline(self) -> Union[float, None]:
+        """
+        Deadline of a repository, whose query starts now.
+        :return: Deadline in monotonic seconds, None without time budget
+        """
+        if not self.unit_time_budget:
+            return None
+        return time.monotonic() + self.unit_time_budget
+
+    def deadline_passed(self, deadline: Union[float, None]) -> bool:
+        """
+        :param deadline: Deadline of unit_deadline
+        :return: True if the deadline has passed
+        """
+        return deadline is not None and time.monotonic() >= deadline
+
+    def mark_partial(self, repo: Any, feature: str):
+        """
+        Records a repository, whose query was stopped at its deadline
+        and which keeps the data queried until then.
+        :param repo: Repository id
+        :param feature: Queried feature for logging
+        """
+        self.logger.warning(
+            "Time budget of %s s exceeded for repo %s at %s, "
+            "keeping partial data", self.unit_time_budget, repo, feature)
+        self.partial_repos.add(repo)
 
     def select_repos(
         self,
         repo_nr: int,
         repo_list: List[int],
-        query_parameters: str = ""
+        query_parameters: str = "",
+        sharded: bool = False
     ):
         """
         Select Repositories according to Parameters
@@ -90,6 +181,8 @@ class Request:
         :param language: Programming language of queried repositories.
         :param sort: Factor by which the repositories are sorted.
         :param repo_list: List with repositories if preselected
+        :param sharded: True if the search is split into star and pushed
+        ranges to select more repositories than the search API returns.
         :returns: List with dictionaries of selected repositories
         """
         selected_repos = []
@@ -131,6 +224,10 @@ class Request:
                 len(self.selected_repos_dict))
             self.logger.debug(
                 "Final object_ids: %s", self.selected_repos_dict.keys())
+        elif sharded:
+            self.selected_repos_dict = self.get_sharded_search(
+                query_parameters=query_parameters,
+                repo_nr=repo_nr)
         else:
             search_url = (
                 "https://api.github.com/search/repositories?q="
@@ -260,6 +357,165 @@ class Request:
                 continue
         return results
 
+    def get_search_page(self, query_parameters: str) -> Dict[str, Any]:
+        """
+        Gets the first search result and the total number of
+        search results of a query.
+        :param query_parameters: Search query including url parameters
+        :return: Search response with total_count and items, empty if
+        the query is rejected (e.g. 422 for an invalid query).
+        """
+        search_url = ("https://api.github.com/search/repositories?q=" +
+                      query_parameters + "&per_page=1")
+        while True:
+            response = self.session.get(
+                search_url, headers=self.headers, timeout=100)
+            if response.status_code == 200:
+                return response.json()
+            if response.status_code in [403, 429]:
+                self.check_rate_limit(response=response)
+            elif 400 <= response.status_code < 500:
+                # Client errors do not change on retry
+                self.logger.critical("Status code: %s at query %s",
+                                     response.status_code, search_url)
+                return {}
+            else:
+                self.logger.critical("Status code: %s at query %s",
+                                     response.status_code, search_url)
+                time.sleep(5)
+
+    def get_search_shards(self, query: str, sort: str,
+                          stars: List[int], pushed: List[date]
+                          ) -> List[List[Any]]:
+        """
+        Splits a search query into shards with less results than the
+        search API returns. Star ranges are halved first, shards with a
+        single star value are split by halving the pushed range.
+        :param query: Search query without stars and pushed qualifiers
+        :param sort: Url parameters after the query, e.g. sort=stars
+        :param stars: Lowest and highest number of stars
+        :param pushed: Earliest and latest pushed date
+        :return: Shards as list of the shard query, its lowest
+        number of stars and its total count.
+        """
+        shard_query = (query + "+stars:" + str(stars[0]) + ".." +
+                       str(stars[1]) + "+pushed:" + pushed[0].isoformat() +
+                       ".." + pushed[1].isoformat())
+        total_count = self.get_search_page(
+            shard_query + "&" + sort).get("total_count", 0)
+        self.logger.debug("Shard %s has %s results",
+                          shard_query, total_count)
+        if total_count <= self.search_result_cap:
+            if total_count == 0:
+                return []
+            return [[shard_query, stars[0], total_count]]
+        if stars[0] < stars[1]:
+            middle = (stars[0] + stars[1]) // 2
+            return (self.get_search_shards(query, sort,
+                                           [middle + 1, stars[1]], pushed) +
+                    self.get_search_shards(query, sort,
+                                           [stars[0], middle], pushed))
+        if pushed[0] < pushed[1]:
+            middle_date = pushed[0] + (pushed[1] - pushed[0]) / 2
+            return (self.get_search_shards(
+                        query, sort, stars,
+                        [middle_date + timedelta(days=1), pushed[1]]) +
+                    self.get_search_shards(
+                        query, sort, stars, [pushed[0], middle_date]))
+        self.logger.critical("Shard %s exceeds the search limit",
+                             shard_query)
+        return [[shard_query, stars[0], total_count]]
+
+    def get_search_results(self, query_parameters: str
+                           ) -> List[Dict[str, Any]]:
+        """
+        Gets all pages of a search query.
+        :param query_parameters: Search query including url parameters
+        :return: Found repositories
+        """
+        next_url = ("https://api.github.com/search/repositories?q=" +
+                    query_parameters + "&per_page=" +
+                    str(self.results_per_page))
+        results = []
+        while next_url:
+            response = self.session.get(
+                next_url, headers=self.headers, timeout=100)
+            if response.status_code in [403, 429]:
+                self.check_rate_limit(response=response)
+                continue
+            if response.status_code != 200:
+                self.logger.critical("Status code: %s at query %s",
+                                     response.status_code, next_url)
+                break
+            results.extend(response.json().get("items", []))
+            next_url = response.links.get("next", {}).get("url")
+        return results
+
+    def get_sharded_search(self, query_parameters: str, repo_nr: int
+                           ) -> Dict[int, Dict[str, Any]]:
+        """
+        Selects repositories beyond the result cap of the search API by
+        splitting the stars:> qualifier of the query into star and
+        pushed ranges. The shards are queried concurrently within the
+        rate limit of the search API.
+        :param query_parameters: Search query, e.g.
+        pushed:>2022-12-31+language:python+stars:>900&sort=stars
+        :param repo_nr: Number of repositories with the most stars
+        to be selected, all found repositories if 0.
+        :return: Selected repositories
+        """
+        query, _, sort = query_parameters.partition("&")
+        stars_match = re.search(r"\+?stars:>(=?)(\d+)", query)
+        pushed_match = re.search(r"\+?pushed:>(=?)(\d{4}-\d{2}-\d{2})",
+                                 query)
+        if not stars_match:
+            self.logger.critical("No stars:> qualifier in query %s", query)
+            return {}
+        min_stars = int(stars_match.group(2))
+        if not stars_match.group(1):
+            min_stars += 1
+        first_pushed = date(2008, 1, 1)
+        if pushed_match:
+            first_pushed = datetime.strptime(
+                pushed_match.group(2), '%Y-%m-%d').date()
+            if not pushed_match.group(1):
+                first_pushed += timedelta(days=1)
+            query = query.replace(pushed_match.group(0), "")
+        query = query.replace(stars_match.group(0), "")
+        # The most starred repository is the upper bound of the star range
+        top_result = self.get_search_page(
+            query + "+stars:>=" + str(min_stars) + "&sort=stars"
+            ).get("items")
+        if not top_result:
+            return {}
+        max_stars = top_result[0].get("stargazers_count")
+        shards = self.get_search_shards(
+            query=query, sort=sort, stars=[min_stars, max_stars],
+            pushed=[first_pushed, date.today()])
+        # Only shards with the most stars are needed for repo_nr results
+        shards.sort(key=lambda shard: shard[1], reverse=True)
+        selected_shards = []
+        shard_total = 0
+        for shard in shards:
+            selected_shards.append(shard[0] + "&" + sort)
+            shard_total += shard[2]
+            if repo_nr and shard_total >= repo_nr:
+                break
+        self.logger.info("Querying %s of %s search shards",
+                         len(selected_shards), len(shards))
+        with ThreadPoolExecutor(max_workers=self.search_workers) as executor:
+            shard_results = list(executor.map(self.get_search_results,
+                                              selected_shards))
+        selected_repos = [repo for results in shard_results
+                          for repo in results]
+        selected_repos.sort(key=lambda repo: repo.get("stargazers_count", 0),
+                            reverse=True)
+        cleaned_results = utils.clean_results(selected_repos)
+        if repo_nr:
+            cleaned_results = dict(list(cleaned_results.items())[:repo_nr])
+        self.logger.debug("Number of cleaned repos: %s", len(cleaned_results))
+        return cleaned_results
+
     def query_repository(
         self,
         queried_features: List[str],
@@ -290,22 +546,29 @@ class Request:
                 request_url_2 = (
                     self.query_features.get(feature).get("request_url_2")
                 )
+                time_slicing = (
+                    self.query_features.get(feature).get("time_slicing",
+                                                         False)
+                )
                 query_dict[feature] = [
-                    feature_list, request_url_1, request_url_2]
+                    feature_list, request_url_1, request_url_2,
+                    time_slicing]
         request_data_dict = {}
         for param, query in query_dict.items():
             if "organization_users" in queried_features:
                 time.sleep(1)
             else:
-                time.sleep(60)
+                time.sleep(self.feature_pause)
             param_list = self.get_repository_data(
+                feature=param,
                 feature_list=query[0],
                 request_url_1=query[1],
                 request_url_2=query[2],
                 filters=filters,
                 repo_list=repo_list,
                 updated_at_filt=updated_at_filt,
-                created_at_filt=created_at_filt
+                created_at_filt=created_at_filt,
+                time_slicing=query[3]
             )
             request_data_dict[param] = param_list
 
@@ -314,7 +577,8 @@ class Request:
     def get_single_object(self,
                           feature: str,
                           filters: Dict[str, Any],
-                          output_format: str
+                          output_format: str,
+                          sample_record: Union[Dict, None] = None
                           ) -> Dict[int,
                                     List[Dict[int,
                                               List[Dict[str,
@@ -323,6 +587,8 @@ class Request:
         Function to retrieve issues and the comments for each.
         Note: Issues also contain pull requests.
         :param feature: Feature that is to be queried (e.g. commits)
+        :param sample_record: Dictionary, which receives the sampled
+        objects per repository (see sampling.ObjectSampler.record).
         :return: A dictionary with the repository id,
         its issue ids and the comments per issue.
         """
@@ -353,6 +619,8 @@ class Request:
         single_object_dict = {}
         subfeature_list = self.query_features.get(
             feature).get("subfeature_list")
+        sample_date_key = self.query_features.get(
+            feature).get("sample_date_key", "")
         self.logger.info("Finished main query for feature: %s", feature)
         if isinstance(objects_per_repo, Dict):
             self.logger.info("Getting subfeatures for: %s", feature)
@@ -373,46 +641,73 @@ class Request:
                 if objects:
                     self.logger.debug("Number of total objects: %s",
                                       len(objects))
-                    for obj in objects:
-                        object_counter += 1
-                        if object_counter % 100 == 0:
-                            self.logger.info(
-                                "Get object Nr. %s of %s",
-                                object_counter, len(objects))
-                            time.sleep(3)
+                    sampler = sampling.ObjectSampler(
+                        objects=objects,
+                        policy=self.sampling_policy,
+                        sample_size=self.sample_size,
+                        date_key=sample_date_key,
+                        seed=repository)
+                    deadline = self.unit_deadline()
+                    timed_out = False
+                    batch = sampler.first_batch()
+                    while batch and not timed_out:
+                        for index in batch:
+                            if self.deadline_passed(deadline):
+                                timed_out = True
+                                break
+                            obj = objects[index]
+                            object_counter += 1
+                            if object_counter % 100 == 0:
+                                self.logger.info(
+                                    "Get object Nr. %s of %s",
+                                    object_counter, len(objects))
+                                time.sleep(3)
 
-                        object_id = obj.get(object_key)
-                        if object_id:
-                            comment_dict = self.get_subfeatures(
-                                features=subfeature_list,
-                                object_id=object_id,
-                                object_url=url,
-                                sub_url=request_url_3,
-                                filter_date=filter_date
-                            )
-                        else:
-                            self.logger.debug("No object id found.")
-                            comment_dict = {}
-                        if isinstance(object_storage, Dict):
-                            object_storage.update(comment_dict)
-                        if isinstance(object_storage, List):
-                            object_storage.append(comment_dict)
-                        if object_counter == 100:
-                            break
+                            object_id = obj.get(object_key)
+                            if object_id:
+                                comment_dict = self.get_subfeatures(
+                                    features=subfeature_list,
+                                    object_id=object_id,
+                                    object_url=url,
+                                    sub_url=request_url_3,
+                                    filter_date=filter_date,
+                                    deadline=deadline
+                                )
+                            else:
+                                self.logger.debug("No object id found.")
+                                comment_dict = {}
+                            sampler.add_weight(
+                                sampling.get_object_weight(comment_dict))
+                            self.progress.add_objects(1)
+                            if isinstance(object_storage, Dict):
+                                object_storage.update(comment_dict)
+                            if isinstance(object_storage, List):
+                                object_storage.append(comment_dict)
+                        batch = sampler.next_batch()
+                    if timed_out or self.deadline_passed(deadline):
+                        sampler.truncate()
+                        self.mark_partial(repository, feature)
                     single_object_dict[repository] = object_storage
+                    if sample_record is not None:
+                        sample_record[repository] = sampler.record(
+                            object_key)
         else:
             single_object_dict = {}
         return single_object_dict
 
     def get_repository_data(
-        self, feature_list: List[str], request_url_1: str,
+        self, feature: str, feature_list: List[str], request_url_1: str,
         request_url_2: str, filters: Dict[str, Any],
         repo_list: Union[List[int], None],
         updated_at_filt: Union[str, None] = None,
-        created_at_filt: Union[str, None] = None
+        created_at_filt: Union[str, None] = None,
+        time_slicing: bool = False
     ) -> Dict[int, List[Dict[str, Any]]]:
         """
-        Query data from repositories
+        Query data from repositories. The pages of a repository are
+        queried until its deadline (see unit_deadline), repositories
+        with more pages keep the pages queried until then.
+        :param feature: Queried feature (e.g. issue)
         :param feature_list: Features are the information,
          which should be stored
         after querying to avoid gathering unwanted data.
@@ -421,15 +716,27 @@ class Request:
         information such as the repository id must be in the middle of the url.
         :param request_url_2: Second part of the url,
          pointing to the GitHub API subcategory.
+        :param time_slicing: True if the endpoint supports since and until,
+        then repositories with too many pages or a list too large for
+        the API are queried in concurrent time slices.
 
         :return: Repository data of the selected features.
         """
         repository_dict = {}
         results = {}
         filter_str = ""
+        slice_filter_str = ""
+        slice_since = None
         if filters:
             for key, value in filters.items():
                 filter_str = filter_str + key + value + "&"
+                if key == "since":
+                    slice_since = datetime.strptime(
+                        value.lstrip("="), '%Y-%m-%dT%H:%M:%SZ')
+                elif key != "until":
+                    slice_filter_str = slice_filter_str + key + value + "&"
+        if not time_slicing:
+            slice_since = None
         self.logger.info(
             "Getting repository data of %s repositories",
             len(self.selected_repos_dict)
@@ -458,6 +765,8 @@ class Request:
         for ind, object_id in enumerate(objects, start=1):
             if ind % 100 == 0:
                 time.sleep(5)
+            # Objects of a repo_list (e.g. users) have no deadline
+            deadline = None if repo_list else self.unit_deadline()
             complete_results = False
             while not complete_results:
                 if not repo_list:
@@ -482,6 +791,7 @@ class Request:
                                  object_id, start_url)
                 try:
                     response = requests.Response()
+                    list_too_large = False
                     for i in range(5):
                         response = self.session.get(
                             start_url, headers=self.headers, timeout=100)
@@ -496,6 +806,7 @@ class Request:
                                 self.logger.critical(
                                     "Data volume too large for API %s",
                                     object_id)
+                                list_too_large = True
                                 complete_results = True
                                 break
                             else:
@@ -513,6 +824,10 @@ class Request:
                             self.logger.critical(
                                 "Status code: %s",
                                 response.status_code)
+                            if self.deadline_passed(deadline):
+                                self.mark_partial(object_id, feature)
+                                complete_results = True
+                                break
                             self.logger.debug(
                                 "Server error at repo %s: %s - Retry in 60s",
                                 object_id, response)
@@ -527,11 +842,23 @@ class Request:
                         last = response.links.get("last")
                         if last:
                             last_url = last.get("url")
-                            nr_of_pages = (
-                                last_url.split("&page=", 1)[1]
-                                )
+                            nr_of_pages = utils.get_page_number(last_url)
 
                     self.logger.info("Querying total pages: %s", nr_of_pages)
+                    if slice_since and (
+                            list_too_large or
+                            nr_of_pages > self.slice_page_threshold):
+                        results = self.get_time_sliced_data(
+                            url_repo=url_repo,
+                            filter_str=slice_filter_str,
+                            since=slice_since,
+                            nr_of_pages=nr_of_pages,
+                            object_id=object_id,
+                            deadline=deadline)
+                        if self.deadline_passed(deadline):
+                            self.mark_partial(object_id, feature)
+                        complete_results = True
+                        continue
                     results = response.json()
                     if response.status_code == 200 and nr_of_pages == 1:
                         complete_results = True
@@ -539,6 +866,9 @@ class Request:
                     next_link = response.links.get('next')
                     if next_link:
                         while next_link:
+                            if self.deadline_passed(deadline):
+                                self.mark_partial(object_id, feature)
+                                break
                             try:
                                 self.logger.debug("Search query: %s",
                                                   next_link.get("url"))
@@ -624,7 +954,6 @@ class Request:
                     for element in results:
                         element_dict = {}  # element_dict type: Dict[str, Any]
                         get_element = False
-                        self.logger.debug(element.get("id"))
                         if updated_at_filt and filter_since:
                             updated_at = element.get("updated_at")
                             upd_date = datetime.strptime(
@@ -642,9 +971,9 @@ class Request:
                         else:
                             get_element = True
                         if get_element:
-                            for feature in feature_list:
+                            for feature_name in feature_list:
                                 try:
-                                    if feature == "description":
+                                    if feature_name == "description":
                                         desc = element.get(
                                                 "description")
                                         if desc:
@@ -653,29 +982,27 @@ class Request:
                                                     "utf-8"))
                                             element_desc = {
                                                 "description": description}
-                                            element_dict[feature] = \
+                                            element_dict[feature_name] = \
                                                 element_desc
                                     else:
-                                        value = element.get(feature)
-                                        element_dict[feature] = value
+                                        value = element.get(feature_name)
+                                        element_dict[feature_name] = value
                                 except AttributeError as att_error:
-                                    error_msg = (
-                                        "Encountered Attribute Error" +
-                                        str(att_error) +
-                                        "At element " +
-                                        feature +
-                                        "\t" +
-                                        element)
-                                    self.logger.error(error_msg)
+                                    self.logger.error(
+                                        "Encountered Attribute Error %s "
+                                        "at element %s\t%s",
+                                        att_error, feature_name, element)
                             element_list.append(element_dict)
                 elif results and isinstance(results, dict):
                     element_dict = {}  # element_dict type: Dict[str, Any]
-                    for feature in feature_list:
-                        element_dict[feature] = results.get(feature)
+                    for feature_name in feature_list:
+                        element_dict[feature_name] = results.get(
+                            feature_name)
                     element_list = element_dict  # [element_dict]
                 else:
                     element_list = []
                 repository_dict[object_id] = element_list
+                self.progress.add_objects(len(element_list))
             except Exception as error:
                 self.logger.error("Error: %s", error)
                 raise
@@ -683,6 +1010,133 @@ class Request:
         self.logger.info("Done getting repository data.")
         return repository_dict
 
+    def get_all_pages(self, start_url: str, object_id: Any,
+                      deadline: Union[float, None] = None
+                      ) -> Union[List[Dict[str, Any]], None]:
+        """
+        Queries all pages of an url by following the next links.
+        :param start_url: Url of the first page
+        :param object_id: Object id for logging
+        :param deadline: Deadline of the repository, after which no
+        further retries and pages are queried.
+        :return: Results of all pages or None,
+        if the list is too large for the API.
+        """
+        results = []  # type: list[dict[str, Any]]
+        next_url = start_url
+        server_errors = 0
+        while next_url:
+            if self.deadline_passed(deadline):
+                break
+            response = self.session.get(
+                next_url, headers=self.headers, timeout=100)
+            if response.status_code in [403, 429]:
+                response_msg = response.json().get("message", "")
+                if "list is too large" in response_msg:
+                    return None
+                self.check_rate_limit(response=response)
+                continue
+            if response.status_code in [500, 502, 503, 504] and \
+                    server_errors < 5:
+                server_errors += 1
+                self.logger.critical(
+                    "Status code: %s at object %s - Retry in 60s",
+                    response.status_code, object_id)
+                time.sleep(60)
+                continue
+            if response.status_code != 200:
+                self.logger.error("Query object %s failed at %s: %s",
+                                  object_id, next_url, response.status_code)
+                break
+            results.extend(response.json())
+            next_url = response.links.get("next", {}).get("url")
+        return results
+
+    def get_time_slice(self, url_repo: str, filter_str: str,
+                       since: datetime, until: datetime, object_id: Any,
+                       deadline: Union[float, None] = None
+                       ) -> List[Dict[str, Any]]:
+        """
+        Queries all elements between since and until.
+        Slices which are still too large for the API are split in half.
+        :param url_repo: Url of the repository endpoint without parameters
+        :param filter_str: Url parameters except since and until
+        :param since: Start of the time slice
+        :param until: End of the time slice
+        :param object_id: Object id for logging
+        :param deadline: Deadline of the repository, slices are not
+        queried after it.
+        :return: Elements of the time slice
+        """
+        if self.deadline_passed(deadline):
+            return []
+        start_url = (url_repo + "?" + filter_str +
+                     "since=" + since.strftime('%Y-%m-%dT%H:%M:%SZ') +
+                     "&until=" + until.strftime('%Y-%m-%dT%H:%M:%SZ') +
+                     "&per_page=" + str(self.results_per_page))
+        self.logger.debug("Object: %s - Slice URL: %s", object_id, start_url)
+        results = self.get_all_pages(start_url=start_url, object_id=object_id,
+                                     deadline=deadline)
+        if results is None:
+            if until - since > timedelta(days=1):
+                middle = since + (until - since) / 2
+                return (self.get_time_slice(url_repo, filter_str, middle,
+                                            until, object_id, deadline) +
+                        self.get_time_slice(url_repo, filter_str, since,
+                                            middle, object_id, deadline))
+            self.logger.critical(
+                "Data volume too large for API %s between %s and %s",
+                object_id, since, until)
+            return []
+        return results
+
+    def get_time_sliced_data(self, url_repo: str, filter_str: str,
+                             since: datetime, nr_of_pages: int,
+                             object_id: Any,
+                             deadline: Union[float, None] = None
+                             ) -> List[Dict[str, Any]]:
+        """
+        Splits the period from since until now into time slices,
+        queries the slices concurrently and merges the results.
+        Elements returned by two slices are only kept once,
+        identified by their sha or id.
+        :param url_repo: Url of the repository endpoint without parameters
+        :param filter_str: Url parameters except since and until
+        :param since: Start of the queried period
+        :param nr_of_pages: Number of pages of the unsliced query
+        :param object_id: Object id for logging
+        :param deadline: Deadline of the repository, after which the
+        slices keep the pages queried until then.
+        :return: Elements of the whole period, newest slice first
+        """
+        until = datetime.utcnow()
+        nr_of_slices = max(math.ceil(nr_of_pages / self.pages_per_slice),
+                           self.slice_workers)
+        slice_length = (until - since) / nr_of_slices
+        # Newest slice first, as returned by the API without slicing
+        slices = [(until - (nr + 1) * slice_length, until - nr * slice_length)
+                  for nr in range(nr_of_slices)]
+        self.logger.info("Querying object %s in %s time slices",
+                         object_id, nr_of_slices)
+        with ThreadPoolExecutor(max_workers=self.slice_workers) as executor:
+            slice_results = list(executor.map(
+                lambda time_slice: self.get_time_slice(
+                    url_repo, filter_str, time_slice[0], time_slice[1],
+                    object_id, deadline),
+                slices))
+        results = []
+        seen_keys = set()
+        for elements in slice_results:
+            for element in elements:
+                key = element.get("sha") or element.get("id")
+                if key in seen_keys:
+                    continue
+                seen_keys.add(key)
+                results.append(element)
+        self.logger.debug("Merged %s elements of object %s",
+                          len(results), object_id)
+        return results
+
     def get_dependents(self, dependents_details: bool) -> Dict[int, int]:
         """
         Get dependencies of a repository
@@ -708,9 +1162,15 @@ class Request:
             url = url_1 + str(repo_owner_login) + "/" + str(repo_name) + url_2
             result_cnt = 500000
             total_dependents = 0
-            visible_dependents = []
+            # Only kept if details are requested, can grow to result_cnt
+            visible_dependents = []  # type: list[list[str]]
             options = None
+            deadline = self.unit_deadline()
+            timed_out = False
             for run in range(5):
+                if self.deadline_passed(deadline):
+                    timed_out = True
+                    break
                 try:
                     self.logger.debug("Getting url: %s", url)
                     response = self.session.get(url)
@@ -759,7 +1219,13 @@ class Request:
                 self.logger.debug("Options found")
                 href_url = ""
                 for row in options[0].find_all("a", href=True):
+                    if self.deadline_passed(deadline):
+                        timed_out = True
+                        break
                     for run in range(3):
+                        if self.deadline_passed(deadline):
+                            timed_out = True
+                            break
                         time.sleep(1)
                         href = ""
                         href_string = re.search(
@@ -777,6 +1243,16 @@ class Request:
                                     "dependent_type=REPOSITORY&" +
                                     href_split[2])
                         self.logger.debug("href_url: %s", href_url)
+                        if not dependents_details:
+                            dep_count = self.get_dependents_count(href_url)
+                            if dep_count is None:
+                                self.logger.error(
+                                    "Could not get count from link %s",
+                                    href_url)
+                                time.sleep(3)
+                                continue
+                            total_dependents += dep_count
+                            break
                         tmp_href_response = self.session.get(
                                     href_url)
                         if tmp_href_response.status_code != 200:
@@ -822,6 +1298,9 @@ class Request:
                         while (next_exists
                                 and len(visible_dependents) <
                                 result_cnt):
+                            if self.deadline_passed(deadline):
+                                timed_out = True
+                                break
                             tmp_href_response = self.session.get(
                                 href_url)
                             if tmp_href_response.status_code != 200:
@@ -915,21 +1394,71 @@ class Request:
                                 )
                                 time.sleep(300)
                                 continue
+            if timed_out:
+                self.mark_partial(repo, "dependents")
             dependents_results[repo] = {"total_dependents":
-                                        total_dependents,
-                                        "visible_dependents":
-                                        len(visible_dependents)}
+                                        total_dependents}
+            if dependents_details:
+                dependents_results[repo]["visible_dependents"] = len(
+                    visible_dependents)
         return dependents_results
 
-    def get_dependencies(self) -> Dict[int, int]:
+    def get_dependents_count(self, url: str) -> Union[int, None]:
+        """
+        Streams a dependents page and scans the received chunks for the
+        number of dependent repositories. The connection is closed as
+        soon as the count is found, without parsing the page.
+        :param url: Url of the dependents page of a package
+        :return: Number of dependent repositories or None,
+        if the count could not be found.
+        """
+        marker = b'class="btn-link selected"'
+        response = self.session.get(url, stream=True, timeout=100)
+        try:
+            if response.status_code == 429:
+                time_to_wait = int(response.headers.get("Retry-After", 60))
+                self.logger.critical(
+                    "Too many requests, sleeping for %s sec.",
+                    time_to_wait)
+                time.sleep(time_to_wait)
+                return None
+            if response.status_code != 200:
+                self.logger.debug("Status code: %s at url %s",
+                                  response.status_code, url)
+                time.sleep(60)
+                return None
+            buffer = b""
+            for chunk in response.iter_content(chunk_size=8192):
+                buffer += chunk
+                match = DEPENDENTS_COUNT_PATTERN.search(buffer)
+                if match:
+                    return int(match.group(1).replace(b",", b""))
+                # Keep only the part which can still contain the count,
+                # from the marker on, or a marker cut at the chunk end
+                marker_pos = buffer.rfind(marker)
+                if marker_pos >= 0:
+                    buffer = buffer[marker_pos:]
+                else:
+                    buffer = buffer[-len(marker):]
+        finally:
+            response.close()
+        return None
+
+    def get_dependencies(self, repo_ids: Union[List[int], None] = None
+                         ) -> Dict[int, int]:
         """
         NOTE: Dependency graph from GitHub is still in progress!
         Changes in near future can cause errors!
         Get dependencies of a repository.
+        :param repo_ids: Restricts the scraping to these repositories,
+        all selected repositories are scraped if not set.
         :return: Repository ids and the number of dependencies
         """
         dependency_results = {}
         repositories = self.selected_repos_dict.items()
+        if repo_ids is not None:
+            repositories = [(repo, data) for repo, data in repositories
+                            if repo in repo_ids]
         for repo_num, (repo, data) in enumerate(repositories, start=1):
             if repo_num % 100 == 0:
                 self.logger.info("Getting repo Nr. %s of %s",
@@ -1025,6 +1554,58 @@ class Request:
                     next_exists = True
             dependency_results[repo] = sorted(results)
         return dependency_results
+
+    def get_dependencies_sbom(self) -> Dict[int, List[str]]:
+        """
+        Get dependencies of a repository from the SBOM of
+        GitHub's dependency graph API, one request per repository.
+        Repositories for which the API call fails are gathered
+        with the web scraper of get_dependencies instead.
+        :return: Repository ids and the sorted dependency names
+        """
+        dependency_results = {}
+        failed_repos = []
+        url_1 = self.query_features.get(
+            "dependency_sbom").get("request_url_1")
+        url_2 = self.query_features.get(
+            "dependency_sbom").get("request_url_2")
+        repositories = self.selected_repos_dict
+        for repo_num, repo in enumerate(repositories, start=1):
+            if repo_num % 100 == 0:
+                self.logger.info("Getting repo Nr. %s of %s",
+                                 repo_num,
+                                 len(repositories))
+            url = url_1 + str(repo) + url_2
+            self.logger.debug("Getting url: %s", url)
+            response = requests.Response()
+            for run in range(3):
+                response = self.session.get(
+                    url, headers=self.headers, timeout=100)
+                if response.status_code in [403, 429] and \
+                        response.headers.get("X-RateLimit-Remaining") == "0":
+                    self.check_rate_limit(response=response)
+                elif response.status_code in [500, 502, 503, 504]:
+                    self.logger.critical(
+                        "Status code: %s - Retry in 60s at try %s",
+                        response.status_code, run + 1)
+                    time.sleep(60)
+                else:
+                    break
+            if response.status_code == 200:
+                sbom = response.json().get("sbom", {})
+                dependency_results[repo] = utils.get_sbom_packages(sbom)
+            else:
+                self.logger.debug(
+                    "No SBOM for repo %s - Status code: %s",
+                    repo, response.status_code)
+                failed_repos.append(repo)
+        if failed_repos:
+            self.logger.info(
+                "Scraping dependencies of %s repositories without SBOM",
+                len(failed_repos))
+            dependency_results.update(
+                self.get_dependencies(repo_ids=failed_repos))
+        return dependency_results
     
     def get_branches(self, activity: str = "all") -> Dict[int, Dict[str, str]]:
         """
@@ -1061,7 +1642,11 @@ class Request:
             next_exists = True
             result_cnt = 500000
             results = {}
+            deadline = self.unit_deadline()
             while next_exists and len(results) < result_cnt:
+                if self.deadline_passed(deadline):
+                    self.mark_partial(repo, "branches_" + activity)
+                    break
                 response = self.session.get(url)
                 self.logger.debug("Getting url %s", url)
                 if response.status_code != 200:
@@ -1125,6 +1710,272 @@ class Request:
             time.sleep(1)
         return branches_results
 
+    def get_advisory_database(self, ecosystems: List[str]
+                              ) -> List[Dict[str, Any]]:
+        """
+        Pages through GitHub's global advisory database.
+        :param ecosystems: Ecosystems (e.g. pip) to be queried
+        :return: List with the advisories of all ecosystems
+        """
+        request_url = self.query_features.get(
+            "global_advisories").get("request_url_1")
+        start_urls = [request_url + "?ecosystem=" + ecosystem +
+                      "&per_page=" + str(self.results_per_page)
+                      for ecosystem in ecosystems]
+        advisories = []
+        for start_url in start_urls:
+            next_url = start_url
+            server_errors = 0
+            rate_limit_retries = 0
+            while next_url:
+                self.logger.debug("Getting advisories page %s", next_url)
+                response = self.session.get(
+                    next_url, headers=self.headers, timeout=100)
+                if response.status_code in [403, 429] and \
+                        rate_limit_retries < 5:
+                    rate_limit_retries += 1
+                    self.check_rate_limit(response=response)
+                    continue
+                if response.status_code in [500, 502, 503, 504] and \
+                        server_errors < 5:
+                    server_errors += 1
+                    self.logger.critical(
+                        "Status code: %s - Retry in 60s",
+                        response.status_code)
+                    time.sleep(60)
+                    continue
+                if response.status_code != 200:
+                    self.logger.error(
+                        "Could not query advisories at %s: %s",
+                        next_url, response.status_code)
+                    break
+                advisories.extend(response.json())
+                rate_limit_retries = 0
+                next_url = response.links.get("next", {}).get("url")
+            self.logger.info("Gathered %s advisories after %s",
+                             len(advisories), start_url)
+        return advisories
+
+    def get_global_advisories(self, ecosystems: List[str],
+                              dump_path: str = ""
+                              ) -> Dict[int, List[Dict[str, Any]]]:
+        """
+        Gets the security advisories of the selected repositories from
+        the global advisory database instead of one request per
+        repository. The advisories are indexed by their repository and
+        joined with the selected repositories.
+        :param ecosystems: Ecosystems to be queried from the API
+        :param dump_path: Path to a json file with a list of advisories
+        in the format of the API, used instead of querying the API.
+        :return: Repository ids with the corresponding advisories
+        in the format of repository security advisories.
+        """
+        cache_key = dump_path or ",".join(ecosystems)
+        advisories_per_repo = self.advisory_cache.get(cache_key)
+        if advisories_per_repo is None:
+            if dump_path:
+                self.logger.info("Reading advisories from %s", dump_path)
+                advisories = utils.json_to_dict(path=dump_path)
+            else:
+                advisories = self.get_advisory_database(
+                    ecosystems=ecosystems)
+            advisories_per_repo = {}  # type: dict[str, list[dict]]
+            for advisory in advisories:
+                repo_name = utils.get_advisory_repository(advisory)
+                if repo_name:
+                    advisories_per_repo.setdefault(repo_name, []).append(
+                        advisory)
+            self.advisory_cache[cache_key] = advisories_per_repo
+        feature_list = self.query_features.get(
+            "global_advisories").get("feature_list")
+        repo_advisories = {}
+        for repo, data in self.selected_repos_dict.items():
+            repo_owner = data.get("owner")
+            repo_owner_login = ""
+            if repo_owner:
+                repo_owner_login = repo_owner.get("login")
+            repo_name = (str(repo_owner_login) + "/" +
+                         str(data.get("name"))).lower()
+            repo_advisories[repo] = [
+                utils.normalize_global_advisory(advisory, feature_list)
+                for advisory in advisories_per_repo.get(repo_name, [])]
+        self.logger.info(
+            "Found advisories for %s of %s repositories",
+            len([adv for adv in repo_advisories.values() if adv]),
+            len(repo_advisories))
+        return repo_advisories
+
+    def query_graphql(self, query: str, variables: Dict[str, Any]
+                      ) -> Union[Dict[str, Any], None]:
+        """
+        Sends a query to the GraphQL API.
+        :param query: GraphQL query
+        :param variables: Variables of the query
+        :return: Data of the response or None, if the query failed.
+        """
+        url = self.query_features.get("graphql").get("request_url_1")
+        for run in range(5):
+            response = self.session.post(
+                url, json={"query": query, "variables": variables},
+                headers=self.headers, timeout=100)
+            if response.status_code in [403, 429]:
+                if response.headers.get("Retry-After"):
+                    time.sleep(int(response.headers["Retry-After"]))
+                else:
+                    self.check_rate_limit(response=response)
+                continue
+            if response.status_code in [500, 502, 503, 504]:
+                self.logger.critical(
+                    "Status code: %s at try %s - Retry in 60s",
+                    response.status_code, run + 1)
+                time.sleep(60)
+                continue
+            if response.status_code != 200:
+                self.logger.error("GraphQL query failed: %s - %s",
+                                  response.status_code, variables)
+                return None
+            results = response.json()
+            if results.get("errors"):
+                self.logger.error("GraphQL errors: %s - %s",
+                                  results.get("errors"), variables)
+            return results.get("data")
+        return None
+
+    def get_branch_stale_date(self) -> date:
+        """
+        :return: Date since which branches without commits are stale
+        """
+        stale_after = self.query_features.get(
+            "branches_graphql").get("stale_after").split("=")
+        stale_date = self.filter_date - relativedelta.relativedelta(
+            **{str(stale_after[0]): int(stale_after[1])})
+        if isinstance(stale_date, datetime):
+            stale_date = stale_date.date()
+        return stale_date
+
+    def get_git_data(self, feature: str, since: str = ""
+                     ) -> Dict[int, Any]:
+        """
+        Gets commits, single commits or branches of the selected
+        repositories from local clones, see git_backend.GitBackend.
+        The clones are updated once per pipeline.
+        :param feature: "commits", "single_commits" or "branches"
+        :param since: Start date of the commits,
+        in the format %Y-%m-%dT%H:%M:%SZ
+        :return: Data per repository in the format of the REST API,
+        for branches a dictionary with stale_branches, active_branches
+        and branches as returned by get_branches_graphql.
+        """
+        results = {}  # type: dict[int, Any]
+        branch_results = {"stale_branches": {},
+                          "active_branches": {},
+                          "branches": {}}  # type: dict[str, dict]
+        stale_date = self.get_branch_stale_date()
+        for repo, data in self.selected_repos_dict.items():
+            try:
+                path = self.git_backend.update(
+                    repo_id=repo, url=str(data.get("html_url")) + ".git")
+                if feature == "commits":
+                    results[repo] = self.git_backend.get_commits(
+                        path=path, since=since)
+                elif feature == "single_commits":
+                    results[repo] = self.git_backend.get_single_commits(
+                        path=path, since=since)
+                else:
+                    stale, active, branches = self.git_backend.get_branches(
+                        path=path, stale_date=stale_date)
+                    branch_results["stale_branches"][repo] = stale
+                    branch_results["active_branches"][repo] = active
+                    branch_results["branches"][repo] = branches
+            except (subprocess.CalledProcessError, OSError) as error:
+                self.logger.error("Could not get %s of repo %s from git: %s",
+                                  feature, repo, error)
+        if feature == "branches":
+            return branch_results
+        return results
+
+    def get_branches_graphql(self) -> Dict[str, Dict[int, Dict[str, Any]]]:
+        """
+        Gets all branches with their head commit and the state of their
+        latest pull request from the GraphQL API, 100 branches per request.
+        Branches without commits within the stale period are stale,
+        the others are active. The states are named as on the branches
+        page of GitHub (Open, Draft, Closed, Merged or Compare).
+        :return: Dictionary with stale_branches and active_branches
+        (branch name and state per repository) and branches
+        (branch name and head commit per repository).
+        """
+        stale_date = self.get_branch_stale_date()
+        branch_results = {"stale_branches": {},
+                          "active_branches": {},
+                          "branches": {}}  # type: dict[str, dict]
+        repositories = self.selected_repos_dict.items()
+        for repo_num, (repo, data) in enumerate(repositories, start=1):
+            if repo_num % 100 == 0:
+                self.logger.info("Getting repo Nr. %s of %s",
+                                 repo_num,
+                                 len(repositories))
+            stale_branches = {}
+            active_branches = {}
+            branches = {}
+            variables = {"id": data.get("node_id"), "after": None}
+            has_next_page = True
+            while has_next_page:
+                results = self.query_graphql(query=BRANCH_REFS_QUERY,
+                                             variables=variables)
+                node = (results or {}).get("node")
+                if not node:
+                    self.logger.error("Could not get branches of repo %s",
+                                      repo)
+                    break
+                default_branch = (node.get("defaultBranchRef") or {}).get(
+                    "name")
+                refs = node.get("refs") or {}
+                for ref in refs.get("nodes") or []:
+                    branch_name = ref.get("name")
+                    target = ref.get("target") or {}
+                    author = target.get("author") or {}
+                    committer = target.get("committer") or {}
+                    author_date = utils.to_api_timestamp(author.get("date"))
+                    branches[branch_name] = [{"commit": {
+                        "sha": target.get("oid"),
+                        "commit": {
+                            "author": {
+                                "name": author.get("name"),
+                                "email": author.get("email"),
+                                "date": author_date},
+                            "committer": {
+                                "name": committer.get("name"),
+                                "email": committer.get("email"),
+                                "date": utils.to_api_timestamp(
+                                    committer.get("date"))}}}}]
+                    pulls = (ref.get("associatedPullRequests") or {}).get(
+                        "nodes")
+                    if branch_name == default_branch:
+                        branch_state = ""
+                    elif pulls:
+                        branch_state = pulls[0].get("state").capitalize()
+                        if pulls[0].get("isDraft") and \
+                                branch_state == "Open":
+                            branch_state = "Draft"
+                    else:
+                        branch_state = "Compare"
+                    commit_date = None
+                    if author_date:
+                        commit_date = datetime.strptime(
+                            author_date, '%Y-%m-%dT%H:%M:%SZ').date()
+                    if commit_date and commit_date >= stale_date:
+                        active_branches[branch_name] = branch_state
+                    else:
+                        stale_branches[branch_name] = branch_state
+                page_info = refs.get("pageInfo") or {}
+                has_next_page = page_info.get("hasNextPage", False)
+                variables["after"] = page_info.get("endCursor")
+            branch_results["stale_branches"][repo] = stale_branches
+            branch_results["active_branches"][repo] = active_branches
+            branch_results["branches"][repo] = branches
+        return branch_results
+
     def get_context_information(self, main_feature: str,
                                 sub_feature: str, filters: Dict[str, Any]
                                 ) -> Dict[int, List[Dict[str, Any]]]:
@@ -1176,7 +2027,8 @@ class Request:
         object_id: int,
         object_url: str,
         sub_url: str,
-        filter_date: Union[datetime, None]
+        filter_date: Union[datetime, None],
+        deadline: Union[float, None] = None
     ) -> Dict[int, List[Dict[str, Any]]]:
         """
         :param session: Active request session
@@ -1188,6 +2040,8 @@ class Request:
         Base url to which the object id is added to query the information.
         :param sub_url: Sub url referring to the subfeatures of a certain
         information (e.g. comments as subfeatures for issues as features)
+        :param deadline: Deadline of the repository, after which no
+        further retries and pages are queried.
         :return: Dictionary with the object id and the concerning comments
         """
         subfeature_dict = {}
@@ -1211,6 +2065,8 @@ class Request:
                 continue
             elif response.status_code in [500, 502,
                                           503, 504]:
+                if self.deadline_passed(deadline):
+                    break
                 self.logger.debug(
                     "Connection failed at object %s:%s",
                     object_id, response)
@@ -1227,6 +2083,8 @@ class Request:
         results = response.json()
         if response.links.get('next'):
             while response.links.get('next'):
+                if self.deadline_passed(deadline):
+                    break
                 try:
                     url = response.links['next']['url']
                     self.logger.debug("Search query: %s",
@@ -1300,4 +2158,5 @@ class Request:
         return subfeature_dict
 
     def __del__(self):
-        self.session.close()
+        if getattr(self, "owns_budget", False):
+            self.request_budget.close()
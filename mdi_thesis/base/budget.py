@@ -0,0 +1,164 @@
+"""
+Request Budget
+
+Author: Jacqueline Schmatz
+Description: Rate limiting of requests per resource class and
+request budgets shared between pipelines.
+"""
+
+import itertools
+import threading
+import time
+from typing import Callable, Dict, List, Union
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+import mdi_thesis.base.progress as progress
+
+
+def resource_class(url: str) -> str:
+    """
+    Gets the resource class of an url. Requests of the same class
+    compete for the same rate limit.
+    :param url: Requested url
+    :return: "graphql", "search", "api", "web" or "external"
+    """
+    parsed_url = urlparse(url)
+    if parsed_url.netloc == "api.github.com":
+        if parsed_url.path.startswith("/graphql"):
+            return "graphql"
+        if parsed_url.path.startswith("/search"):
+            return "search"
+        return "api"
+    if parsed_url.netloc == "github.com":
+        return "web"
+    return "external"
+
+
+class RateLimiter:
+    """
+    Thread safe rate limiter, which spaces requests evenly
+    to allow a number of requests per period.
+    Waiting threads are served in the order they called acquire.
+    """
+    def __init__(self, requests_per_period: int, period: float) -> None:
+        """
+        :param requests_per_period: Allowed requests per period
+        :param period: Period in seconds
+        """
+        self.interval = period / requests_per_period
+        self.next_slot = 0.0
+        self.waited_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Blocks until the next request is allowed.
+        :return: Seconds waited
+        """
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+            wait = slot - now
+            self.waited_seconds += wait
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class BudgetAdapter(HTTPAdapter):
+    """
+    Transport adapter, which passes every request through the
+    rate limiter of its resource class before sending it.
+    """
+    def __init__(self, limiters: Dict[str, Union[RateLimiter, None]],
+                 on_request: Union[Callable[[str], None], None] = None,
+                 **kwargs) -> None:
+        """
+        :param limiters: Rate limiter per resource class,
+        resource classes without limiter are not limited.
+        :param on_request: Called with the resource class of each request
+        """
+        self.limiters = limiters
+        self.on_request = on_request
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        resource = resource_class(request.url)
+        limiter = self.limiters.get(resource)
+        if limiter:
+            limiter.acquire()
+        if self.on_request:
+            self.on_request(resource)
+        return super().send(request, **kwargs)
+
+
+class TokenPool:
+    """
+    Thread safe round robin over API tokens.
+    """
+    def __init__(self, tokens: List[str]) -> None:
+        """
+        :param tokens: API tokens
+        """
+        self.tokens = tokens
+        self.token_cycle = itertools.cycle(tokens)
+        self.lock = threading.Lock()
+
+    def next_token(self) -> str:
+        """
+        :return: Next token of the pool
+        """
+        with self.lock:
+            return next(self.token_cycle)
+
+
+class RequestBudget:
+    """
+    Connection pool, token pool and rate limiters, which can be
+    shared by several pipelines to stay within one rate budget.
+    """
+    def __init__(self, tokens: List[str], pool_size: int = 10,
+                 throttle: bool = False) -> None:
+        """
+        :param tokens: API tokens, the rate limits of the API
+        scale with the number of tokens.
+        :param pool_size: Connections kept open per host
+        :param throttle: True to space REST and GraphQL requests evenly
+        within their rate limits, e.g. for pipelines sharing the budget.
+        Otherwise they are only paused by check_rate_limit, when a rate
+        limit is exhausted. Search requests are always spaced, as
+        sharded searches query concurrently.
+        """
+        self.tokens = TokenPool(tokens)
+        # The search API allows 30 requests per minute and token,
+        # REST and GraphQL API 5000 requests per hour and token.
+        self.limiters = {
+            "api": None, "graphql": None,
+            "search": RateLimiter(
+                requests_per_period=30 * len(tokens), period=60)
+        }  # type: Dict[str, Union[RateLimiter, None]]
+        if throttle:
+            self.limiters["api"] = RateLimiter(
+                requests_per_period=5000 * len(tokens), period=3600)
+            self.limiters["graphql"] = RateLimiter(
+                requests_per_period=5000 * len(tokens), period=3600)
+        self.progress = progress.ProgressTracker(limiters=self.limiters)
+        self.session = requests.Session()
+        retry = Retry(total=3, backoff_factor=0.5)
+        adapter = BudgetAdapter(limiters=self.limiters,
+                                on_request=self.progress.add_request,
+                                max_retries=retry,
+                                pool_connections=pool_size,
+                                pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def close(self):
+        """
+        Stops the progress tracker and closes the connection pool.
+        """
+        self.progress.stop()
+        self.session.close()
@@ -0,0 +1,218 @@
+"""
+Git Backend
+
+Author: Jacqueline Schmatz
+Description: Mines commits, single commits and branches from local
+blobless bare clones instead of the REST API.
+"""
+
+import logging
+import os
+import subprocess
+import threading
+from datetime import date
+from typing import Any, Dict, List, Tuple
+import mdi_thesis.base.utils as utils
+
+# Separators of commits and fields in the git log output
+RECORD_SEPARATOR = "\x1e"
+FIELD_SEPARATOR = "\x1f"
+LOG_FORMAT = (RECORD_SEPARATOR +
+              FIELD_SEPARATOR.join(["%H", "%an", "%ae", "%aI",
+                                    "%cn", "%ce", "%cI", "%B"]) +
+              FIELD_SEPARATOR)
+BRANCH_FORMAT = FIELD_SEPARATOR.join([
+    "%(refname:short)", "%(objectname)",
+    "%(authorname)", "%(authoremail)", "%(authordate:iso-strict)",
+    "%(committername)", "%(committeremail)", "%(committerdate:iso-strict)"])
+
+
+class GitBackend:
+    """
+    Keeps a blobless bare clone per repository, which is updated
+    incrementally, and converts the local history to the json
+    formats of the REST API.
+    """
+    def __init__(self, clone_path: str, logger: logging.Logger) -> None:
+        """
+        :param clone_path: Directory of the clones
+        :param logger: Logger of the pipeline
+        """
+        self.clone_path = clone_path
+        self.logger = logger
+        self.updated = set()  # type: set[str]
+        self.repo_locks = {}  # type: dict[str, threading.Lock]
+        self.lock = threading.Lock()
+
+    def run(self, path: str, args: List[str]) -> str:
+        """
+        Runs a git command.
+        :param path: Git directory
+        :param args: Arguments of the git command
+        :return: Output of the command
+        """
+        result = subprocess.run(
+            ["git", "-C", path, "-c", "core.quotePath=false"] + args,
+            capture_output=True, check=True,
+            encoding="utf-8", errors="replace")
+        return result.stdout
+
+    def update(self, repo_id: Any, url: str) -> str:
+        """
+        Clones a repository without blobs or fetches its new commits,
+        once per backend.
+        :param repo_id: Repository id, name of the clone
+        :param url: Clone url or path of a local repository
+        :return: Path of the clone
+        """
+        path = os.path.join(self.clone_path, str(repo_id) + ".git")
+        with self.lock:
+            repo_lock = self.repo_locks.setdefault(path, threading.Lock())
+        with repo_lock:
+            if path in self.updated:
+                return path
+            if os.path.exists(path):
+                self.logger.info("Fetching %s", url)
+                self.run(path, ["fetch", "--prune", "--filter=blob:none",
+                                "origin",
+                                "+refs/heads/*:refs/heads/*"])
+            else:
+                self.logger.info("Cloning %s", url)
+                os.makedirs(self.clone_path, exist_ok=True)
+                subprocess.run(["git", "clone", "--bare", "--quiet",
+                                "--filter=blob:none", url, path],
+                               capture_output=True, check=True)
+            self.updated.add(path)
+        return path
+
+    def get_log(self, path: str, since: str,
+                numstat: bool) -> List[Dict[str, Any]]:
+        """
+        Gets the commits of the default branch since a date.
+        :param path: Path of the clone
+        :param since: Date in the format %Y-%m-%dT%H:%M:%SZ
+        :param numstat: True to get the changed lines per file
+        :return: Commits with their fields and files
+        """
+        args = ["log", "--no-renames", "--since=" + since,
+                "--format=" + LOG_FORMAT]
+        if numstat:
+            args.append("--numstat")
+        commits = []
+        for record in self.run(path, args).split(RECORD_SEPARATOR)[1:]:
+            fields = record.split(FIELD_SEPARATOR)
+            files = []
+            for line in fields[8].strip().splitlines():
+                parts = line.split("\t", 2)
+                if len(parts) != 3:
+                    continue
+                # Binary files have no line counts
+                additions = int(parts[0]) if parts[0].isdigit() else 0
+                deletions = int(parts[1]) if parts[1].isdigit() else 0
+                files.append({"filename": parts[2],
+                              "additions": additions,
+                              "deletions": deletions,
+                              "changes": additions + deletions})
+            commits.append({
+                "sha": fields[0],
+                "commit": {
+                    "author": {
+                        "name": fields[1],
+                        "email": fields[2],
+                        "date": utils.to_api_timestamp(fields[3])},
+                    "committer": {
+                        "name": fields[4],
+                        "email": fields[5],
+                        "date": utils.to_api_timestamp(fields[6])},
+                    "message": fields[7].strip(),
+                    "verification": {"verified": False}},
+                "files": files})
+        return commits
+
+    def get_commits(self, path: str, since: str) -> List[Dict[str, Any]]:
+        """
+        Gets the commits in the format of the commits of the REST API.
+        Without GitHub accounts, the committer id is the committer email.
+        :param path: Path of the clone
+        :param since: Date in the format %Y-%m-%dT%H:%M:%SZ
+        :return: Commits with sha, commit and committer
+        """
+        return [{"sha": commit["sha"],
+                 "commit": commit["commit"],
+                 "committer": {
+                     "id": commit["commit"]["committer"]["email"],
+                     "login": None}}
+                for commit in self.get_log(path, since, numstat=False)]
+
+    def get_single_commits(self, path: str, since: str
+                           ) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Gets the commits with their stats and files in the format of
+        the single commits of the REST API.
+        :param path: Path of the clone
+        :param since: Date in the format %Y-%m-%dT%H:%M:%SZ
+        :return: Commit per sha
+        """
+        single_commits = {}
+        for commit in self.get_log(path, since, numstat=True):
+            additions = sum(file["additions"] for file in commit["files"])
+            deletions = sum(file["deletions"] for file in commit["files"])
+            single_commits[commit["sha"]] = [{
+                "stats": {"total": additions + deletions,
+                          "additions": additions,
+                          "deletions": deletions},
+                "commit": commit["commit"],
+                "files": commit["files"]}]
+        return single_commits
+
+    def get_branches(self, path: str, stale_date: date
+                     ) -> Tuple[Dict[str, str], Dict[str, str],
+                                Dict[str, List[Dict[str, Any]]]]:
+        """
+        Gets the branches with their head commit. Branches without
+        commits since the stale date are stale, the others are active.
+        Without pull requests, branches merged into the default branch
+        are Merged and the others Compare.
+        :param path: Path of the clone
+        :param stale_date: Start of the active period
+        :return: Stale and active branches with their state and
+        the branches with their head commit.
+        """
+        default_branch = self.run(
+            path, ["symbolic-ref", "--short", "HEAD"]).strip()
+        merged = set(self.run(
+            path, ["for-each-ref", "--merged=HEAD",
+                   "--format=%(refname:short)", "refs/heads"]).splitlines())
+        stale_branches = {}
+        active_branches = {}
+        branches = {}
+        for line in self.run(path, ["for-each-ref",
+                                    "--format=" + BRANCH_FORMAT,
+                                    "refs/heads"]).splitlines():
+            fields = line.split(FIELD_SEPARATOR)
+            if len(fields) != 8:
+                continue
+            branch_name = fields[0]
+            author_date = utils.to_api_timestamp(fields[4])
+            branches[branch_name] = [{"commit": {
+                "sha": fields[1],
+                "commit": {
+                    "author": {
+                        "name": fields[2],
+                        "email": fields[3].strip("<>"),
+                        "date": author_date},
+                    "committer": {
+                        "name": fields[5],
+                        "email": fields[6].strip("<>"),
+                        "date": utils.to_api_timestamp(fields[7])}}}}]
+            if branch_name == default_branch:
+                branch_state = ""
+            elif branch_name in merged:
+                branch_state = "Merged"
+            else:
+                branch_state = "Compare"
+            if author_date and author_date[:10] >= stale_date.isoformat():
+                active_branches[branch_name] = branch_state
+            else:
+                stale_branches[branch_name] = branch_state
+        return stale_branches, active_branches, branches
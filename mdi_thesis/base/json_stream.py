@@ -0,0 +1,235 @@
+"""
+Json Stream
+
+Author: Jacqueline Schmatz
+Description: Reads the top-level object of large json files (e.g. the
+outputs of the data miner) repository by repository from a memory map,
+without loading the whole file. A sidecar index ({file}.json.idx) with
+the position of each member allows to read single repositories, e.g.
+via JsonMembers, a read-only mapping over the members of a file.
+"""
+
+import json
+import mmap
+import os
+import re
+from collections.abc import ItemsView, Mapping
+from typing import Any, Dict, Iterator, List, Tuple, Union
+import mdi_thesis.base.serializer as serializer
+
+# Json strings and whitespace between the members
+STRING = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"', re.S)
+WHITESPACE = re.compile(rb'[ \t\n\r]*')
+VALUE_ENDS = {" ", "\t", "\n", "\r", ",", "}"}
+# Bytes decoded at first for a value, doubled until the value is complete
+CHUNK_SIZE = 65536
+INDEX_SUFFIX = ".idx"
+
+DECODER = json.JSONDecoder()
+
+
+def decode_value(buffer: Any, start: int) -> Tuple[Any, int]:
+    """
+    Decodes the json value starting at start. Growing chunks of the
+    buffer are decoded until the value is complete.
+    :param buffer: Bytes or memory map of a json file
+    :param start: Start of the value
+    :return: Decoded value and position after the value
+    """
+    size = CHUNK_SIZE
+    while True:
+        chunk_end = min(start + size, len(buffer))
+        # A character cut at the chunk end is after the value
+        text = buffer[start:chunk_end].decode("utf-8", errors="ignore")
+        try:
+            value, end = DECODER.raw_decode(text)
+            # A member ends before whitespace, a comma or a bracket,
+            # otherwise (e.g. a cut number) it continues after the chunk
+            if text[end:end + 1] in VALUE_ENDS or chunk_end == len(buffer):
+                return value, start + len(text[:end].encode("utf-8"))
+        except json.JSONDecodeError:
+            if chunk_end == len(buffer):
+                raise
+        size *= 2
+
+
+def iter_members(buffer: Any) -> Iterator[Tuple[str, Any, int, int]]:
+    """
+    Decodes the members of the top-level json object one by one.
+    :param buffer: Bytes or memory map of a json file
+    :return: Key, decoded value, start and end of the value per member
+    """
+    pos = WHITESPACE.match(buffer, 0).end()
+    if buffer[pos:pos + 1] != b"{":
+        raise ValueError("No json object at " + str(pos))
+    pos = WHITESPACE.match(buffer, pos + 1).end()
+    if buffer[pos:pos + 1] == b"}":
+        return
+    while True:
+        key_match = STRING.match(buffer, pos)
+        if key_match is None:
+            raise ValueError("No key at " + str(pos))
+        key = json.loads(key_match.group())
+        pos = WHITESPACE.match(buffer, key_match.end()).end()
+        if buffer[pos:pos + 1] != b":":
+            raise ValueError("No colon at " + str(pos))
+        start = WHITESPACE.match(buffer, pos + 1).end()
+        value, end = decode_value(buffer, start)
+        yield key, value, start, end
+        pos = WHITESPACE.match(buffer, end).end()
+        separator = buffer[pos:pos + 1]
+        if separator == b"}":
+            return
+        if separator != b",":
+            raise ValueError("No comma at " + str(pos))
+        pos = WHITESPACE.match(buffer, pos + 1).end()
+
+
+def iter_items(path: str) -> Iterator[Tuple[str, Any]]:
+    """
+    Reads the members of the top-level json object one by one,
+    e.g. the data per repository of a data miner output. Only the
+    current member is decoded, the file is read via a memory map.
+    :param path: Path to json file
+    :return: Key and decoded value per member
+    """
+    with open(path, "rb") as json_file:
+        if os.fstat(json_file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(json_file.fileno(), 0,
+                       access=mmap.ACCESS_READ) as buffer:
+            for key, value, _, _ in iter_members(buffer):
+                yield key, value
+
+
+def write_index(path: str, members: Dict[str, List[int]]):
+    """
+    Writes the sidecar index of a json file. Size and modification time
+    of the file are stored to detect changes of the file.
+    :param path: Path to json file
+    :param members: Offset and length of the value per key,
+    e.g. of serializer.dump
+    """
+    stat = os.stat(path)
+    index = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+             "members": members}
+    with open(path + INDEX_SUFFIX, "wb") as index_file:
+        index_file.write(serializer.dumps(index))
+
+
+def build_index(path: str) -> Dict[str, List[int]]:
+    """
+    Indexes the members of an existing json file and writes the
+    sidecar index, if the directory is writable.
+    :param path: Path to json file
+    :return: Offset and length of the value per key
+    """
+    members = {}  # type: dict[str, list[int]]
+    with open(path, "rb") as json_file:
+        if os.fstat(json_file.fileno()).st_size > 0:
+            with mmap.mmap(json_file.fileno(), 0,
+                           access=mmap.ACCESS_READ) as buffer:
+                for key, _, start, end in iter_members(buffer):
+                    members[key] = [start, end - start]
+    try:
+        write_index(path=path, members=members)
+    except OSError:
+        pass
+    return members
+
+
+def read_index(path: str) -> Union[Dict[str, List[int]], None]:
+    """
+    Reads the sidecar index of a json file.
+    :param path: Path to json file
+    :return: Offset and length of the value per key, None if there is
+    no index or the file changed after indexing.
+    """
+    if not os.path.exists(path + INDEX_SUFFIX):
+        return None
+    index = serializer.load(path + INDEX_SUFFIX)
+    stat = os.stat(path)
+    if (index.get("size") != stat.st_size or
+            index.get("mtime_ns") != stat.st_mtime_ns):
+        return None
+    return index.get("members")
+
+
+def get_items(path: str, keys: List[Any]) -> Dict[str, Any]:
+    """
+    Reads the members of the given keys (e.g. repository ids) of a json
+    file. Only their values are decoded, at the positions of the index.
+    A missing or outdated index is rebuilt first.
+    :param path: Path to json file
+    :param keys: Keys of the members
+    :return: Decoded value per key, keys without member are left out
+    """
+    members = read_index(path)
+    if members is None:
+        members = build_index(path)
+    found = [serializer.json_key(key) for key in keys
+             if serializer.json_key(key) in members]
+    items = {}  # type: dict[str, Any]
+    if not found:
+        return items
+    with open(path, "rb") as json_file:
+        with mmap.mmap(json_file.fileno(), 0,
+                       access=mmap.ACCESS_READ) as buffer:
+            for key in found:
+                start, length = members[key]
+                items[key] = serializer.loads(
+                    buffer[start:start + length])
+    return items
+
+
+def get_item(path: str, key: Any) -> Any:
+    """
+    Reads the member of one key (e.g. repository id) of a json file,
+    see get_items.
+    :param path: Path to json file
+    :param key: Key of the member
+    :return: Decoded value, None if there is no member of the key
+    """
+    return get_items(path=path, keys=[key]).get(serializer.json_key(key))
+
+
+class StreamedItems(ItemsView):
+    """
+    Items of JsonMembers, iterated in the order of the file.
+    """
+
+    def __iter__(self) -> Iterator[Tuple[str, Any]]:
+        return iter_items(path=self._mapping.path)
+
+
+class JsonMembers(Mapping):
+    """
+    Read-only mapping over the members of the top-level object of a json
+    file. Only the index is kept in memory, a value is decoded on each
+    access and items are read one by one (see iter_items).
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: Path to json file, a missing or outdated index
+        is rebuilt first.
+        """
+        self.path = path
+        self.members = read_index(path)
+        if self.members is None:
+            self.members = build_index(path)
+
+    def __getitem__(self, key: str) -> Any:
+        start, length = self.members[key]
+        with open(self.path, "rb") as json_file:
+            json_file.seek(start)
+            return serializer.loads(json_file.read(length))
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.members)
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    def items(self) -> StreamedItems:
+        return StreamedItems(self)
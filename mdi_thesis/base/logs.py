@@ -0,0 +1,173 @@
+"""
+Logging
+
+Author: Jacqueline Schmatz
+Description: Asynchronous logging via a queue with a background writer,
+per module log levels and rate limiting of debug messages.
+"""
+
+import atexit
+import copy
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+from pathlib import Path
+from typing import Dict, Union
+
+LOG_FORMAT = ("%(asctime)s - %(levelname)s " +
+              "- line: " +
+              "%(lineno)s - %(funcName)s - " +
+              "%(module)s - %(message)s")
+
+# Default level of loggers without own level in LOG_LEVELS
+DEFAULT_LEVEL = "DEBUG"
+# Formats the tracebacks of records before they are queued
+EXCEPTION_FORMATTER = logging.Formatter()
+
+
+class RecordQueueHandler(QueueHandler):
+    """
+    Puts records on the queue with their message merged, the log format
+    is applied and the records are written in the listener thread.
+    Only for queues between threads of the same process.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The arguments (e.g. dictionaries) may change before the
+        # listener writes the record, so the message is merged here
+        record = copy.copy(record)
+        message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = EXCEPTION_FORMATTER.formatException(
+                record.exc_info)
+        if record.exc_text:
+            message += "\n" + record.exc_text
+        record.msg = message
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        return record
+
+
+class DebugRateFilter(logging.Filter):
+    """
+    Passes at most burst debug records per call site and interval,
+    further debug records of the call site are dropped and counted.
+    Records of level INFO and above always pass.
+    """
+    def __init__(self, burst: int = 20, interval: float = 10) -> None:
+        """
+        :param burst: Debug records per call site and interval
+        :param interval: Interval in seconds
+        """
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.call_sites = {}  # type: dict[tuple[str, int], list]
+        self.suppressed = 0
+        self.lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+        now = time.monotonic()
+        call_site = (record.pathname, record.lineno)
+        with self.lock:
+            window = self.call_sites.get(call_site)
+            if window is None or now - window[0] >= self.interval:
+                self.call_sites[call_site] = [now, 1]
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            self.suppressed += 1
+            return False
+
+
+class LogQueue:
+    """
+    Queue handler shared by all loggers and the listener,
+    which writes the records to the console and the log file.
+    """
+    def __init__(self, log_dir: str,
+                 log_levels: Union[Dict[str, str], None] = None) -> None:
+        """
+        :param log_dir: Directory of the log file
+        :param log_levels: Log level per logger name (e.g. module)
+        """
+        self.log_levels = log_levels or {}
+        formatter = logging.Formatter(LOG_FORMAT)
+        console = logging.StreamHandler()
+        console.setFormatter(formatter)
+        file_name = datetime.now().strftime('logger_%Y%m%d_%H_%M')
+        file_handler = logging.FileHandler(
+            os.path.join(log_dir, file_name + ".log"))
+        file_handler.setFormatter(formatter)
+        self.queue = queue.SimpleQueue()  # type: queue.SimpleQueue
+        self.handler = RecordQueueHandler(self.queue)
+        self.rate_filter = DebugRateFilter()
+        self.handler.addFilter(self.rate_filter)
+        self.listener = QueueListener(self.queue, console, file_handler)
+        self.listener.start()
+        self.running = True
+        atexit.register(self.stop)
+
+    def stop(self):
+        """
+        Writes the remaining records and stops the listener.
+        """
+        if self.running:
+            self.running = False
+            self.listener.stop()
+
+    def attach(self, logger: logging.Logger):
+        """
+        Adds the queue handler and the configured level to a logger.
+        :param logger: Logger
+        """
+        logger.addHandler(self.handler)
+        logger.setLevel(self.level_of(logger.name))
+
+    def level_of(self, name: str) -> str:
+        """
+        Gets the configured level of a logger, a level configured
+        for a package applies to its modules.
+        :param name: Logger name, e.g. mdi_thesis.base.base
+        :return: Log level name
+        """
+        parts = name.split(".")
+        for end in range(len(parts), 0, -1):
+            level = self.log_levels.get(".".join(parts[:end]))
+            if level:
+                return level
+        return self.log_levels.get("", DEFAULT_LEVEL)
+
+
+LOG_QUEUE = None  # type: Union[LogQueue, None]
+LOG_QUEUE_LOCK = threading.Lock()
+
+
+def get_logger(name: str,
+               log_levels: Union[Dict[str, str], None] = None
+               ) -> logging.Logger:
+    """
+    Gets a logger writing via the shared log queue.
+    The queue is set up by the first call.
+    :param name: Logger name
+    :param log_levels: Log level per logger name, used by the first call
+    :return: Logger
+    """
+    global LOG_QUEUE
+    logger = logging.getLogger(name)
+    with LOG_QUEUE_LOCK:
+        if LOG_QUEUE is None:
+            log_dir = os.path.join(
+                Path(os.path.dirname(__file__)).parents[1],
+                "outputs", "logs")
+            LOG_QUEUE = LogQueue(log_dir=log_dir, log_levels=log_levels)
+        if LOG_QUEUE.handler not in logger.handlers:
+            LOG_QUEUE.attach(logger)
+    return logger
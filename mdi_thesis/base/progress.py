@@ -0,0 +1,199 @@
+"""
+Progress Tracker
+
+Author: Jacqueline Schmatz
+Description: Tracks the progress of mining runs and writes
+throughput, limiter idle time and ETA to a status file.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Union
+
+
+class ProgressTracker:
+    """
+    Thread safe counter of completed units, requests and objects.
+    A unit is one repository passing one stage of a language.
+    """
+    def __init__(self, limiters: Dict[str, Any], window: float = 600) -> None:
+        """
+        :param limiters: Rate limiters (budget.RateLimiter) per resource
+        class, their waiting time is reported as idle time.
+        :param window: Seconds of the window for rates per minute
+        """
+        self.limiters = limiters
+        self.window = window
+        self.started = time.monotonic()
+        self.units = {}  # type: Dict[str, Dict[str, Dict[str, int]]]
+        self.requests = {}  # type: Dict[str, int]
+        self.objects = 0
+        self.request_times = deque()  # type: deque
+        self.object_times = deque()  # type: deque
+        self.lock = threading.Lock()
+        self.status_path = ""
+        self.interval = 60.0
+        self.stop_event = threading.Event()
+        self.writer = None  # type: Union[threading.Thread, None]
+
+    def plan(self, language: str, stages: List[str], units: int):
+        """
+        Sets the number of units of each stage of a language.
+        :param language: Programming language of the pipeline
+        :param stages: Stage names
+        :param units: Units per stage, e.g. selected repositories
+        """
+        with self.lock:
+            language_units = self.units.setdefault(language, {})
+            for stage in stages:
+                language_units[stage] = {"done": 0, "total": units}
+
+    def complete(self, language: str, stage: str,
+                 units: Union[int, None] = None):
+        """
+        Marks units of a stage as completed.
+        :param language: Programming language of the pipeline
+        :param stage: Stage name
+        :param units: Completed units, None if the whole stage finished
+        """
+        with self.lock:
+            stage_units = self.units.setdefault(language, {}).setdefault(
+                stage, {"done": 0, "total": 0})
+            if units is None:
+                stage_units["done"] = stage_units["total"]
+            else:
+                stage_units["done"] += units
+
+    def add_request(self, resource: str):
+        """
+        :param resource: Resource class of the sent request
+        """
+        now = time.monotonic()
+        with self.lock:
+            self.requests[resource] = self.requests.get(resource, 0) + 1
+            self.request_times.append(now)
+            self.trim(self.request_times, now)
+
+    def add_objects(self, number: int):
+        """
+        :param number: Number of received objects (e.g. commits)
+        """
+        now = time.monotonic()
+        with self.lock:
+            self.objects += number
+            self.object_times.append((now, number))
+            self.trim(self.object_times, now)
+
+    def trim(self, times: deque, now: float):
+        """
+        Removes entries older than the window.
+        """
+        while times:
+            entry = times[0]
+            timestamp = entry[0] if isinstance(entry, tuple) else entry
+            if now - timestamp <= self.window:
+                break
+            times.popleft()
+
+    def status(self) -> Dict[str, Any]:
+        """
+        :return: Current progress, throughput and ETA
+        """
+        now = time.monotonic()
+        with self.lock:
+            self.trim(self.request_times, now)
+            self.trim(self.object_times, now)
+            elapsed = now - self.started
+            minutes = min(elapsed, self.window) / 60 or 1
+            requests_per_minute = len(self.request_times) / minutes
+            objects_per_minute = sum(
+                number for _, number in self.object_times) / minutes
+            total_requests = sum(self.requests.values())
+            done = sum(stage["done"] for stages in self.units.values()
+                       for stage in stages.values())
+            total = sum(stage["total"] for stages in self.units.values()
+                        for stage in stages.values())
+            units = json.loads(json.dumps(self.units))
+            requests = dict(self.requests)
+            objects = self.objects
+        idle = {resource: round(limiter.waited_seconds, 1)
+                for resource, limiter in self.limiters.items() if limiter}
+        eta_seconds = None
+        if done and requests_per_minute:
+            # Remaining requests at the requests per unit so far
+            remaining_requests = (max(total - done, 0) *
+                                  total_requests / done)
+            eta_seconds = round(remaining_requests /
+                                requests_per_minute * 60)
+        eta = None
+        if eta_seconds is not None:
+            eta = (datetime.now() +
+                   timedelta(seconds=eta_seconds)).isoformat(
+                       timespec="seconds")
+        return {
+            "updated_at": datetime.now().isoformat(timespec="seconds"),
+            "elapsed_seconds": round(elapsed),
+            "units": units,
+            "units_done": done,
+            "units_total": total,
+            "requests": requests,
+            "requests_per_minute": round(requests_per_minute, 1),
+            "objects": objects,
+            "objects_per_minute": round(objects_per_minute, 1),
+            "limiter_idle_seconds": idle,
+            "eta_seconds": eta_seconds,
+            "eta": eta
+        }
+
+    def write_status(self):
+        """
+        Writes the status file, replacing it at once,
+        so readers never see a partly written file.
+        """
+        if not self.status_path:
+            return
+        temp_path = self.status_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as outfile:
+            json.dump(self.status(), outfile, indent=4)
+        os.replace(temp_path, self.status_path)
+
+    def start(self, status_path: str, interval: float = 60):
+        """
+        Starts writing the status file periodically.
+        Further calls while running are ignored, so pipelines
+        sharing the tracker can all call start.
+        :param status_path: Path of the status file
+        :param interval: Seconds between writes
+        """
+        with self.lock:
+            if self.writer:
+                return
+            self.status_path = status_path
+            self.interval = interval
+            self.stop_event.clear()
+            self.writer = threading.Thread(target=self.run_writer,
+                                           name="progress", daemon=True)
+            self.writer.start()
+
+    def run_writer(self):
+        """
+        Writes the status file until stop is called.
+        """
+        while not self.stop_event.wait(self.interval):
+            self.write_status()
+
+    def stop(self):
+        """
+        Stops the periodic writes and writes the final status.
+        """
+        with self.lock:
+            writer = self.writer
+            self.writer = None
+        if writer:
+            self.stop_event.set()
+            writer.join()
+            self.write_status()
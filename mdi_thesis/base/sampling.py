@@ -0,0 +1,184 @@
+"""
+Object Sampling
+
+Author: Jacqueline Schmatz
+Description: Sampling policies selecting the objects of a repository
+(e.g. commits, issues) for which subfeatures are queried.
+"""
+
+import math
+import random
+from typing import Any, Dict, List
+import mdi_thesis.base.utils as utils
+
+POLICIES = ["first", "fixed", "stratified", "adaptive"]
+
+
+def get_object_weight(subfeatures: Dict[Any, List[Dict[str, Any]]]
+                      ) -> float:
+    """
+    Size of the queried subfeatures of an object, used as target value
+    of the adaptive policy: changed lines of a commit,
+    otherwise the number of subfeatures (e.g. comments).
+    :param subfeatures: Subfeatures per object id
+    :return: Weight of the object
+    """
+    weight = 0
+    for rows in subfeatures.values():
+        for row in rows:
+            stats = row.get("stats") if isinstance(row, dict) else None
+            if isinstance(stats, dict):
+                weight += stats.get("total") or 0
+            else:
+                weight += 1
+    return weight
+
+
+class ObjectSampler:
+    """
+    Selects the objects of one repository, for which
+    the subfeatures are queried.
+    policy "first": The first objects in API order.
+    policy "fixed": A random sample of a fixed size.
+    policy "stratified": A random sample spread over equal time
+    strata of the queried window, in proportion to their objects.
+    policy "adaptive": A random pilot sample, extended until the
+    relative error of the mean object weight is within the target.
+    """
+    def __init__(self, objects: List[Dict[str, Any]], policy: str = "first",
+                 sample_size: int = 100, date_key: str = "",
+                 strata: int = 4, pilot_size: int = 20,
+                 relative_error: float = 0.1, seed: Any = None) -> None:
+        """
+        :param objects: Objects of the repository
+        :param policy: Sampling policy, see POLICIES
+        :param sample_size: Objects per repository, the maximum
+        for the adaptive policy.
+        :param date_key: Date of the objects for the stratified policy
+        :param strata: Number of time strata
+        :param pilot_size: Size of the pilot sample of the adaptive policy
+        :param relative_error: Targeted relative standard error of the
+        mean object weight for the adaptive policy.
+        :param seed: Seed for reproducible samples, e.g. the repository id
+        """
+        if policy not in POLICIES:
+            raise ValueError("Unknown sampling policy: " + str(policy))
+        self.objects = objects
+        self.policy = policy
+        self.sample_size = min(sample_size, len(objects))
+        self.date_key = date_key
+        self.strata = strata
+        self.pilot_size = pilot_size
+        self.relative_error = relative_error
+        self.random = random.Random(seed)
+        self.order = []  # type: List[int]
+        self.selected = []  # type: List[int]
+        self.weights = []  # type: List[float]
+
+    def first_batch(self) -> List[int]:
+        """
+        :return: Indices of the objects to be queried first
+        """
+        if self.policy == "first":
+            batch = list(range(self.sample_size))
+        elif self.policy == "stratified":
+            batch = self.stratified_indices()
+        else:
+            self.order = self.random.sample(range(len(self.objects)),
+                                            self.sample_size)
+            if self.policy == "adaptive":
+                batch = self.order[:min(self.pilot_size, self.sample_size)]
+            else:
+                batch = self.order
+        self.selected.extend(batch)
+        return batch
+
+    def next_batch(self) -> List[int]:
+        """
+        Adaptive policy: extends the sample to the size required by the
+        spread of the weights seen so far.
+        :return: Indices of further objects, empty if the sample suffices
+        """
+        if self.policy != "adaptive" or len(self.weights) < 2:
+            return []
+        required = self.required_size()
+        batch = self.order[len(self.selected):required]
+        self.selected.extend(batch)
+        return batch
+
+    def add_weight(self, weight: float):
+        """
+        :param weight: Weight of a queried object
+        """
+        self.weights.append(weight)
+
+    def truncate(self):
+        """
+        Drops the selected objects, which were not queried,
+        e.g. after the deadline of the repository.
+        """
+        self.selected = self.selected[:len(self.weights)]
+
+    def required_size(self) -> int:
+        """
+        Sample size for the targeted relative standard error,
+        based on the coefficient of variation of the weights.
+        :return: Required sample size, at most sample_size
+        """
+        mean = sum(self.weights) / len(self.weights)
+        if mean == 0:
+            return len(self.selected)
+        variance = (sum((weight - mean) ** 2 for weight in self.weights) /
+                    (len(self.weights) - 1))
+        variation = math.sqrt(variance) / mean
+        required = math.ceil((variation / self.relative_error) ** 2)
+        return max(len(self.selected), min(required, self.sample_size))
+
+    def stratified_indices(self) -> List[int]:
+        """
+        Splits the time window of the objects in equal strata and
+        draws randomly from each stratum in proportion to its size.
+        Objects without date form a stratum of their own.
+        :return: Indices of the sampled objects
+        """
+        dates = [utils.get_object_date(obj, self.date_key)
+                 for obj in self.objects]
+        known = [obj_date for obj_date in dates if obj_date]
+        strata = {}  # type: Dict[int, List[int]]
+        if known:
+            start = min(known)
+            span = (max(known) - start).total_seconds() or 1
+            for index, obj_date in enumerate(dates):
+                stratum = -1
+                if obj_date:
+                    stratum = min(int((obj_date - start).total_seconds() /
+                                      span * self.strata), self.strata - 1)
+                strata.setdefault(stratum, []).append(index)
+        else:
+            strata[-1] = list(range(len(self.objects)))
+        sample = []
+        remainders = []
+        for stratum, indices in strata.items():
+            share = self.sample_size * len(indices) / len(self.objects)
+            sample.extend(self.random.sample(indices, int(share)))
+            remainders.append((share - int(share), stratum))
+        # Largest remainders get the objects left after rounding down
+        remainders.sort(reverse=True)
+        for _, stratum in remainders[:self.sample_size - len(sample)]:
+            left = [index for index in strata[stratum]
+                    if index not in sample]
+            sample.append(self.random.choice(left))
+        return sorted(sample)
+
+    def record(self, object_key: str) -> Dict[str, Any]:
+        """
+        :param object_key: Key identifying the objects (e.g. sha)
+        :return: Policy, population and sampled object ids
+        """
+        return {
+            "policy": self.policy,
+            "population": len(self.objects),
+            "sample_size": len(self.selected),
+            "sampled": [self.objects[index].get(object_key)
+                        for index in self.selected]
+        }
@@ -0,0 +1,107 @@
+"""
+Stage Scheduler
+
+Author: Jacqueline Schmatz
+Description: Runs data collection stages concurrently,
+if they do not compete for the same rate limit.
+"""
+
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, List, Union
+
+
+class Stage:
+    """
+    Data collection stage with the resource classes it uses
+    and the stages which have to be finished before.
+    """
+    def __init__(self, function: Callable, resources: List[str],
+                 depends_on: Union[List[str], None] = None) -> None:
+        """
+        :param function: Function collecting the data of the stage
+        :param resources: Resource classes (e.g. api, web) used by the stage,
+        stages sharing a resource class do not run at the same time.
+        :param depends_on: Names of stages which have to be finished first
+        """
+        self.function = function
+        self.name = function.__name__
+        self.resources = resources
+        self.depends_on = depends_on or []
+
+
+class StageScheduler:
+    """
+    Runs stages as soon as their dependencies are finished and
+    their resource classes are not used by a running stage.
+    """
+    def __init__(self, stages: List[Stage], logger: logging.Logger,
+                 concurrent: bool = True, stage_pause: float = 240,
+                 on_finished: Union[Callable[[Stage], None], None] = None
+                 ) -> None:
+        """
+        :param stages: Stages in their preferred order
+        :param logger: Logger of the pipeline
+        :param concurrent: False to run one stage after the other
+        :param stage_pause: Seconds a resource class idles after a stage
+        :param on_finished: Called with each successfully finished stage
+        """
+        self.stages = stages
+        self.logger = logger
+        self.concurrent = concurrent
+        self.stage_pause = stage_pause
+        self.on_finished = on_finished
+
+    def run_stage(self, stage: Stage):
+        """
+        Runs a single stage and pauses its resource classes afterwards.
+        :param stage: Stage to be run
+        """
+        self.logger.info("Starting function %s", stage.name)
+        try:
+            stage.function()
+        except Exception as error:
+            self.logger.error(
+                "Error at function %s:%s", stage.name, error)
+            raise
+        self.logger.info("Finished function %s successfully", stage.name)
+        if self.on_finished:
+            self.on_finished(stage)
+        time.sleep(self.stage_pause)
+
+    def run(self):
+        """
+        Runs all stages.
+        """
+        pending = list(self.stages)
+        finished = set()
+        running = {}
+        busy_resources = set()
+        max_workers = len({resource for stage in self.stages
+                           for resource in stage.resources}) or 1
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while pending or running:
+                for stage in list(pending):
+                    if not self.concurrent and running:
+                        break
+                    dependencies_done = all(dependency in finished
+                                            for dependency in
+                                            stage.depends_on)
+                    resources_free = busy_resources.isdisjoint(
+                        stage.resources)
+                    if dependencies_done and resources_free:
+                        pending.remove(stage)
+                        busy_resources.update(stage.resources)
+                        future = executor.submit(self.run_stage, stage)
+                        running[future] = stage
+                if not running:
+                    raise ValueError(
+                        "Unresolvable stage dependencies: " +
+                        ", ".join(stage.name for stage in pending))
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    future.result()
+                    finished.add(stage.name)
+                    busy_resources.difference_update(stage.resources)
@@ -0,0 +1,122 @@
+"""
+Json Serializer
+
+Author: Jacqueline Schmatz
+Description: Serializes and parses json with orjson, if it is installed,
+otherwise with the json module. Both backends write numpy scalars and
+arrays and read the files written by each other.
+"""
+
+import json
+from typing import IO, Any, Dict, List, Union
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = "json" if orjson is None else "orjson"
+# Spaces per level of pretty printed json (orjson only indents by 2)
+INDENT = 4 if orjson is None else 2
+if orjson is not None:
+    OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def to_builtin(obj: Any) -> Any:
+    """
+    Converts numpy scalars and arrays, which the backend
+    does not serialize itself.
+    :param obj: Object to be serialized
+    :return: Python scalar or list
+    """
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError("Object of type " + type(obj).__name__ +
+                    " is not JSON serializable")
+
+
+def json_key(key: Any) -> str:
+    """
+    :param key: Dictionary key
+    :return: Key as written to json, e.g. repository id as string
+    """
+    if isinstance(key, bool) or key is None:
+        return json.dumps(key)
+    return str(key)
+
+
+def dumps(data: Any, pretty: bool = False) -> bytes:
+    """
+    Serializes data to json.
+    :param data: Data to be serialized
+    :param pretty: True to indent the json, otherwise it is compact
+    :return: Json encoded in utf-8
+    """
+    if orjson is not None:
+        option = OPTIONS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=to_builtin, option=option)
+    if pretty:
+        text = json.dumps(data, indent=INDENT, default=to_builtin)
+    else:
+        text = json.dumps(data, separators=(",", ":"), default=to_builtin)
+    return text.encode("utf-8")
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    """
+    Parses json.
+    :param data: Json
+    :return: Parsed data
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # e.g. NaN written by the json module
+            pass
+    return json.loads(data)
+
+
+def dump(data: Any, file: IO[bytes],
+         pretty: bool = False) -> Dict[str, List[int]]:
+    """
+    Writes data to a binary file. Dictionaries are written member by
+    member, so only one serialized value is kept in memory.
+    :param data: Data to be written
+    :param file: File opened for writing bytes
+    :param pretty: True to indent the json, otherwise it is compact
+    :return: Offset and length of the value per key of a dictionary
+    """
+    members = {}  # type: dict[str, list[int]]
+    if not isinstance(data, dict) or not data:
+        file.write(dumps(data, pretty=pretty))
+        return members
+    newline = b"\n" + b" " * INDENT if pretty else b""
+    colon = b": " if pretty else b":"
+    position = file.write(b"{")
+    for number, (key, value) in enumerate(data.items()):
+        key = json_key(key)
+        head = (b"," if number else b"") + newline + dumps(key) + colon
+        position += file.write(head)
+        encoded = dumps(value, pretty=pretty)
+        if pretty:
+            # Nested lines are indented by one more level
+            encoded = encoded.replace(b"\n", newline)
+        members[key] = [position, len(encoded)]
+        position += file.write(encoded)
+    file.write(b"\n}" if pretty else b"}")
+    return members
+
+
+def load(path: str) -> Any:
+    """
+    :param path: Path to json file
+    :return: Parsed content of the file
+    """
+    with open(path, "rb") as json_file:
+        return loads(json_file.read())
@@ -2,18 +2,15 @@
 Module for helper functions for data collection,
 data cleaning and data storage.
 """
-import json
 import os
 import re
-import numpy as np
-from typing import Dict, List, Any, Union
-
-
-class npEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, np.int32):
-            return int(obj)
-        return json.JSONEncoder.default(self, obj)
+import sys
+import threading
+from datetime import datetime, timezone
+from urllib.parse import urlparse, parse_qs
+from typing import Dict, List, Any, Set, Union
+import mdi_thesis.base.json_stream as json_stream
+import mdi_thesis.base.serializer as serializer
 
 
 def __get_ids_from_txt__(path: str) -> List[int]:
@@ -47,7 +44,9 @@ def clean_results(
     :returns: dictionary with clean lists
     """
     dictionary_of_list = {}
-    key_list = ["id", "node_id", "name", "owner", "html_url"]
+    key_list = ["id", "node_id", "name", "owner", "html_url",
+                "pushed_at", "updated_at", "open_issues",
+                "archived", "stargazers_count"]
     item_counter = 0
     test_dict = {}
     for item in results:
@@ -133,17 +132,355 @@ def get_contributor_per_files(commit: Dict) -> Dict[str, set]:
     return file_committer
 
 
-def dict_to_json(data: Union[Dict, List], data_path: str, feature: str):
+def get_object_date(obj: Dict[str, Any],
+                    date_key: str) -> Union[datetime, None]:
+    """
+    Gets the date of an object.
+    :param obj: Object returned by the API
+    :param date_key: Key of the date, nested keys separated by dots
+    (e.g. commit.committer.date)
+    :return: Date of the object or None, if not available
+    """
+    value = obj
+    for key in date_key.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ')
+    except (TypeError, ValueError):
+        return None
+
+
+def trim_to_window(data: Dict[Any, Any], date_key: str,
+                   since: datetime) -> Dict[Any, Any]:
+    """
+    Removes objects older than the start of a window from data per
+    repository. The data of a repository is either a list of objects
+    or a dictionary with lists of objects (e.g. comments per issue),
+    empty lists are removed from the dictionary.
+    :param data: Data per repository
+    :param date_key: Date of the objects, see get_object_date
+    :param since: Start of the window
+    :return: Data per repository within the window
+    """
+    def in_window(obj):
+        obj_date = get_object_date(obj, date_key)
+        return obj_date is None or obj_date >= since
+
+    trimmed = {}
+    for repo, content in data.items():
+        if isinstance(content, list):
+            trimmed[repo] = [obj for obj in content if in_window(obj)]
+        elif isinstance(content, dict):
+            trimmed[repo] = {}
+            for key, objects in content.items():
+                if isinstance(objects, list):
+                    objects = [obj for obj in objects if in_window(obj)]
+                    if not objects:
+                        continue
+                trimmed[repo][key] = objects
+        else:
+            trimmed[repo] = content
+    return trimmed
+
+
+def trim_samples(records: Dict[Any, Dict[str, Any]],
+                 data: Dict[Any, Dict[str, Any]]) -> Dict[Any, Any]:
+    """
+    Restricts sample records (see sampling.ObjectSampler.record) to the
+    sampled objects left in the data, e.g. after trim_to_window.
+    The population is reduced by the removed sampled objects, removed
+    objects outside of the sample are not known.
+    :param records: Sample record per repository
+    :param data: Data per repository and object id
+    :return: Sample record per repository
+    """
+    trimmed = {}
+    for repo, record in records.items():
+        if not isinstance(record, dict):
+            trimmed[repo] = record
+            continue
+        objects = data.get(repo) or {}
+        sampled = [object_id for object_id in record.get("sampled") or []
+                   if object_id in objects]
+        removed = len(record.get("sampled") or []) - len(sampled)
+        trimmed[repo] = {
+            **record,
+            "population": max((record.get("population") or 0) - removed,
+                              len(sampled)),
+            "sample_size": len(sampled),
+            "sampled": sampled}
+    return trimmed
+
+
+def to_api_timestamp(timestamp: Union[str, None]) -> Union[str, None]:
+    """
+    Converts an ISO 8601 timestamp with offset, as returned by the
+    GraphQL API, to the UTC format of the REST API.
+    :param timestamp: Timestamp, e.g. 2023-08-23T10:00:00+02:00
+    :return: Timestamp in the format %Y-%m-%dT%H:%M:%SZ
+    """
+    if not timestamp:
+        return timestamp
+    parsed = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    if parsed.tzinfo:
+        parsed = parsed.astimezone(timezone.utc)
+    return parsed.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def get_page_number(url: str) -> int:
+    """
+    Gets the page number of a paginated API url.
+    :param url: Url with page parameter, e.g. of the last link
+    :return: Page number, 1 if the url has no page parameter
+    """
+    pages = parse_qs(urlparse(url).query).get("page")
+    if pages:
+        return int(pages[0])
+    return 1
+
+
+def get_sbom_packages(sbom: Dict) -> List[str]:
+    """
+    Extracts the dependency names from a SPDX SBOM returned by
+    GitHub's dependency graph API.
+    The package describing the repository itself is excluded and
+    the ecosystem prefix (e.g. npm:) is removed from the names.
+    :param sbom: SBOM object of the API response
+    :return: Sorted list with unique dependency names
+    """
+    described_ids = set(sbom.get("documentDescribes", []))
+    for relationship in sbom.get("relationships", []):
+        if relationship.get("relationshipType") == "DESCRIBES":
+            described_ids.add(relationship.get("relatedSpdxElement"))
+    dependencies = set()
+    for package in sbom.get("packages", []):
+        if package.get("SPDXID") in described_ids:
+            continue
+        name = package.get("name")
+        if name:
+            dependencies.add(name.split(":", 1)[-1])
+    return sorted(dependencies)
+
+
+def get_advisory_repository(advisory: Dict) -> Union[str, None]:
+    """
+    Gets the repository of an advisory from the global advisory database.
+    :param advisory: Advisory returned by the global advisory database
+    :return: Repository in the form owner/name (lowercase) or None,
+    if the advisory does not refer to a GitHub repository.
+    """
+    repo_advisory_url = advisory.get("repository_advisory_url")
+    if repo_advisory_url:
+        match = re.search(r"/repos/([^/]+/[^/]+)/security-advisories",
+                          repo_advisory_url)
+        if match:
+            return match.group(1).lower()
+    source_code_location = advisory.get("source_code_location")
+    if source_code_location:
+        match = re.search(r"github\.com/([^/]+/[^/#?]+)",
+                          source_code_location)
+        if match:
+            repo_name = match.group(1).lower()
+            if repo_name.endswith(".git"):
+                repo_name = repo_name[:-4]
+            return repo_name
+    return None
+
+
+def normalize_global_advisory(advisory: Dict,
+                              feature_list: List[str]) -> Dict[str, Any]:
+    """
+    Converts an advisory from the global advisory database to the
+    format of repository security advisories.
+    :param advisory: Advisory returned by the global advisory database
+    :param feature_list: Features which are kept
+    :return: Advisory with the features of a repository advisory
+    """
+    advisory = dict(advisory)
+    advisory.setdefault("state", "published")
+    advisory.setdefault("created_at", advisory.get("published_at"))
+    if not advisory.get("cvss"):
+        advisory["cvss"] = {"score": None}
+    cwes = advisory.get("cwes") or []
+    advisory.setdefault("cwe_ids", [cwe.get("cwe_id") for cwe in cwes])
+    vulnerabilities = []
+    for vulnerability in advisory.get("vulnerabilities") or []:
+        vulnerability = dict(vulnerability)
+        vulnerability.setdefault("patched_versions",
+                                 vulnerability.get("first_patched_version"))
+        vulnerabilities.append(vulnerability)
+    advisory["vulnerabilities"] = vulnerabilities
+    return {feature: advisory.get(feature) for feature in feature_list}
+
+
+def get_deep_size(data: Any, seen: Union[Set[int], None] = None) -> int:
+    """
+    Memory size of parsed json data in bytes. Objects referenced
+    several times (e.g. keys cached by the parser) are counted once.
+    :param data: Parsed json data
+    :param seen: Ids of the objects counted before
+    :return: Size in bytes
+    """
+    if seen is None:
+        seen = set()
+    if id(data) in seen:
+        return 0
+    seen.add(id(data))
+    size = sys.getsizeof(data)
+    if isinstance(data, dict):
+        size += sum(get_deep_size(key, seen) + get_deep_size(value, seen)
+                    for key, value in data.items())
+    elif isinstance(data, list):
+        size += sum(get_deep_size(element, seen) for element in data)
+    return size
+
+
+def estimate_size(data: Any, samples: int = 10) -> int:
+    """
+    Estimates the memory size of parsed json data from the size of
+    evenly spaced samples of its members (e.g. repositories).
+    :param data: Parsed json data
+    :param samples: Number of sampled members
+    :return: Estimated size in bytes
+    """
+    if not isinstance(data, dict) or len(data) <= samples:
+        return get_deep_size(data)
+    items = list(data.items())
+    sampled = items[::len(items) // samples]
+    seen = set()  # type: set[int]
+    sampled_size = sum(get_deep_size(key, seen) + get_deep_size(value, seen)
+                       for key, value in sampled)
+    return sys.getsizeof(data) + sampled_size * len(items) // len(sampled)
+
+
+def to_json_keys(data: Any) -> Any:
+    """
+    Converts the dictionary keys of the data to strings as a json round
+    trip does (e.g. repository ids), without serializing the data.
+    :param data: Data as written by dict_to_json
+    :return: Data as read by json_to_dict
+    """
+    if isinstance(data, dict):
+        return {serializer.json_key(key): to_json_keys(value)
+                for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [to_json_keys(element) for element in data]
+    return data
+
+
+def dict_to_json(data: Union[Dict, List], data_path: str, feature: str,
+                 index: bool = False, pretty: bool = False):
     """
     Helper function to write file.
     :param data: data to be written
     :param data_path: Path where file should be written.
     :param feature: Feature for filename.
+    :param index: True to write the sidecar index of the keys
+    (e.g. repository ids) of a dictionary, see json_stream.get_items.
+    :param pretty: True to indent the json, otherwise it is compact.
     """
-    json_object = json.dumps(data, indent=4, cls=npEncoder)
     file_name = os.path.join(data_path, (feature + ".json"))
-    with open(file_name, "w", encoding='utf-8') as outfile:
-        outfile.write(json_object)
+    # Written to a temporary file first, so a failing serialization
+    # keeps the previous file instead of truncating it
+    temp_name = file_name + ".tmp"
+    try:
+        with open(temp_name, "wb") as outfile:
+            members = serializer.dump(data=data, file=outfile, pretty=pretty)
+        os.replace(temp_name, file_name)
+    except BaseException:
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+        raise
+    if index and isinstance(data, dict):
+        json_stream.write_index(path=file_name, members=members)
+
+
+def merge_outputs(data: Dict, new_data: Dict):
+    """
+    Merges the data of an output into its previous data. Data of a
+    repository replaces its previous data, dictionaries of other keys
+    (e.g. per feature) are merged.
+    :param data: Previous data per key, updated in place
+    :param new_data: New data per key
+    """
+    for key, value in new_data.items():
+        previous = data.get(key)
+        if (not str(key).isdigit() and isinstance(previous, dict) and
+                isinstance(value, dict)):
+            data[key] = {**previous, **value}
+        else:
+            data[key] = value
+
+
+class JsonLinesWriter:
+    """
+    Appends data per repository to json lines files while mining
+    and merges them into the json files of the features afterwards.
+    """
+    def __init__(self, data_path: str, merge_existing: bool = False) -> None:
+        """
+        :param data_path: Path where the files should be written.
+        :param merge_existing: True to merge the data into existing json
+        files. Data of a repository replaces its previous data, other
+        keys (e.g. counted features) are merged.
+        """
+        self.data_path = data_path
+        self.merge_existing = merge_existing
+        self.features = set()  # type: set[str]
+        self.lock = threading.Lock()
+
+    def append(self, data: Dict, feature: str):
+        """
+        Appends one line per key (e.g. repository id) of the data.
+        The file of a feature is truncated on its first append.
+        :param data: data to be written
+        :param feature: Feature for filename.
+        """
+        lines = b"".join(
+            serializer.dumps({"key": key, "data": value}) + b"\n"
+            for key, value in data.items())
+        file_name = os.path.join(self.data_path, (feature + ".jsonl"))
+        with self.lock:
+            mode = "ab" if feature in self.features else "wb"
+            self.features.add(feature)
+            with open(file_name, mode) as outfile:
+                outfile.write(lines)
+
+    def finalize(self):
+        """
+        Merges the json lines files into the json files of the features.
+        Data of the same key from several lines is merged,
+        if it is a dictionary.
+        """
+        with self.lock:
+            for feature in sorted(self.features):
+                file_name = os.path.join(self.data_path,
+                                         (feature + ".jsonl"))
+                merged = {}  # type: dict[str, Any]
+                with open(file_name, "rb") as infile:
+                    for line in infile:
+                        row = serializer.loads(line)
+                        key = str(row.get("key"))
+                        value = row.get("data")
+                        existing = merged.get(key)
+                        if (isinstance(existing, dict) and
+                                isinstance(value, dict)):
+                            existing.update(value)
+                        else:
+                            merged[key] = value
+                json_path = os.path.join(self.data_path, feature + ".json")
+                if self.merge_existing and os.path.exists(json_path):
+                    existing = json_to_dict(path=json_path)
+                    merge_outputs(data=existing, new_data=merged)
+                    merged = existing
+                dict_to_json(data=merged, data_path=self.data_path,
+                             feature=feature, index=True)
+                os.remove(file_name)
+            self.features = set()
 
 
 def json_to_dict(path: str) -> Dict:
@@ -152,6 +489,4 @@ def json_to_dict(path: str) -> Dict:
     :param path: Path to json file
     :return: dictionary with json content
     """
-    with open(path, encoding='utf-8') as json_file:
-        data = json.load(json_file)
-    return data
+    return serializer.load(path)
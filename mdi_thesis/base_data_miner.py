@@ -6,16 +6,48 @@ Description: Pipeline for data collection.
 """
 
 import time
+import copy
 import csv
+import json
 import os
+import queue
 import sys
 import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from datetime import date
-from typing import Union, List
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Union, List, Set
 from dateutil import relativedelta
 import mdi_thesis.base.base as base
 import mdi_thesis.base.utils as utils
+import mdi_thesis.base.scheduler as scheduler
+import mdi_thesis.base.budget as budget
+import mdi_thesis.constants as constants
+
+# Repository data, which is unchanged if the repository is unchanged
+CHANGE_KEYS = ["pushed_at", "updated_at", "open_issues"]
+# Stages skipped for unchanged repositories with their outputs, only
+# stages whose data changes with a push. Forks, issues, pull requests,
+# issue comments and dependents can change without any CHANGE_KEYS,
+# branches become stale with the date of the run.
+CHANGE_DETECTION_STAGES = {
+    "commits_to_json": ["commits"],
+    "single_commits_to_json": ["single_commits", "single_commits_sample"]
+}
+# Time budget of the retry of partial units per unit_time_budget
+STRAGGLER_BUDGET_FACTOR = 4
+# Orders in which the selected repositories are mined, see order_repos
+MINING_ORDERS = ["selection", "stars", "criticality", "staleness", "list"]
+# Date and period of the outputs as filtered by their stages
+CARRY_FORWARD_WINDOWS = {
+    "forks": ["created_at", "months=6"],
+    "pull_requests": ["updated_at", "months=6"],
+    "issue": ["updated_at", "months=6"],
+    "commits": ["commit.committer.date", "months=12"],
+    "single_commits": ["commit.committer.date", "months=1"],
+    "issue_comments": ["updated_at", "days=90"]
+}
 
 
 class DataMinePipeline(base.Request):
@@ -24,41 +56,654 @@ class DataMinePipeline(base.Request):
     """
     def __init__(self, language: str, filter_date, repo_nr: int = 0,
                  get_existing_repos: bool = False,
-                 repo_list: Union[List, None] = None) -> None:
+                 repo_list: Union[List, None] = None,
+                 dependency_source: str = "sbom",
+                 advisory_source: str = "repository",
+                 advisory_dump: str = "",
+                 sharded_search: bool = False,
+                 branch_source: str = "graphql",
+                 concurrent_stages: bool = True,
+                 streaming: bool = False,
+                 queue_size: int = 10,
+                 sampling_policy: str = "first",
+                 sample_size: int = 100,
+                 status_interval: float = 60,
+                 run_stages: bool = True,
+                 change_detection: bool = False,
+                 commit_source: str = "api",
+                 stage_gating: bool = False,
+                 unit_time_budget: float = 0,
+                 straggler_time_budget: Union[float, None] = None,
+                 mining_order: str = "selection",
+                 priority_list: str = "mdi_thesis/preselected_repos.txt",
+                 priority_batch_size: int = 0,
+                 keep_data: bool = False,
+                 persist: bool = True,
+                 request_budget: Union[budget.RequestBudget, None] = None
+                 ) -> None:
         """
         :param language: Current programming language
         :param filter_date: Start date for filters in functions
         :param repo_num: Repo number to be queried.
         :param get_existing_repos: True if a file already exists
                                 with repositories for the current language
+        :param dependency_source: "sbom" to get upstream dependencies
+                                from the dependency graph API with the
+                                web scraper as fallback, "web" to
+                                only use the web scraper.
+        :param advisory_source: "repository" to query the advisories
+                                per repository, "database" to join the
+                                global advisory database with the
+                                selected repositories. Languages without
+                                ecosystems in query_features.json are
+                                queried per repository without dump.
+        :param advisory_dump: Optional json file with advisories of the
+                                global advisory database, used instead
+                                of the API for advisory_source "database".
+        :param sharded_search: True if the repository search is split
+                                into star and pushed ranges to select
+                                more than 1,000 repositories.
+        :param branch_source: "graphql" to get the branches and their
+                                states from the GraphQL API, "web" to
+                                scrape the branch states and query each
+                                branch from the REST API, "git" to get
+                                them from local clones.
+        :param concurrent_stages: True if stages which do not compete
+                                for the same rate limit run concurrently.
+        :param streaming: True if each repository passes through all
+                                stages as a unit and its data is
+                                appended to the output files as soon as
+                                a stage finished it.
+        :param queue_size: Repositories waiting in front of a stage
+                                in streaming mode.
+        :param sampling_policy: Selection of the commits and issues per
+                                repository, for which single commits and
+                                issue comments are queried: "first",
+                                "fixed", "stratified" or "adaptive",
+                                see sampling.ObjectSampler.
+        :param sample_size: Objects per repository for the sampling
+                                policy, the maximum for "adaptive".
+        :param status_interval: Seconds between writes of the progress
+                                status file outputs/logs/status.json.
+        :param run_stages: False to only select the repositories, e.g.
+                                to run single units with run_unit.
+        :param change_detection: True to skip the stages of
+                                CHANGE_DETECTION_STAGES for repositories
+                                with unchanged CHANGE_KEYS since the last
+                                {language}_repository.json and to carry
+                                their previous data forward.
+        :param commit_source: "api" to query commits and single commits
+                                from the REST API, "git" to read all of
+                                them from local clones, which are
+                                kept in outputs/clones.
+        :param stage_gating: True to run the expensive stages of
+                                stage_gates.json only for repositories
+                                whose data of the selection (archived,
+                                pushed_at, stars, open_issues) meets the
+                                predicates of the stage. Skipped units
+                                are stored in {language}_skipped.json.
+        :param unit_time_budget: Seconds per repository and query of a
+                                stage (e.g. its pages or dependents),
+                                after which the repository keeps its
+                                partial data, 0 for no limit.
+        :param straggler_time_budget: Seconds per repository for the
+                                retry of units left with partial data,
+                                which runs after all other units,
+                                0 for no limit. By default
+                                STRAGGLER_BUDGET_FACTOR times the
+                                unit_time_budget. Units still partial are
+                                stored in {language}_partial_units.json.
+        :param mining_order: Order in which the repositories are mined,
+                                so a run cut short has the most valuable
+                                data: "selection" (order of the search),
+                                "stars" (most stars first), "criticality"
+                                (highest previous criticality score
+                                first), "staleness" (new repositories and
+                                those pushed most since their previous
+                                data first) or "list" (repositories of
+                                priority_list first).
+        :param priority_list: File with one repository id per line
+                                for the mining order "list".
+        :param priority_batch_size: Repositories which pass through all
+                                stages before the next repositories
+                                start, 0 to run each stage for all
+                                repositories at once. The output files
+                                are complete after each batch.
+        :param keep_data: True to keep the mined data in memory for
+                                get_data_source, e.g. to hand it to the
+                                MetricsPipeline without reading the files.
+        :param persist: False to not write the output files, e.g. if
+                                the data is only kept in memory.
+        :param request_budget: Session, tokens and rate limiters shared
+                                with the pipelines of other languages.
 
         """
-        super().__init__(filter_date)
+        super().__init__(filter_date, request_budget=request_budget)
         self.logger.info("Start date: %s", self.filter_date)
         self.repo_list = repo_list
         self.repo_num = repo_nr
         self.language = language
         self.get_existing_repos = get_existing_repos
+        self.dependency_source = dependency_source
+        self.advisory_source = advisory_source
+        self.advisory_dump = advisory_dump
+        self.sharded_search = sharded_search
+        self.branch_source = branch_source
+        self.concurrent_stages = concurrent_stages
+        self.streaming = streaming
+        self.queue_size = queue_size
+        self.sampling_policy = sampling_policy
+        self.sample_size = sample_size
+        self.status_interval = status_interval
+        self.run_stages = run_stages
+        self.change_detection = change_detection
+        self.commit_source = commit_source
+        self.stage_gating = stage_gating
+        self.stage_gates = {}  # type: dict[str, dict]
+        if stage_gating:
+            stage_gates_file = open(
+                "mdi_thesis/stage_gates.json", encoding="utf-8")
+            self.stage_gates = json.load(stage_gates_file)
+        if mining_order not in MINING_ORDERS:
+            raise ValueError("Unknown mining order: " + str(mining_order))
+        self.mining_order = mining_order
+        self.priority_list = priority_list
+        self.priority_batch_size = priority_batch_size
+        self.keep_data = keep_data
+        self.persist = persist
+        self.mined_data = {}  # type: dict[str, Any]
+        self.data_lock = threading.Lock()
+        self.unit_time_budget = unit_time_budget
+        if straggler_time_budget is None:
+            straggler_time_budget = (STRAGGLER_BUDGET_FACTOR *
+                                     unit_time_budget)
+        self.straggler_time_budget = straggler_time_budget
+        self.partial_units = {}  # type: dict[str, set[int]]
+        self.partial_lock = threading.Lock()
+        self.gated_repos = {}  # type: dict[str, set[int]]
+        self.skipped_units = {}  # type: dict[int, dict[str, list[str]]]
+        self.unchanged_repos = set()  # type: set[int]
+        self.carried_data = {}  # type: dict[str, dict[int, Any]]
+        self.stream_writer = None  # type: Union[utils.JsonLinesWriter, None]
         self.query_parameters = ""
         self.query_functions = self.build_pipeline()
         self.search_to_json()
         self.base_data = {}
 
+    def write_output(self, data: Union[Dict, List], feature: str):
+        """
+        Writes the data of a feature to the output files. In streaming
+        mode the data is appended to the json lines file of the feature.
+        With keep_data, the data is also kept in memory.
+        :param data: Data per repository
+        :param feature: Feature for filename, without language
+        """
+        if self.keep_data:
+            self.keep_output(data=data, feature=feature)
+        if not self.persist:
+            return
+        if self.stream_writer:
+            self.stream_writer.append(data=data,
+                                      feature=self.language + "_" + feature)
+        else:
+            carried = self.carried_data.get(feature)
+            if carried and isinstance(data, dict):
+                data = {**carried, **data}
+            utils.dict_to_json(data=data,
+                               data_path=self.output_path,
+                               feature=self.language + "_" + feature,
+                               index=True)
+
+    def keep_output(self, data: Union[Dict, List], feature: str):
+        """
+        Keeps the data of a feature in memory. The data is merged with
+        the data kept before as in the output files (see
+        utils.merge_outputs), so the data of repositories written in
+        several parts (e.g. batches) is complete.
+        :param data: Data per repository
+        :param feature: Feature, without language
+        """
+        with self.data_lock:
+            if not isinstance(data, dict):
+                self.mined_data[feature] = data
+                return
+            kept = self.mined_data.get(feature)
+            if not isinstance(kept, dict):
+                kept = dict(self.carried_data.get(feature) or {})
+                self.mined_data[feature] = kept
+            utils.merge_outputs(data=kept, new_data=data)
+
+    def get_data_source(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Hands the data kept in memory over, e.g. to the MetricsPipeline.
+        The keys are converted to strings as if the data was read from
+        the output files, the data is no longer kept by the pipeline.
+        :return: Data per feature and language
+        """
+        data_source = {}
+        with self.data_lock:
+            for feature in list(self.mined_data):
+                data_source[feature] = {self.language: utils.to_json_keys(
+                    self.mined_data.pop(feature))}
+        return data_source
+
+    def repo_view(self, repo_ids: List[int]) -> "DataMinePipeline":
+        """
+        Copy of the pipeline restricted to the given repositories.
+        Session, rate limiters and output writer are shared, the
+        repositories left with partial data are recorded per view.
+        :param repo_ids: Repository ids of the selected repositories
+        :return: Pipeline for the given repositories
+        """
+        view = copy.copy(self)
+        view.owns_budget = False
+        view.selected_repos_dict = {
+            repo: self.selected_repos_dict[repo] for repo in repo_ids
+            if repo in self.selected_repos_dict}
+        view.base_data = {}
+        view.partial_repos = set()
+        return view
+
+    def run_unit(self, repo: int, stage_name: str) -> bool:
+        """
+        Runs one stage for one repository, unless the repository is
+        excluded from the stage.
+        :param repo: Repository id of a selected repository
+        :param stage_name: Name of the stage function, e.g. forks_to_json
+        :return: True if the stage finished without error
+        """
+        success = True
+        if repo not in self.excluded_repos(stage_name):
+            success = self.query_unit(repo=repo, stage_name=stage_name)
+        self.progress.complete(language=self.language,
+                               stage=stage_name, units=1)
+        return success
+
+    def query_unit(self, repo: int, stage_name: str) -> bool:
+        """
+        Runs one stage for one repository without pauses.
+        :param repo: Repository id of a selected repository
+        :param stage_name: Name of the stage function, e.g. forks_to_json
+        :return: True if the stage finished without error
+        """
+        view = self.repo_view([repo])
+        view.feature_pause = 0
+        view.branch_pause = 0
+        success = True
+        try:
+            getattr(view, stage_name)()
+        except Exception as error:
+            self.logger.error(
+                "Error at function %s for repo %s:%s",
+                stage_name, repo, error)
+            success = False
+        self.add_partial_units(stage_name=stage_name,
+                               repos=view.partial_repos)
+        return success
+
+    def add_partial_units(self, stage_name: str, repos: Set[int]):
+        """
+        :param stage_name: Name of the stage function
+        :param repos: Repositories left with partial data by the stage
+        """
+        if repos:
+            with self.partial_lock:
+                self.partial_units.setdefault(stage_name, set()).update(
+                    repos)
+
+    def retry_partial_units(self):
+        """
+        Runs the units left with partial data again after all other
+        units, with the time budget for stragglers. Their data replaces
+        the partial data in the output files. Units which are still
+        partial are stored in {language}_partial_units.json.
+        """
+        units = [(repo, stage_name)
+                 for stage_name, repos in self.partial_units.items()
+                 for repo in repos]
+        self.partial_units = {}
+        if units:
+            self.logger.info("Retrying %s units with partial data",
+                             len(units))
+            unit_time_budget = self.unit_time_budget
+            self.unit_time_budget = self.straggler_time_budget
+            owns_writer = self.stream_writer is None
+            if owns_writer:
+                self.stream_writer = utils.JsonLinesWriter(
+                    data_path=self.output_path, merge_existing=True)
+            for repo, stage_name in units:
+                self.query_unit(repo=repo, stage_name=stage_name)
+            if owns_writer:
+                self.stream_writer.finalize()
+                self.stream_writer = None
+            self.unit_time_budget = unit_time_budget
+        partial_units = {}  # type: dict[int, list[str]]
+        for stage_name, repos in self.partial_units.items():
+            for repo in repos:
+                partial_units.setdefault(repo, []).append(stage_name)
+        self.write_output(data=partial_units, feature="partial_units")
+
+    def run_streaming(self):
+        """
+        Streams each repository through all stages. Every stage has its
+        own worker, which hands a finished repository to the next stage
+        via a bounded queue, so all stages and their rate limits
+        are used at once and the output grows per repository.
+        """
+        stages = self.query_functions
+        self.stream_writer = utils.JsonLinesWriter(
+            data_path=self.output_path)
+        for feature, data in self.carried_data.items():
+            self.write_output(data=data, feature=feature)
+        queues = [queue.Queue(maxsize=self.queue_size)
+                  for _ in stages]  # type: List[queue.Queue]
+
+        def stage_worker(index: int, stage: scheduler.Stage):
+            while True:
+                repo = queues[index].get()
+                if repo is not None:
+                    self.run_unit(repo=repo, stage_name=stage.name)
+                if index + 1 < len(queues):
+                    queues[index + 1].put(repo)
+                if repo is None:
+                    break
+            self.logger.info("Finished function %s for all repos",
+                             stage.name)
+
+        workers = [threading.Thread(target=stage_worker,
+                                    args=(index, stage),
+                                    name=stage.name, daemon=True)
+                   for index, stage in enumerate(stages)]
+        for worker in workers:
+            worker.start()
+        for repo in self.selected_repos_dict:
+            queues[0].put(repo)
+        queues[0].put(None)
+        for worker in workers:
+            worker.join()
+        if self.unit_time_budget:
+            self.retry_partial_units()
+        self.stream_writer.finalize()
+        self.stream_writer = None
+
+    def order_repos(self):
+        """
+        Sorts the selected repositories by the mining order.
+        Repositories without a priority value keep their order
+        after the others.
+        """
+        if self.mining_order == "selection":
+            return
+        priorities = {}  # type: dict[int, float]
+        if self.mining_order == "stars":
+            priorities = {
+                repo: data.get("stargazers_count")
+                for repo, data in self.selected_repos_dict.items()
+                if data.get("stargazers_count") is not None}
+        elif self.mining_order == "criticality":
+            metrics_path = os.path.join(
+                Path(self.output_path).parent, "results",
+                self.language + "_metrics.json")
+            if os.path.exists(metrics_path):
+                scores = utils.json_to_dict(path=metrics_path).get(
+                    "criticality_score") or {}
+                priorities = {int(repo): score
+                              for repo, score in scores.items()
+                              if isinstance(score, (int, float))}
+        elif self.mining_order == "staleness":
+            previous = self.read_previous_output("repository")
+            for repo, data in self.selected_repos_dict.items():
+                pushed_at = data.get("pushed_at")
+                previous_pushed_at = (previous.get(str(repo)) or {}).get(
+                    "pushed_at")
+                if not previous_pushed_at:
+                    priorities[repo] = math.inf
+                elif pushed_at:
+                    priorities[repo] = (
+                        datetime.strptime(pushed_at,
+                                          '%Y-%m-%dT%H:%M:%SZ') -
+                        datetime.strptime(previous_pushed_at,
+                                          '%Y-%m-%dT%H:%M:%SZ')
+                    ).total_seconds()
+        elif os.path.exists(self.priority_list):
+            with open(self.priority_list, encoding="utf-8") as list_file:
+                repo_ids = [line.strip() for line in list_file]
+            priorities = {int(repo): -position
+                          for position, repo in enumerate(repo_ids)
+                          if repo.isdigit()}
+        else:
+            self.logger.error("Priority list %s not found",
+                              self.priority_list)
+        ordered = sorted(
+            self.selected_repos_dict,
+            key=lambda repo: (repo not in priorities,
+                              -priorities.get(repo, 0)))
+        self.selected_repos_dict = {
+            repo: self.selected_repos_dict[repo] for repo in ordered}
+        self.logger.info("Mining %s repositories ordered by %s, "
+                         "%s with priority value",
+                         len(ordered), self.mining_order,
+                         len([repo for repo in ordered
+                              if repo in priorities]))
+
+    def run_batches(self):
+        """
+        Runs all stages for batches of repositories in mining order,
+        without the pauses between stages. Exhausted rate limits are
+        waited for by check_rate_limit. After each batch its data is
+        merged into the output files, so the data of a run cut short
+        covers complete repositories.
+        """
+        repos = list(self.selected_repos_dict)
+        batches = math.ceil(len(repos) / self.priority_batch_size)
+        for batch_num, start in enumerate(
+                range(0, len(repos), self.priority_batch_size), start=1):
+            batch = repos[start:start + self.priority_batch_size]
+            self.logger.info("Mining batch %s of %s with %s repositories",
+                             batch_num, batches, len(batch))
+            self.stream_writer = utils.JsonLinesWriter(
+                data_path=self.output_path, merge_existing=start > 0)
+            if start == 0:
+                for feature, data in self.carried_data.items():
+                    self.write_output(data=data, feature=feature)
+            view = self.repo_view(batch)
+            view.feature_pause = 0
+            view.branch_pause = 0
+            scheduler.StageScheduler(
+                stages=view.build_pipeline(),
+                logger=self.logger,
+                concurrent=self.concurrent_stages,
+                stage_pause=0,
+                on_finished=lambda stage: self.progress.complete(
+                    language=self.language, stage=stage.name,
+                    units=len(batch))).run()
+            self.stream_writer.finalize()
+            self.stream_writer = None
+
+    def detect_changes(self):
+        """
+        Compares the selected repositories with the previous
+        {language}_repository.json. Repositories with unchanged
+        CHANGE_KEYS are unchanged, if the outputs of all stages of
+        CHANGE_DETECTION_STAGES are available. Their previous data is
+        carried forward, trimmed to the periods of the current filter date.
+        """
+        self.unchanged_repos = set()
+        self.carried_data = {}
+        if not self.change_detection:
+            return
+        previous = self.read_previous_output("repository")
+        for repo, data in self.selected_repos_dict.items():
+            previous_data = previous.get(str(repo))
+            if previous_data and all(
+                    key in data and data.get(key) == previous_data.get(key)
+                    for key in CHANGE_KEYS):
+                self.unchanged_repos.add(repo)
+        if not self.unchanged_repos:
+            return
+        carried_data = {}
+        for features in CHANGE_DETECTION_STAGES.values():
+            for feature in features:
+                data = self.read_previous_output(feature)
+                if not data and not feature.endswith("_sample"):
+                    self.logger.info(
+                        "No previous %s data, change detection disabled",
+                        feature)
+                    self.unchanged_repos = set()
+                    return
+                data = {int(repo): content for repo, content in data.items()
+                        if int(repo) in self.unchanged_repos}
+                window = CARRY_FORWARD_WINDOWS.get(feature)
+                if window:
+                    period = window[1].split("=")
+                    since = (self.filter_date - relativedelta.relativedelta(
+                        **{period[0]: int(period[1])}))
+                    data = utils.trim_to_window(
+                        data=data, date_key=window[0],
+                        since=datetime.combine(since, datetime.min.time()))
+                carried_data[feature] = data
+        if "single_commits_sample" in carried_data:
+            carried_data["single_commits_sample"] = utils.trim_samples(
+                records=carried_data["single_commits_sample"],
+                data=carried_data.get("single_commits") or {})
+        self.carried_data = carried_data
+        self.logger.info("Unchanged repositories: %s of %s",
+                         len(self.unchanged_repos),
+                         len(self.selected_repos_dict))
+
+    def read_previous_output(self, feature: str) -> Dict[str, Any]:
+        """
+        :param feature: Feature of the output file
+        :return: Data of the last run, empty if not available
+        """
+        path = os.path.join(self.output_path,
+                            self.language + "_" + feature + ".json")
+        if os.path.exists(path):
+            return utils.json_to_dict(path=path)
+        return {}
+
+    def gate_stages(self):
+        """
+        Applies the predicates of stage_gates.json to the data of the
+        selected repositories. Repositories failing a predicate skip
+        the stage, their outputs of the stage are recorded with the
+        failed predicates in skipped_units.
+        """
+        self.gated_repos = {}
+        self.skipped_units = {}
+        for stage_name, gate in self.stage_gates.items():
+            gated = set()
+            for repo, data in self.selected_repos_dict.items():
+                reasons = self.failed_predicates(
+                    data=data, predicates=gate.get("predicates", {}))
+                if reasons:
+                    gated.add(repo)
+                    skipped = self.skipped_units.setdefault(repo, {})
+                    for feature in gate.get("outputs", []):
+                        skipped[feature] = reasons
+            if gated:
+                self.gated_repos[stage_name] = gated
+                self.logger.info("Skipping %s for %s of %s repositories",
+                                 stage_name, len(gated),
+                                 len(self.selected_repos_dict))
+            # Previous data of skipped units is not carried forward
+            for feature in gate.get("outputs", []):
+                carried = self.carried_data.get(feature)
+                if carried:
+                    self.carried_data[feature] = {
+                        repo: content for repo, content in carried.items()
+                        if repo not in gated}
+
+    def failed_predicates(self, data: Dict[str, Any],
+                          predicates: Dict[str, Any]) -> List[str]:
+        """
+        Checks the data of a repository against the predicates of a
+        stage gate. Predicates on missing data pass.
+        :param data: Data of the repository from the selection
+        :param predicates: archived (allowed value), max_pushed_age_days,
+        min_stars and min_open_issues.
+        :return: Failed predicates, empty if the stage runs
+        """
+        failed = []
+        archived = data.get("archived")
+        if ("archived" in predicates and archived is not None and
+                archived != predicates["archived"]):
+            failed.append("archived")
+        pushed_at = data.get("pushed_at")
+        if "max_pushed_age_days" in predicates and pushed_at:
+            pushed_date = datetime.strptime(
+                pushed_at, '%Y-%m-%dT%H:%M:%SZ').date()
+            filter_date = self.filter_date
+            if isinstance(filter_date, datetime):
+                filter_date = filter_date.date()
+            if ((filter_date - pushed_date).days >
+                    predicates["max_pushed_age_days"]):
+                failed.append("max_pushed_age_days")
+        for predicate, key in [("min_stars", "stargazers_count"),
+                               ("min_open_issues", "open_issues")]:
+            value = data.get(key)
+            if (predicate in predicates and value is not None and
+                    value < predicates[predicate]):
+                failed.append(predicate)
+        return failed
+
+    def excluded_repos(self, stage_name: str) -> Set[int]:
+        """
+        :param stage_name: Name of the stage function
+        :return: Repositories which are not queried by the stage,
+        unchanged or gated repositories.
+        """
+        excluded = set(self.gated_repos.get(stage_name, set()))
+        if stage_name in CHANGE_DETECTION_STAGES:
+            excluded |= self.unchanged_repos
+        return excluded
+
+    def restricted_stage(self, stage_name: str) -> Callable:
+        """
+        Stage function running a stage on a view of the repositories
+        not excluded from it. The data of unchanged repositories is
+        carried forward by write_output, the repositories left with
+        partial data are recorded in partial_units.
+        :param stage_name: Name of the stage function
+        :return: Stage function with the same name
+        """
+        def run_stage():
+            excluded = self.excluded_repos(stage_name)
+            view = self.repo_view(
+                [repo for repo in self.selected_repos_dict
+                 if repo not in excluded])
+            getattr(view, stage_name)()
+            self.add_partial_units(stage_name=stage_name,
+                                   repos=view.partial_repos)
+        run_stage.__name__ = stage_name
+        return run_stage
+
     def base_data_to_json(self):
         """
         Queries data to json file.
         """
+        base_features = ["repository",
+                         "contributors",
+                         "release",
+                         "community_health"]
+        ecosystems = self.query_features.get(
+            "global_advisories").get("ecosystems").get(self.language, [])
+        # Without ecosystems (e.g. cpp) the global advisory database
+        # cannot be restricted to the language, the advisories are
+        # queried per repository instead of the whole database.
+        from_database = (self.advisory_source != "repository" and
+                         bool(ecosystems or self.advisory_dump))
+        if not from_database:
+            base_features.append("advisories")
         self.base_data = self.query_repository(
-            ["repository",
-             "contributors",
-             "release",
-             "community_health",
-             "advisories"],
+            base_features,
             filters={})
+        if from_database:
+            self.base_data["advisories"] = self.get_global_advisories(
+                ecosystems=ecosystems,
+                dump_path=self.advisory_dump)
         for feature, data in self.base_data.items():
-            utils.dict_to_json(data=data,
-                               data_path=self.output_path,
-                               feature=self.language + "_" + feature)
+            self.write_output(data=data, feature=feature)
 
     def forks_to_json(self,):
         """
@@ -70,11 +715,8 @@ class DataMinePipeline(base.Request):
                                       created_at_filt="months=6"
                                       )
         data = forks.get("forks")
-        if data:
-            utils.dict_to_json(
-                data=data,
-                data_path=self.output_path,
-                feature=self.language + "_" + "forks")
+        if data or self.carried_data.get("forks"):
+            self.write_output(data=data or {}, feature="forks")
 
     def pulls_issues_to_json(self):
         """
@@ -94,9 +736,7 @@ class DataMinePipeline(base.Request):
             updated_at_filt="months=6"
                 )
         for feature, data in pulls_data.items():
-            utils.dict_to_json(data=data,
-                               data_path=self.output_path,
-                               feature=self.language + "_" + feature)
+            self.write_output(data=data, feature=feature)
 
     def commits_to_json(self):
         """
@@ -104,13 +744,15 @@ class DataMinePipeline(base.Request):
         """
         filter_date = self.filter_date - relativedelta.relativedelta(months=12)
         filter_date = filter_date.strftime('%Y-%m-%dT%H:%M:%SZ')
-        commits = self.query_repository(
-            ["commits"],
-            filters={"since": str("=") + filter_date})
+        if self.commit_source == "git":
+            commits = {"commits": self.get_git_data(feature="commits",
+                                                    since=filter_date)}
+        else:
+            commits = self.query_repository(
+                ["commits"],
+                filters={"since": str("=") + filter_date})
         for feature, data in commits.items():
-            utils.dict_to_json(data=data,
-                               data_path=self.output_path,
-                               feature=self.language + "_" + feature)
+            self.write_output(data=data, feature=feature)
 
     def single_commits_to_json(self):
         """
@@ -118,14 +760,31 @@ class DataMinePipeline(base.Request):
         """
         filter_date = self.filter_date - relativedelta.relativedelta(months=1)
         filter_date_str = filter_date.strftime('%Y-%m-%dT%H:%M:%SZ')
+        if self.commit_source == "git":
+            single_commits = self.get_git_data(feature="single_commits",
+                                               since=filter_date_str)
+            # All commits of the period are read from the clones
+            sample_record = {repo: {"policy": "all",
+                                    "population": len(commits),
+                                    "sample_size": len(commits),
+                                    "sampled": list(commits)}
+                             for repo, commits in single_commits.items()}
+            self.write_output(data=single_commits,
+                              feature="single_commits")
+            self.write_output(data=sample_record,
+                              feature="single_commits_sample")
+            return
+        sample_record = {}
         single_commits = self.get_single_object(
             feature="commits",
             filters={
                 "since": str("=") + filter_date_str
-                }, output_format="dict")
-        utils.dict_to_json(data=single_commits,
-                           data_path=self.output_path,
-                           feature=self.language + "_single_commits")
+                }, output_format="dict",
+            sample_record=sample_record)
+        self.write_output(data=single_commits,
+                          feature="single_commits")
+        self.write_output(data=sample_record,
+                          feature="single_commits_sample")
 
     def issue_comments_to_json(self):
         """
@@ -138,6 +797,7 @@ class DataMinePipeline(base.Request):
         filter_date_issues = (self.filter_date -
                               relativedelta.relativedelta(days=90))
         filter_date_issues = filter_date_issues.strftime('%Y-%m-%dT%H:%M:%SZ')
+        sample_record = {}
         issue_comments = self.get_single_object(
             feature="issue_comments",
             filters={
@@ -145,19 +805,23 @@ class DataMinePipeline(base.Request):
                 "state": "=all",
                 "sort": "=updated",
                 "direction": "=desc"
-                }, output_format="dict")
-        utils.dict_to_json(data=issue_comments,
-                           data_path=self.output_path,
-                           feature=self.language + "_issue_comments")
+                }, output_format="dict",
+            sample_record=sample_record)
+        self.write_output(data=issue_comments,
+                          feature="issue_comments")
+        self.write_output(data=sample_record,
+                          feature="issue_comments_sample")
 
     def upstream_dependencies_to_json(self):
         """
         Queries data to json file.
         """
-        upstream_dependencies = self.get_dependencies()
-        utils.dict_to_json(data=upstream_dependencies,
-                           data_path=self.output_path,
-                           feature=self.language + "_upstream_dependencies")
+        if self.dependency_source == "sbom":
+            upstream_dependencies = self.get_dependencies_sbom()
+        else:
+            upstream_dependencies = self.get_dependencies()
+        self.write_output(data=upstream_dependencies,
+                          feature="upstream_dependencies")
 
     def downstream_dependencies_to_json(self):
         """
@@ -166,36 +830,38 @@ class DataMinePipeline(base.Request):
 
         downstream_dependencies = self.get_dependents(
             dependents_details=False)
-        utils.dict_to_json(data=downstream_dependencies,
-                           data_path=self.output_path,
-                           feature=self.language + "_downstream_dependencies")
+        self.write_output(data=downstream_dependencies,
+                          feature="downstream_dependencies")
 
     def branches_to_json(self):
         """
         Queries data to json file.
         """
+        if self.branch_source in ["graphql", "git"]:
+            if self.branch_source == "git":
+                branch_data = self.get_git_data(feature="branches")
+            else:
+                branch_data = self.get_branches_graphql()
+            for feature, data in branch_data.items():
+                self.write_output(data=data, feature=feature)
+            return
         # Stale branches
         stale_branches = self.get_branches(activity="stale")
-        utils.dict_to_json(data=stale_branches,
-                           data_path=self.output_path,
-                           feature=self.language + "_stale_branches")
+        self.write_output(data=stale_branches, feature="stale_branches")
 
-        time.sleep(300)
+        time.sleep(self.branch_pause)
 
         # Active branches
         active_branches = self.get_branches(activity="active")
-        utils.dict_to_json(data=active_branches,
-                           data_path=self.output_path,
-                           feature=self.language + "_active_branches")
+        self.write_output(data=active_branches,
+                          feature="active_branches")
         # All branches from API
         branches = self.get_single_object(
             feature="branches",
             filters={},
             output_format="dict"
             )
-        utils.dict_to_json(data=branches,
-                           data_path=self.output_path,
-                           feature=self.language + "_branches")
+        self.write_output(data=branches, feature="branches")
 
     def contributors_to_json(self):
         """
@@ -251,20 +917,16 @@ class DataMinePipeline(base.Request):
                     repo)
                 repo_user_organizations[repo] = users.get("organization_users")
 
-            utils.dict_to_json(
-                data=repo_user_organizations,
-                data_path=self.output_path,
-                feature=self.language + "_organization_users")
+            self.write_output(data=repo_user_organizations,
+                              feature="organization_users")
             self.logger.debug("Getting contributor count.")
             # Contributor_count
             contributor_count = utils.get_contributors(
                 contributors_data,
                 check_contrib=True)
 
-            utils.dict_to_json(
-                data=contributor_count,
-                data_path=self.output_path,
-                feature=self.language + "_contributor_count")
+            self.write_output(data=contributor_count,
+                              feature="contributor_count")
             repo_organizations_count = {}
             for repo, users in repo_user_organizations.items():
                 distinct_org = set()
@@ -276,10 +938,8 @@ class DataMinePipeline(base.Request):
                                 distinct_org.add(org_login)
                 distinct_org = list(distinct_org)
                 repo_organizations_count[repo] = distinct_org
-            utils.dict_to_json(
-                data=repo_organizations_count,
-                data_path=self.output_path,
-                feature=self.language + "_organizations")
+            self.write_output(data=repo_organizations_count,
+                              feature="organizations")
 
     def search_to_json(self):
         """
@@ -314,11 +974,12 @@ class DataMinePipeline(base.Request):
             self.logger.info("Searching repos")
             self.query_parameters = ("pushed:>2022-12-31+language:" +
                                      self.language + search_query)
-        if self.repo_list:
+        if self.repo_list or self.query_parameters:
             self.select_repos(
                 repo_nr=self.repo_num,
                 repo_list=self.repo_list,
-                query_parameters=self.query_parameters)
+                query_parameters=self.query_parameters,
+                sharded=self.sharded_search)
             self.logger.info(
                 "Finished getting repos for language %s",
                 self.language)
@@ -328,45 +989,120 @@ class DataMinePipeline(base.Request):
             )
             sys.exit()
 
-        for data_query in self.query_functions:
-            self.logger.info("Starting function %s", data_query.__name__)
-            repeat = True
-            while repeat:
-                try:
-                    data_query()
-                    repeat = False
-                    self.logger.info("Finished function %s successfully",
-                                     data_query.__name__)
-                    time.sleep(240)
-                except Exception as error:
-                    self.logger.error(
-                        "Error at function %s:%s",
-                        data_query.__name__, error)
-                    raise
+        self.order_repos()
+        self.detect_changes()
+        self.gate_stages()
+        self.query_functions = self.build_pipeline()
+        if not self.run_stages:
+            return
+        if self.stage_gating:
+            self.write_output(data=self.skipped_units, feature="skipped")
+        self.progress.plan(
+            language=self.language,
+            stages=[stage.name for stage in self.query_functions],
+            units=len(self.selected_repos_dict))
+        self.progress.start(
+            status_path=os.path.join(Path(self.output_path).parent,
+                                     "logs", "status.json"),
+            interval=self.status_interval)
+        if self.streaming:
+            self.run_streaming()
+        else:
+            if self.priority_batch_size:
+                self.run_batches()
+            else:
+                scheduler.StageScheduler(
+                    stages=self.query_functions,
+                    logger=self.logger,
+                    concurrent=self.concurrent_stages,
+                    on_finished=lambda stage: self.progress.complete(
+                        language=self.language, stage=stage.name)).run()
+            if self.unit_time_budget:
+                self.retry_partial_units()
+        if self.owns_budget:
+            self.progress.stop()
 
-    def build_pipeline(self):
+    def build_pipeline(self) -> List[scheduler.Stage]:
         """
-        Pipeline, passing all functions and runs for each language
+        Pipeline, passing all functions and runs for each language.
+        Each stage declares the resource classes it requests:
+        api (REST API), graphql (GraphQL API), web (GitHub pages)
+        and git (local clones), and the stages it depends on.
+        Stages running concurrently get a view of their own each.
         """
-
+        if self.dependency_source == "sbom":
+            dependency_resources = ["api"]
+        else:
+            dependency_resources = ["web"]
+        if self.branch_source == "graphql":
+            branch_resources = ["graphql"]
+        elif self.branch_source == "git":
+            branch_resources = ["git"]
+        else:
+            branch_resources = ["web", "api"]
+        if self.commit_source == "git":
+            commit_resources = ["git"]
+        else:
+            commit_resources = ["api"]
+        # Stages using the repository data of the base data
+        base_stage = ["base_data_to_json"]
         query_functions = [
-            self.base_data_to_json,
-            self.forks_to_json,
-            self.pulls_issues_to_json,
-            self.commits_to_json,
-            self.single_commits_to_json,
-            self.issue_comments_to_json,
-            self.upstream_dependencies_to_json,
-            self.downstream_dependencies_to_json,
-            self.branches_to_json,
-            self.contributors_to_json
+            scheduler.Stage(self.base_data_to_json, ["api"]),
+            scheduler.Stage(self.forks_to_json, ["api"]),
+            scheduler.Stage(self.pulls_issues_to_json, ["api"]),
+            scheduler.Stage(self.commits_to_json, commit_resources),
+            scheduler.Stage(self.single_commits_to_json, commit_resources),
+            scheduler.Stage(self.issue_comments_to_json, ["api"]),
+            scheduler.Stage(self.upstream_dependencies_to_json,
+                            dependency_resources, depends_on=base_stage),
+            scheduler.Stage(self.downstream_dependencies_to_json, ["web"],
+                            depends_on=base_stage),
+            scheduler.Stage(self.branches_to_json, branch_resources,
+                            depends_on=base_stage),
+            scheduler.Stage(self.contributors_to_json, ["api"],
+                            depends_on=base_stage)
         ]
+        for stage in query_functions:
+            # Views keep the state of a stage (e.g. base_data,
+            # partial_repos, feature_pause) apart from concurrent stages
+            if (self.concurrent_stages or self.excluded_repos(stage.name) or
+                    self.unit_time_budget):
+                stage.function = self.restricted_stage(stage.name)
         return query_functions
 
 
-def run_pipeline(start_date, languages, get_existing_repos, read_csv=""):
+def run_languages_concurrently(start_date, languages, get_existing_repos,
+                               repo_list):
+    """
+    Mines all languages concurrently in one process. The pipelines
+    share one connection pool, token pool and rate limiters, so their
+    requests are interleaved within the global rate budget.
+    """
+    tokens = getattr(constants, "API_TOKENS", [constants.API_TOKEN])
+    request_budget = budget.RequestBudget(
+        tokens=tokens, pool_size=4 * len(languages), throttle=True)
+    try:
+        with ThreadPoolExecutor(max_workers=len(languages)) as executor:
+            pipelines = [executor.submit(DataMinePipeline,
+                                         language=language,
+                                         filter_date=start_date,
+                                         repo_nr=1000,
+                                         get_existing_repos=get_existing_repos,
+                                         repo_list=repo_list,
+                                         request_budget=request_budget)
+                         for language in languages]
+            for pipeline in pipelines:
+                pipeline.result()
+    finally:
+        request_budget.close()
+
+
+def run_pipeline(start_date, languages, get_existing_repos, read_csv="",
+                 concurrent_languages=False):
     """
     Run data collection pipeline.
+    concurrent_languages: True to mine all languages at once within
+    one throttled rate budget, see run_languages_concurrently.
     """
     date_file = open("start_date", "w", encoding="utf-8")
     date_file.write(str(start_date))
@@ -386,6 +1122,11 @@ def run_pipeline(start_date, languages, get_existing_repos, read_csv=""):
                          get_existing_repos=get_existing_repos,
                          repo_list=repo_list)
 
+    elif concurrent_languages:
+        run_languages_concurrently(start_date=start_date,
+                                   languages=languages,
+                                   get_existing_repos=get_existing_repos,
+                                   repo_list=repo_list)
     else:
         for language in languages:
             DataMinePipeline(language=language,
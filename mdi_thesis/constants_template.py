@@ -3,3 +3,7 @@ Module to store confidental information.
 Includes API Token.
 """
 API_TOKEN = "YOUR_TOKEN"
+# Optional: Several tokens, which are used in turns
+# API_TOKENS = [API_TOKEN]
+# Optional: Log levels per module or package, default DEBUG
+# LOG_LEVELS = {"mdi_thesis.base.base": "INFO"}
@@ -0,0 +1,300 @@
+"""
+GH Archive Importer
+
+Author: Jacqueline Schmatz
+Description: Builds the issue, pull request, fork, release and issue
+comment data of the selected repositories from local GH Archive
+hour files (https://www.gharchive.org) instead of the REST API.
+"""
+
+import glob
+import gzip
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from pathlib import Path
+from typing import Any, Dict, List, Set
+from dateutil import relativedelta
+import mdi_thesis.base.utils as utils
+import mdi_thesis.base_data_miner as base_data_miner
+
+# Datasets built from each event type
+EVENT_DATASETS = {
+    "IssuesEvent": ["issue"],
+    "IssueCommentEvent": ["issue", "issue_comments"],
+    "PullRequestEvent": ["pull_requests"],
+    "ForkEvent": ["forks"],
+    "ReleaseEvent": ["release"]
+}
+# Event types as they appear in the compact json lines,
+# to skip other events without parsing them
+EVENT_MARKERS = ['"type":"' + event_type + '"'
+                 for event_type in EVENT_DATASETS]
+
+# Keys kept besides the features, to find the latest version of
+# an object and its period
+VERSION_KEYS = ["id", "number", "created_at", "updated_at", "published_at"]
+
+# Repository ids and kept keys per dataset of the worker processes,
+# see init_worker
+REPO_IDS = set()  # type: Set[int]
+DATASET_KEYS = {}  # type: Dict[str, List[str]]
+
+
+def init_worker(repo_ids: Set[int], dataset_keys: Dict[str, List[str]]):
+    """
+    Sets the repository ids and kept keys once per worker process.
+    :param repo_ids: Ids of the selected repositories
+    :param dataset_keys: Keys of the objects kept per dataset,
+    see get_dataset_keys
+    """
+    global REPO_IDS, DATASET_KEYS
+    REPO_IDS = repo_ids
+    DATASET_KEYS = dataset_keys
+
+
+def get_features(query_features: Dict[str, Any], dataset: str
+                 ) -> List[str]:
+    """
+    :param query_features: Content of query_features.json
+    :param dataset: Dataset name, e.g. issue
+    :return: Features of the objects of the dataset in the output
+    """
+    if dataset == "issue_comments":
+        return query_features.get(dataset).get("subfeature_list")
+    return query_features.get(dataset).get("feature_list")
+
+
+def get_dataset_keys(query_features: Dict[str, Any]
+                     ) -> Dict[str, List[str]]:
+    """
+    Gets the keys of the objects needed for the output, so the workers
+    do not pass the full event payloads back.
+    :param query_features: Content of query_features.json
+    :return: Features and VERSION_KEYS per dataset
+    """
+    return {dataset: sorted(set(get_features(query_features, dataset)) |
+                            set(VERSION_KEYS))
+            for dataset in ["issue", "issue_comments", "pull_requests",
+                            "forks", "release"]}
+
+
+def project(obj: Dict[str, Any], dataset: str) -> Dict[str, Any]:
+    """
+    :param obj: Object of an event payload
+    :param dataset: Dataset of the object
+    :return: Object with the kept keys of the dataset
+    """
+    keys = DATASET_KEYS.get(dataset)
+    if keys is None:
+        return obj
+    return {key: obj[key] for key in keys if key in obj}
+
+
+def keep_latest(objects: Dict[Any, Dict[str, Any]], obj: Dict[str, Any]):
+    """
+    Stores an object by its id, unless a newer version is stored.
+    :param objects: Objects per id
+    :param obj: Object of an event payload
+    """
+    def version(element):
+        return (element.get("updated_at") or element.get("published_at") or
+                element.get("created_at") or "")
+
+    previous = objects.get(obj.get("id"))
+    if previous is None or version(obj) >= version(previous):
+        objects[obj.get("id")] = obj
+
+
+def read_hour_file(path: str) -> Dict[str, Dict[int, Any]]:
+    """
+    Reads the events of the selected repositories from one hour file.
+    Only the keys of the objects needed for the output are kept.
+    :param path: Path of a GH Archive .json.gz file
+    :return: Objects per dataset, repository and object id,
+    issue comments per dataset, repository, issue number and comment id.
+    """
+    datasets = {"issue": {}, "issue_comments": {}, "pull_requests": {},
+                "forks": {}, "release": {}}  # type: Dict[str, Dict]
+    with gzip.open(path, "rt", encoding="utf-8", errors="replace") as file:
+        for line in file:
+            if not any(marker in line for marker in EVENT_MARKERS):
+                continue
+            event = json.loads(line)
+            repo_id = (event.get("repo") or {}).get("id")
+            if repo_id not in REPO_IDS:
+                continue
+            event_type = event.get("type")
+            payload = event.get("payload") or {}
+            if event_type in ["IssuesEvent", "IssueCommentEvent"]:
+                issue = payload.get("issue")
+                if issue:
+                    keep_latest(datasets["issue"].setdefault(repo_id, {}),
+                                project(issue, "issue"))
+                comment = payload.get("comment")
+                if (event_type == "IssueCommentEvent" and issue and
+                        comment and payload.get("action") != "deleted"):
+                    keep_latest(
+                        datasets["issue_comments"].setdefault(
+                            repo_id, {}).setdefault(issue.get("number"), {}),
+                        project(comment, "issue_comments"))
+            elif event_type == "PullRequestEvent":
+                pull_request = payload.get("pull_request")
+                if pull_request:
+                    keep_latest(
+                        datasets["pull_requests"].setdefault(repo_id, {}),
+                        project(pull_request, "pull_requests"))
+            elif event_type == "ForkEvent":
+                forkee = payload.get("forkee")
+                if forkee:
+                    keep_latest(datasets["forks"].setdefault(repo_id, {}),
+                                project(forkee, "forks"))
+            elif event_type == "ReleaseEvent":
+                release = payload.get("release")
+                if release:
+                    keep_latest(datasets["release"].setdefault(repo_id, {}),
+                                project(release, "release"))
+    return datasets
+
+
+def merge_datasets(merged: Dict[str, Dict[int, Any]],
+                   datasets: Dict[str, Dict[int, Any]]):
+    """
+    Merges the datasets of one hour file into the merged datasets.
+    :param merged: Datasets of the previous hour files
+    :param datasets: Datasets of one hour file
+    """
+    for dataset, repos in datasets.items():
+        for repo_id, objects in repos.items():
+            merged_objects = merged[dataset].setdefault(repo_id, {})
+            if dataset == "issue_comments":
+                for number, comments in objects.items():
+                    merged_comments = merged_objects.setdefault(number, {})
+                    for comment in comments.values():
+                        keep_latest(merged_comments, comment)
+            else:
+                for obj in objects.values():
+                    keep_latest(merged_objects, obj)
+
+
+class GHArchiveImporter:
+    """
+    Imports GH Archive hour files for the selected repositories of
+    pipelines and writes the datasets in the format of the miner.
+    The hour files are read once for all pipelines.
+    """
+    def __init__(self, pipelines: List[base_data_miner.DataMinePipeline],
+                 workers: int = 0) -> None:
+        """
+        :param pipelines: Pipelines (e.g. one per language) with
+        selected repositories, their filter date and output.
+        :param workers: Processes decompressing hour files in parallel,
+        0 for the number of CPUs.
+        """
+        self.pipelines = pipelines
+        self.logger = pipelines[0].logger
+        self.workers = workers or os.cpu_count() or 1
+
+    def read_files(self, paths: List[str]) -> Dict[str, Dict[int, Any]]:
+        """
+        Reads the hour files in parallel.
+        :param paths: Paths of the hour files
+        :return: Merged datasets of all files
+        """
+        merged = {"issue": {}, "issue_comments": {}, "pull_requests": {},
+                  "forks": {}, "release": {}}  # type: Dict[str, Dict]
+        repo_ids = set()  # type: Set[int]
+        for pipeline in self.pipelines:
+            repo_ids.update(pipeline.selected_repos_dict)
+        dataset_keys = get_dataset_keys(self.pipelines[0].query_features)
+        with ProcessPoolExecutor(max_workers=self.workers,
+                                 initializer=init_worker,
+                                 initargs=(repo_ids,
+                                           dataset_keys)) as executor:
+            for file_num, datasets in enumerate(
+                    executor.map(read_hour_file, paths), start=1):
+                merge_datasets(merged, datasets)
+                if file_num % 100 == 0:
+                    self.logger.info("Read hour file %s of %s",
+                                     file_num, len(paths))
+        return merged
+
+    def to_output(self, pipeline: base_data_miner.DataMinePipeline,
+                  dataset: str, repos: Dict[int, Any]) -> Dict[int, Any]:
+        """
+        Converts a dataset to the format of the miner: the features of
+        query_features.json, newest objects first and trimmed to the
+        periods of the stages.
+        :param pipeline: Pipeline of the selected repositories
+        :param dataset: Dataset name, e.g. issue
+        :param repos: Objects per repository and object id
+        :return: Data per repository
+        """
+        query_features = pipeline.query_features
+        output = {}  # type: Dict[int, Any]
+        for repo_id in pipeline.selected_repos_dict:
+            objects = repos.get(repo_id, {})
+            features = get_features(query_features, dataset)
+            if dataset == "issue_comments":
+                output[repo_id] = {
+                    number: [{feature: comment.get(feature)
+                              for feature in features}
+                             for comment in comments.values()]
+                    for number, comments in objects.items()}
+            else:
+                elements = sorted(
+                    objects.values(),
+                    key=lambda obj: (obj.get("updated_at") or
+                                     obj.get("created_at") or ""),
+                    reverse=True)
+                output[repo_id] = [{feature: element.get(feature)
+                                    for feature in features}
+                                   for element in elements]
+        window = base_data_miner.CARRY_FORWARD_WINDOWS.get(dataset)
+        if window:
+            period = window[1].split("=")
+            since = (pipeline.filter_date - relativedelta.relativedelta(
+                **{period[0]: int(period[1])}))
+            output = utils.trim_to_window(
+                data=output, date_key=window[0],
+                since=datetime.combine(since, datetime.min.time()))
+        return output
+
+    def run(self, paths: List[str]):
+        """
+        Imports the hour files and writes the datasets.
+        :param paths: Paths of the hour files
+        """
+        self.logger.info("Importing %s hour files", len(paths))
+        merged = self.read_files(paths)
+        for pipeline in self.pipelines:
+            for dataset, repos in merged.items():
+                pipeline.write_output(
+                    data=self.to_output(pipeline=pipeline, dataset=dataset,
+                                        repos=repos),
+                    feature=dataset)
+        self.logger.info("Finished importing hour files")
+
+
+def main():
+    """
+    Setting parameters for the import here. The hour files
+    (e.g. 2023-08-01-15.json.gz) are read from inputs/gharchive.
+    """
+    start_date = date.today()
+    languages = ["php", "cpp", "python", "JavaScript", "java"]
+    curr_path = Path(os.path.dirname(__file__))
+    paths = sorted(glob.glob(os.path.join(
+        curr_path.parents[0], "inputs", "gharchive", "*.json.gz")))
+    pipelines = [base_data_miner.DataMinePipeline(
+        language=language,
+        filter_date=start_date,
+        get_existing_repos=True,
+        run_stages=False,
+        change_detection=False) for language in languages]
+    GHArchiveImporter(pipelines=pipelines).run(paths=paths)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,29 +10,83 @@ import json
 import os
 import sys
 import inspect
+from collections import OrderedDict
 from pathlib import Path
-from typing import Dict, List
+from typing import Any, Dict, List, Union
 from datetime import date, datetime
 from dateutil import relativedelta
 import mdi_thesis.base.base as base
+import mdi_thesis.base.json_stream as json_stream
 import mdi_thesis.base.utils as utils
+import mdi_thesis.base_data_miner as base_data_miner
 import mdi_thesis.metrics as metrics
 
+# Parsed json data takes about 3 (indented) to 6 (compact) times
+# the size of its file
+JSON_MEMORY_FACTOR = 6
+
 
 class MetricsPipeline():
     """
     Pipeline which reads data, calculates metrics and stores the
     results in json files.
     """
-    def __init__(self, filter_date: date):
+    def __init__(self, filter_date: date,
+                 repo_ids: Union[List[int], None] = None,
+                 languages: Union[List[str], None] = None,
+                 data_source: Union[Dict[str, Dict[str, Any]], None] = None,
+                 metrics_subset: Union[List[str], None] = None,
+                 max_cache_mb: float = 4096):
+        """
+        :param filter_date: Date on which the metric periods end
+        :param repo_ids: Repositories for which the metrics are
+        recalculated and merged into the existing results,
+        None for all repositories.
+        :param languages: Languages for which the metrics are
+        calculated, None for all languages of the mined data.
+        :param data_source: Mined data per objective and language, e.g.
+        of DataMinePipeline.get_data_source, None to read the json files
+        of outputs/data.
+        :param metrics_subset: Metrics to be calculated, None for all
+        metrics of metrics_data_mapping.json. Only the objectives of
+        these metrics are read.
+        :param max_cache_mb: Memory in MB of the parsed data kept while
+        calculating the metrics of a language. Files whose data would
+        not fit are read repository by repository, see get_data.
+        """
         self.logger = base.get_logger(__name__)
+        self.repo_ids = None
+        if repo_ids is not None:
+            self.repo_ids = {str(repo) for repo in repo_ids}
         self.results_dict = {}
         self.languages = set()
-        self.data_dict = self.read_json()
-        self.filter_date = filter_date
         metrics_objective_mapping = open(
             "mdi_thesis/metrics_data_mapping.json", encoding="utf-8")
         self.metrics_objective_mapping = json.load(metrics_objective_mapping)
+        if metrics_subset is not None:
+            unknown = set(metrics_subset) - set(
+                self.metrics_objective_mapping)
+            if unknown:
+                raise ValueError("Unknown metrics: " +
+                                 ", ".join(sorted(unknown)))
+            self.metrics_objective_mapping = {
+                metric: objectives for metric, objectives
+                in self.metrics_objective_mapping.items()
+                if metric in metrics_subset}
+        self.metrics_subset = metrics_subset
+        self.data_source = data_source
+        self.max_cache_mb = max_cache_mb
+        self.cache = OrderedDict()  # type: OrderedDict[tuple, Any]
+        self.cache_sizes = {}  # type: dict[tuple, int]
+        self.data_files = {}  # type: dict[str, dict[str, str]]
+        if data_source is None:
+            self.data_files = self.read_json()
+        else:
+            for language_data in data_source.values():
+                self.languages.update(language_data)
+        if languages is not None:
+            self.languages &= set(languages)
+        self.filter_date = filter_date
         self.metric_periods = {}
         self.metric_objective_periods = {}
 
@@ -41,38 +95,87 @@ class MetricsPipeline():
             sys.path.append(parent_dir)
         self.output_path = os.path.join(parent_dir, "outputs", "results")
 
-    def read_json(self):
+    def read_json(self) -> Dict[str, Dict[str, str]]:
         """
-        Reads all json files returned by base_data_miner.py
-        Stores results in dictionary by objective and language.
+        Finds the json files returned by base_data_miner.py, which
+        contain objectives of the metrics. The files are read on demand
+        by get_data.
+        :return: File path by objective and language
         """
         parent_dir = os.path.abspath('.')
         if parent_dir not in sys.path:
             sys.path.append(parent_dir)
-        combined_dict = {}
+        objectives = {objective for metric_objectives
+                      in self.metrics_objective_mapping.values()
+                      for objective in metric_objectives}
+        objectives.add("skipped")
+        data_files = {}  # type: Dict[str, Dict[str, str]]
         path = os.path.join(parent_dir, "outputs", "data")
-        self.logger.info("Reading json files from path %s", path)
+        self.logger.info("Finding json files in path %s", path)
         for filename in os.listdir(path):
             if filename.endswith(".json"):
                 objective = filename.split(".")[0].split("_", 1)[1]
                 language = filename.split("_")[0]
                 self.languages.add(language)
-                file_path = os.path.join(path, filename)
-                tmp_dict = utils.json_to_dict(path=file_path)
-                lang_dict = {}
-                lang_dict[language] = tmp_dict
-                if objective in combined_dict:
-                    combined_dict[objective].update(lang_dict)
-                else:
-                    combined_dict[objective] = lang_dict
-        return combined_dict
+                if objective in objectives:
+                    data_files.setdefault(objective, {})[language] = \
+                        os.path.join(path, filename)
+        return data_files
 
-    def filter_data(self, data: Dict,
+    def get_data(self, objective: str, language: str
+                 ) -> Union[Dict, json_stream.JsonMembers, None]:
+        """
+        Gets the data of an objective and language. Files are read on
+        first use and kept in memory as long as the estimated size of
+        the kept data (see utils.estimate_size) is within max_cache_mb,
+        the least recently used data is dropped first. Files whose data
+        would exceed max_cache_mb (JSON_MEMORY_FACTOR times the file
+        size) are not kept, their data is read repository by repository.
+        :param objective: Objective, e.g. issue
+        :param language: Programming language
+        :return: Data per repository, a read-only mapping reading the
+        data of a repository on access for large files, None if there
+        is no data
+        """
+        if self.data_source is not None:
+            return self.data_source.get(objective, {}).get(language)
+        key = (objective, language)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        path = self.data_files.get(objective, {}).get(language)
+        if path is None:
+            return None
+        if (os.path.getsize(path) * JSON_MEMORY_FACTOR >
+                self.max_cache_mb * 1024 * 1024):
+            self.logger.info("Streaming json file %s", path)
+            return json_stream.JsonMembers(path=path)
+        self.logger.info("Reading json file %s", path)
+        self.cache[key] = utils.json_to_dict(path=path)
+        self.cache_sizes[key] = utils.estimate_size(self.cache[key])
+        while (len(self.cache) > 1 and sum(self.cache_sizes.values()) >
+               self.max_cache_mb * 1024 * 1024):
+            evicted, _ = self.cache.popitem(last=False)
+            self.cache_sizes.pop(evicted)
+            self.logger.debug("Dropped data of %s from memory", evicted)
+        return self.cache[key]
+
+    def drop_language(self, language: str):
+        """
+        Drops the data of a language, whose metrics are calculated.
+        :param language: Programming language
+        """
+        for key in [key for key in self.cache if key[1] == language]:
+            self.cache.pop(key)
+            self.cache_sizes.pop(key)
+
+    def filter_data(self, data: Union[Dict, json_stream.JsonMembers],
                     filter_parameter: str,
                     filter_period: str):
         """
         Filters data according to parameter.
-        :param data: Data to be filtered
+        :param data: Data to be filtered per repository, large files
+        are read repository by repository.
         :param filter_parameter: Parameter of GitHub object
         on which the filter is applied.
         :param filter_period: Filter period for which the object
@@ -217,33 +320,35 @@ class MetricsPipeline():
             self.metric_periods = {}
             self.logger.info("Data Preparation for %s and objective %s",
                              language, objective)
-            objective_dict = {}
-            if objective in self.data_dict:
-                objective_dict = self.data_dict.get(objective)
-            else:
+            data_dict = self.get_data(objective=objective,
+                                      language=language)
+            if data_dict is None:
                 self.logger.critical("No dictionary found for %s", objective)
-            data_dict = {}
-            if objective_dict:
-                data_dict = objective_dict.get(language)
-                if data_dict:
-                    if filters:
-                        param = filters[0]
-                        period = filters[1]
-                        self.logger.debug(
-                            "Filtering objective %s for language %s",
-                            objective, language)
-                        filtered_data = self.filter_data(
-                            data=data_dict,
-                            filter_parameter=param,
-                            filter_period=period)
-                        prep_data[objective] = filtered_data
-                        self.logger.debug("Adding dict %s - to objective %s",
-                                          self.metric_periods, objective)
-                    else:
-                        self.logger.debug("Getting objective %s", objective)
-                        prep_data[objective] = data_dict
-                    self.metric_objective_periods[objective] = \
-                        self.metric_periods
+            if data_dict and objective == "repository" and \
+                    self.repo_ids is not None:
+                # Metrics are calculated for the repository data,
+                # only the data of these repositories is read
+                data_dict = {repo: data_dict[repo] for repo in data_dict
+                             if repo in self.repo_ids}
+            if data_dict:
+                if filters:
+                    param = filters[0]
+                    period = filters[1]
+                    self.logger.debug(
+                        "Filtering objective %s for language %s",
+                        objective, language)
+                    filtered_data = self.filter_data(
+                        data=data_dict,
+                        filter_parameter=param,
+                        filter_period=period)
+                    prep_data[objective] = filtered_data
+                    self.logger.debug("Adding dict %s - to objective %s",
+                                      self.metric_periods, objective)
+                else:
+                    self.logger.debug("Getting objective %s", objective)
+                    prep_data[objective] = data_dict
+                self.metric_objective_periods[objective] = \
+                    self.metric_periods
         return prep_data
 
     def run_metrics_to_json(self):
@@ -284,12 +389,22 @@ class MetricsPipeline():
                 except AttributeError as att_err:
                     self.logger.error("Attribute Error: %s\n", att_err)
                     raise
+            skipped_metrics = self.get_skipped_metrics(language=lang)
+            if self.repo_ids is not None or self.metrics_subset is not None:
+                metrics_results = self.merge_results(
+                    language=lang, metrics_results=metrics_results)
+                skipped_metrics = self.merge_skipped_metrics(
+                    language=lang, skipped_metrics=skipped_metrics)
             utils.dict_to_json(data=metrics_results,
                                data_path=self.output_path,
                                feature=lang + "_metrics"
                                )
+            utils.dict_to_json(data=skipped_metrics,
+                               data_path=self.output_path,
+                               feature=lang + "_skipped_metrics")
             metric_period_languages[lang] = metric_period_results
             self.results_dict[lang] = metrics_results
+            self.drop_language(language=lang)
         curr_path = Path(os.path.dirname(__file__))
         output_path = os.path.join(
             curr_path.parents[0], "outputs/results/", )
@@ -297,6 +412,102 @@ class MetricsPipeline():
                            data_path=output_path,
                            feature="metric_date_ranges")
 
+    def get_skipped_metrics(self, language: str) -> Dict:
+        """
+        Gets the metrics of repositories, for which objectives were
+        skipped by the stage gates of the data miner. Their results are
+        based on missing instead of empty data. They are stored in
+        {language}_skipped_metrics.json next to the results.
+        :param language: Programming language
+        :return: Skipped objectives per repository and metric
+        """
+        skipped_units = self.get_data(objective="skipped",
+                                      language=language)
+        skipped_metrics = {}
+        for repo, features in (skipped_units or {}).items():
+            if self.repo_ids is not None and repo not in self.repo_ids:
+                continue
+            for metric, objectives in self.metrics_objective_mapping.items():
+                skipped = [objective for objective in objectives
+                           if objective in features]
+                if skipped:
+                    skipped_metrics.setdefault(repo, {})[metric] = skipped
+        return skipped_metrics
+
+    def merge_results(self, language: str, metrics_results: Dict) -> Dict:
+        """
+        Merges recalculated metrics of some repositories or a subset of
+        the metrics into the existing results of the language.
+        :param language: Programming language
+        :param metrics_results: Results per metric and repository
+        :return: Existing results updated with the new results
+        """
+        path = os.path.join(self.output_path, language + "_metrics.json")
+        if not os.path.exists(path):
+            return metrics_results
+        existing = utils.json_to_dict(path=path)
+        for metric, results in metrics_results.items():
+            previous = existing.get(metric)
+            if (self.repo_ids is not None and
+                    isinstance(previous, dict) and isinstance(results, dict)):
+                previous.update({str(repo): value
+                                 for repo, value in results.items()})
+            else:
+                existing[metric] = results
+        return existing
+
+    def merge_skipped_metrics(self, language: str,
+                              skipped_metrics: Dict) -> Dict:
+        """
+        Merges the skipped metrics of recalculated repositories or
+        metrics into the existing skipped metrics of the language.
+        Recalculated metrics are no longer skipped, unless they are
+        skipped again.
+        :param language: Programming language
+        :param skipped_metrics: Skipped objectives per repository and
+        metric, see get_skipped_metrics
+        :return: Existing skipped metrics updated with the new ones
+        """
+        path = os.path.join(self.output_path,
+                            language + "_skipped_metrics.json")
+        if not os.path.exists(path):
+            return skipped_metrics
+        existing = utils.json_to_dict(path=path)
+        for repo in list(existing):
+            if self.repo_ids is None or repo in self.repo_ids:
+                existing[repo] = {
+                    metric: objectives for metric, objectives
+                    in existing[repo].items()
+                    if metric not in self.metrics_objective_mapping}
+                if not existing[repo]:
+                    del existing[repo]
+        for repo, repo_metrics in skipped_metrics.items():
+            existing.setdefault(repo, {}).update(repo_metrics)
+        return existing
+
+
+def run_mined_pipeline(start_date: date, languages: List[str],
+                       get_existing_repos: bool, persist_data: bool = True):
+    """
+    Mines the languages and calculates the metrics from the mined data
+    in memory, without reading the json files of outputs/data.
+    :param persist_data: False to not write the mined data to files
+    """
+    data_source = {}  # type: Dict[str, Dict[str, Any]]
+    for language in languages:
+        miner = base_data_miner.DataMinePipeline(
+            language=language,
+            filter_date=start_date,
+            repo_nr=1000,
+            get_existing_repos=get_existing_repos,
+            keep_data=True,
+            persist=persist_data)
+        for objective, language_data in miner.get_data_source().items():
+            data_source.setdefault(objective, {}).update(language_data)
+    pipeline = MetricsPipeline(filter_date=start_date,
+                               data_source=data_source)
+    pipeline.run_metrics_to_json()
+
 
 def run_pipeline(start_date: date):
     """
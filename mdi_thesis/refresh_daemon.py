@@ -0,0 +1,281 @@
+"""
+Refresh Daemon
+
+Author: Jacqueline Schmatz
+Description: Keeps the mined data current by refreshing the most
+stale units (repository and stage) first and recalculating the
+metrics of the refreshed repositories.
+"""
+
+import heapq
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from pathlib import Path
+from typing import Dict, List, Set, Tuple, Union
+import mdi_thesis.base.budget as budget
+import mdi_thesis.base.utils as utils
+import mdi_thesis.base_data_miner as base_data_miner
+import mdi_thesis.constants as constants
+import mdi_thesis.metrics_pipeline as metrics_pipeline
+
+
+class RefreshDaemon:
+    """
+    Refreshes units of the selected repositories of one language
+    ordered by their priority. The priority of a unit grows with the
+    time since its last refresh. It is raised if the repository was
+    pushed or updated since then and by the criticality score of the
+    repository. Units never refreshed come first.
+    """
+    def __init__(self, language: str, batch_size: int = 50,
+                 min_staleness: float = 7 * 24 * 3600,
+                 min_changed_staleness: float = 24 * 3600,
+                 change_weight: float = 10,
+                 metadata_interval: float = 24 * 3600,
+                 idle_sleep: float = 600,
+                 request_budget: Union[budget.RequestBudget, None] = None
+                 ) -> None:
+        """
+        :param language: Programming language of existing repositories
+        :param batch_size: Units refreshed before the metrics
+        are recalculated and the queue is rebuilt.
+        :param min_staleness: Seconds after which an unchanged unit
+        is refreshed.
+        :param min_changed_staleness: Seconds after which a unit of a
+        pushed or updated repository is refreshed.
+        :param change_weight: Additional priority weight of units
+        of pushed or updated repositories.
+        :param metadata_interval: Seconds between refreshes of the
+        repository data of all repositories (pushed_at, updated_at).
+        :param idle_sleep: Seconds waited if no unit is due.
+        :param request_budget: Session, tokens and rate limiters shared
+        with the daemons of other languages.
+        """
+        self.language = language
+        self.batch_size = batch_size
+        self.min_staleness = min_staleness
+        self.min_changed_staleness = min_changed_staleness
+        self.change_weight = change_weight
+        self.metadata_interval = metadata_interval
+        self.idle_sleep = idle_sleep
+        self.pipeline = base_data_miner.DataMinePipeline(
+            language=language,
+            filter_date=date.today(),
+            get_existing_repos=True,
+            run_stages=False,
+            change_detection=False,
+            request_budget=request_budget)
+        self.logger = self.pipeline.logger
+        self.stages = [stage.name for stage in self.pipeline.query_functions]
+        outputs_path = Path(self.pipeline.output_path).parent
+        self.state_path = os.path.join(outputs_path, "refresh")
+        os.makedirs(self.state_path, exist_ok=True)
+        self.metrics_path = os.path.join(
+            outputs_path, "results", language + "_metrics.json")
+        self.state = self.read_state()
+        self.metadata = self.read_output("repository")
+        self.criticality = {}  # type: Dict[str, float]
+
+    def read_state(self) -> Dict:
+        """
+        :return: Last refresh per repository and stage (epoch seconds)
+        and of the repository data.
+        """
+        path = os.path.join(self.state_path,
+                            self.language + "_refresh_state.json")
+        if os.path.exists(path):
+            return utils.json_to_dict(path=path)
+        return {"metadata_refreshed": None, "units": {}}
+
+    def write_state(self):
+        """
+        Stores the refresh state.
+        """
+        utils.dict_to_json(data=self.state, data_path=self.state_path,
+                           feature=self.language + "_refresh_state")
+
+    def read_output(self, feature: str) -> Dict:
+        """
+        :param feature: Feature of the output file
+        :return: Mined data of the feature, empty if not available
+        """
+        path = os.path.join(self.pipeline.output_path,
+                            self.language + "_" + feature + ".json")
+        if os.path.exists(path):
+            return utils.json_to_dict(path=path)
+        return {}
+
+    def read_criticality(self):
+        """
+        Reads the last criticality scores of the repositories.
+        """
+        if os.path.exists(self.metrics_path):
+            scores = utils.json_to_dict(path=self.metrics_path).get(
+                "criticality_score") or {}
+            self.criticality = {repo: score for repo, score
+                                in scores.items()
+                                if isinstance(score, (int, float))}
+
+    def last_activity(self, repo: str) -> Union[float, None]:
+        """
+        :param repo: Repository id
+        :return: Latest pushed_at or updated_at in epoch seconds
+        """
+        data = self.metadata.get(repo) or {}
+        timestamps = [datetime.strptime(data[key], '%Y-%m-%dT%H:%M:%SZ')
+                      for key in ["pushed_at", "updated_at"]
+                      if data.get(key)]
+        if not timestamps:
+            return None
+        return (max(timestamps) - datetime(1970, 1, 1)).total_seconds()
+
+    def priority(self, repo: str, stage: str,
+                 now: float) -> Union[float, None]:
+        """
+        :param repo: Repository id
+        :param stage: Stage name
+        :param now: Current time in epoch seconds
+        :return: Priority of the unit, None if it is not due
+        """
+        last = self.state["units"].get(repo, {}).get(stage)
+        if last is None:
+            return math.inf
+        staleness = now - last
+        activity = self.last_activity(repo)
+        changed = activity is not None and activity > last
+        if changed and staleness < self.min_changed_staleness:
+            return None
+        if not changed and staleness < self.min_staleness:
+            return None
+        weight = 1 + self.change_weight if changed else 1
+        return staleness * weight * (1 + self.criticality.get(repo, 0))
+
+    def build_queue(self) -> List[Tuple[float, str, str]]:
+        """
+        :return: Heap of the due units with their negated priority
+        """
+        now = time.time()
+        queue = []
+        for repo in self.pipeline.selected_repos_dict:
+            for stage in self.stages:
+                priority = self.priority(str(repo), stage, now)
+                if priority is not None:
+                    queue.append((-priority, str(repo), stage))
+        heapq.heapify(queue)
+        return queue
+
+    def refresh_metadata(self):
+        """
+        Refreshes the repository data of all repositories,
+        one request per repository.
+        """
+        self.logger.info("Refreshing repository data of %s",
+                         self.language)
+        self.pipeline.feature_pause = 0
+        data = self.pipeline.query_repository(
+            ["repository"], filters={}).get("repository") or {}
+        self.pipeline.stream_writer = utils.JsonLinesWriter(
+            data_path=self.pipeline.output_path, merge_existing=True)
+        self.pipeline.write_output(data=data, feature="repository")
+        self.pipeline.stream_writer.finalize()
+        self.pipeline.stream_writer = None
+        self.metadata = self.read_output("repository")
+        self.state["metadata_refreshed"] = time.time()
+        self.write_state()
+
+    def run_batch(self, queue: List[Tuple[float, str, str]]) -> Set[int]:
+        """
+        Refreshes the units with the highest priority.
+        :param queue: Heap of due units
+        :return: Refreshed repositories
+        """
+        self.pipeline.filter_date = date.today()
+        self.pipeline.stream_writer = utils.JsonLinesWriter(
+            data_path=self.pipeline.output_path, merge_existing=True)
+        refreshed = set()
+        units = 0
+        for _ in range(min(self.batch_size, len(queue))):
+            _, repo, stage = heapq.heappop(queue)
+            started = time.time()
+            if self.pipeline.run_unit(repo=int(repo), stage_name=stage):
+                self.state["units"].setdefault(repo, {})[stage] = started
+                refreshed.add(int(repo))
+                units += 1
+        self.pipeline.stream_writer.finalize()
+        self.pipeline.stream_writer = None
+        self.write_state()
+        self.logger.info("Refreshed %s units of %s repositories",
+                         units, len(refreshed))
+        return refreshed
+
+    def recalculate_metrics(self, repos: Set[int]):
+        """
+        Recalculates the metrics of the refreshed repositories.
+        :param repos: Repository ids
+        """
+        pipeline = metrics_pipeline.MetricsPipeline(
+            filter_date=date.today(), repo_ids=list(repos),
+            languages=[self.language])
+        pipeline.run_metrics_to_json()
+
+    def run(self, max_batches: Union[int, None] = None):
+        """
+        Refreshes units until max_batches is reached or forever.
+        :param max_batches: Number of batches, None to run forever
+        """
+        self.pipeline.progress.start(
+            status_path=os.path.join(self.state_path,
+                                     self.language + "_status.json"))
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            metadata_refreshed = self.state.get("metadata_refreshed")
+            if (metadata_refreshed is None or
+                    time.time() - metadata_refreshed >=
+                    self.metadata_interval):
+                self.refresh_metadata()
+            self.read_criticality()
+            queue = self.build_queue()
+            if not queue:
+                self.logger.info("No units due, sleeping %s seconds",
+                                 self.idle_sleep)
+                time.sleep(self.idle_sleep)
+                continue
+            refreshed = self.run_batch(queue)
+            if refreshed:
+                self.recalculate_metrics(refreshed)
+            batches += 1
+
+
+def run_daemons(languages: List[str]):
+    """
+    Runs a refresh daemon per language within one rate budget.
+    """
+    tokens = getattr(constants, "API_TOKENS", [constants.API_TOKEN])
+    request_budget = budget.RequestBudget(
+        tokens=tokens, pool_size=4 * len(languages), throttle=True)
+    try:
+        with ThreadPoolExecutor(max_workers=len(languages)) as executor:
+            daemons = [executor.submit(
+                lambda language: RefreshDaemon(
+                    language=language,
+                    request_budget=request_budget).run(), language)
+                       for language in languages]
+            for daemon in daemons:
+                daemon.result()
+    finally:
+        request_budget.close()
+
+
+def main():
+    """
+    Setting parameters for the daemon here.
+    """
+    languages = ["php", "cpp", "python", "JavaScript", "java"]
+    run_daemons(languages=languages)
+
+
+if __name__ == "__main__":
+    main()
@@ -42,5 +42,6 @@ setup(
     entry_points={
         "console_scripts": ["mdi_thesis = mdi_thesis.__main__:main"]
     },
-    extras_require={"test": read_requirements("requirements-test.txt")},
+    extras_require={"test": read_requirements("requirements-test.txt"),
+                    "fast": ["orjson"]},
 )
@@ -0,0 +1,51 @@
+import os
+import threading
+
+import mdi_thesis.base.utils as utils
+import mdi_thesis.base_data_miner as base_data_miner
+
+# Outputs per batch, the last part retries repository 1
+PARTS = [
+    {"issue": {1: [{"id": 10}], 2: [{"id": 20}]},
+     "summary": {"stars": {1: 5, 2: 7}, "forks": {1: 1}}},
+    {"issue": {3: [{"id": 30}]},
+     "summary": {"stars": {3: 9}}},
+    {"issue": {1: [{"id": 10}, {"id": 11}]},
+     "summary": {"forks": {1: 2}}},
+]
+
+
+def get_pipeline(output_path):
+    pipeline = base_data_miner.DataMinePipeline.__new__(
+        base_data_miner.DataMinePipeline)
+    pipeline.language = "python"
+    pipeline.output_path = output_path
+    pipeline.keep_data = True
+    pipeline.persist = True
+    pipeline.data_lock = threading.Lock()
+    pipeline.mined_data = {}
+    pipeline.carried_data = {"issue": {4: [{"id": 40}]}}
+    pipeline.stream_writer = None
+    return pipeline
+
+
+def test_data_source_matches_output_files(tmpdir):
+    pipeline = get_pipeline(str(tmpdir))
+    for number, part in enumerate(PARTS):
+        pipeline.stream_writer = utils.JsonLinesWriter(
+            data_path=str(tmpdir), merge_existing=number > 0)
+        if number == 0:
+            for feature, data in pipeline.carried_data.items():
+                pipeline.write_output(data=data, feature=feature)
+        for feature, data in part.items():
+            pipeline.write_output(data=data, feature=feature)
+        pipeline.stream_writer.finalize()
+    data_source = pipeline.get_data_source()
+    for feature in ["issue", "summary"]:
+        persisted = utils.json_to_dict(
+            path=os.path.join(str(tmpdir), "python_" + feature + ".json"))
+        assert data_source[feature]["python"] == persisted
+    assert data_source["summary"]["python"] == {
+        "stars": {"1": 5, "2": 7, "3": 9}, "forks": {"1": 2}}
+    assert data_source["issue"]["python"]["1"] == [{"id": 10}, {"id": 11}]
+    assert pipeline.mined_data == {}
@@ -0,0 +1,53 @@
+import logging
+import pytest
+
+import mdi_thesis.base.base as base
+
+PAGE = (b"<html><head>" + b"x" * 9000 + b"</head><body>" +
+        b'<a class="btn-link selected" href="?dependent_type=REPOSITORY">' +
+        b"\n" + b" " * 9000 + b"\n" +
+        b'<svg class="octicon"></svg>\n1,234\n Repositories\n</a>' +
+        b'<a class="btn-link" href="?dependent_type=PACKAGE">' +
+        b"56\n Packages</a>" + b"y" * 20000 + b"</body></html>")
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, page, chunk_size):
+        self.page = page
+        self.chunk_size = chunk_size
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.page), self.chunk_size):
+            yield self.page[start:start + self.chunk_size]
+
+    def close(self):
+        pass
+
+
+class FakeSession:
+    def __init__(self, page, chunk_size):
+        self.page = page
+        self.chunk_size = chunk_size
+
+    def get(self, url, stream, timeout):
+        return FakeResponse(self.page, self.chunk_size)
+
+
+def get_count(page, chunk_size):
+    request = base.Request.__new__(base.Request)
+    request.logger = logging.getLogger(__name__)
+    request.session = FakeSession(page, chunk_size)
+    return request.get_dependents_count("https://github.com/a/b/network")
+
+
+@pytest.mark.parametrize("chunk_size",
+                         [1, 7, 20, 8192, 9050, 9020, len(PAGE)])
+def test_dependents_count_split_across_chunks(chunk_size):
+    assert get_count(PAGE, chunk_size) == 1234
+
+
+def test_dependents_count_missing():
+    page = PAGE.replace(b"1,234", b"")
+    assert get_count(page, 9050) is None
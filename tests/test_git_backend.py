@@ -0,0 +1,149 @@
+import logging
+import os
+import subprocess
+from datetime import date
+
+import pytest
+
+import mdi_thesis.base.git_backend as git_backend
+import mdi_thesis.base.utils as utils
+
+ALICE = ("Alice", "alice@example.com")
+BOB = ("Bob", "bob@example.com")
+
+
+def git(path, *args, author=ALICE, committer=ALICE, when=""):
+    env = dict(os.environ,
+               GIT_AUTHOR_NAME=author[0], GIT_AUTHOR_EMAIL=author[1],
+               GIT_COMMITTER_NAME=committer[0],
+               GIT_COMMITTER_EMAIL=committer[1],
+               GIT_AUTHOR_DATE=when, GIT_COMMITTER_DATE=when)
+    subprocess.run(["git", "-C", path, "-c", "commit.gpgsign=false"] +
+                   list(args), env=env, check=True, capture_output=True)
+
+
+def write(path, name, content):
+    mode = "wb" if isinstance(content, bytes) else "w"
+    with open(os.path.join(path, name), mode) as file:
+        file.write(content)
+
+
+@pytest.fixture
+def fixture_repo(tmpdir):
+    """
+    main: first (Alice), second (Alice, committed by Bob, co-author)
+    merged: first, merged into main
+    feature: first, old (stale)
+    """
+    path = str(tmpdir.join("fixture"))
+    os.makedirs(path)
+    git(path, "init", "--quiet", "--initial-branch=main")
+    write(path, "a.txt", "one\ntwo\nthree\n")
+    git(path, "add", "a.txt")
+    git(path, "commit", "--quiet", "-m", "first",
+        when="2023-07-01T12:00:00+02:00")
+    git(path, "branch", "merged")
+    git(path, "checkout", "--quiet", "-b", "feature")
+    write(path, "b.txt", "feature\n")
+    git(path, "add", "b.txt")
+    git(path, "commit", "--quiet", "-m", "old",
+        when="2023-01-10T08:00:00-05:00")
+    git(path, "checkout", "--quiet", "main")
+    write(path, "a.txt", "one\n2\nthree\nfour\n")
+    write(path, "image.bin", b"\x00\x01\x02\x00")
+    git(path, "add", "a.txt", "image.bin")
+    git(path, "commit", "--quiet", "-m",
+        "second\n\nCo-authored-by: Carol <carol@example.com>",
+        committer=BOB, when="2023-07-20T23:30:00-03:00")
+    backend = git_backend.GitBackend(
+        clone_path=str(tmpdir.join("clones")),
+        logger=logging.getLogger(__name__))
+    return backend, backend.update(repo_id=1, url=path)
+
+
+def test_get_log(fixture_repo):
+    backend, path = fixture_repo
+    commits = backend.get_log(path, "2023-06-01T00:00:00Z", numstat=True)
+    assert [commit["commit"]["message"] for commit in commits] == [
+        "second\n\nCo-authored-by: Carol <carol@example.com>", "first"]
+    second, first = commits
+    assert second["commit"]["author"] == {
+        "name": "Alice", "email": "alice@example.com",
+        "date": "2023-07-21T02:30:00Z"}
+    assert second["commit"]["committer"]["email"] == "bob@example.com"
+    assert first["commit"]["committer"]["date"] == "2023-07-01T10:00:00Z"
+    assert sorted(second["files"], key=lambda file: file["filename"]) == [
+        {"filename": "a.txt", "additions": 2, "deletions": 1,
+         "changes": 3},
+        {"filename": "image.bin", "additions": 0, "deletions": 0,
+         "changes": 0}]
+    assert first["files"] == [{"filename": "a.txt", "additions": 3,
+                               "deletions": 0, "changes": 3}]
+
+
+def test_get_log_since(fixture_repo):
+    backend, path = fixture_repo
+    commits = backend.get_log(path, "2023-07-10T00:00:00Z", numstat=False)
+    assert [commit["commit"]["message"][:6] for commit in commits] == [
+        "second"]
+    assert commits[0]["files"] == []
+
+
+def test_get_commits(fixture_repo):
+    backend, path = fixture_repo
+    commits = backend.get_commits(path, "2023-06-01T00:00:00Z")
+    assert set(commits[0]) == {"sha", "commit", "committer"}
+    assert commits[0]["committer"] == {"id": "bob@example.com",
+                                       "login": None}
+
+
+def test_get_single_commits(fixture_repo):
+    backend, path = fixture_repo
+    single_commits = backend.get_single_commits(path,
+                                                "2023-06-01T00:00:00Z")
+    assert len(single_commits) == 2
+    for sha, rows in single_commits.items():
+        assert len(sha) == 40
+        assert set(rows[0]) == {"stats", "commit", "files"}
+    second = [rows[0] for rows in single_commits.values()
+              if rows[0]["commit"]["message"].startswith("second")][0]
+    assert second["stats"] == {"total": 3, "additions": 2, "deletions": 1}
+    # Co-authors are read from the message as for the REST API
+    contributors = utils.get_contributor_per_files(single_commits)
+    assert contributors["a.txt"] == {"alice@example.com",
+                                     "carol@example.com"}
+    assert contributors["image.bin"] == {"alice@example.com",
+                                         "carol@example.com"}
+
+
+def test_get_branches(fixture_repo):
+    backend, path = fixture_repo
+    stale_branches, active_branches, branches = backend.get_branches(
+        path, stale_date=date(2023, 5, 1))
+    assert stale_branches == {"feature": "Compare"}
+    assert active_branches == {"main": "", "merged": "Merged"}
+    assert set(branches) == {"main", "merged", "feature"}
+    head = branches["feature"][0]["commit"]
+    assert len(head["sha"]) == 40
+    assert head["commit"]["author"] == {
+        "name": "Alice", "email": "alice@example.com",
+        "date": "2023-01-10T13:00:00Z"}
+    assert branches["main"][0]["commit"]["commit"]["committer"] == {
+        "name": "Bob", "email": "bob@example.com",
+        "date": "2023-07-21T02:30:00Z"}
+
+
+def test_update_fetches_new_commits(fixture_repo, tmpdir):
+    backend, path = fixture_repo
+    source = str(tmpdir.join("fixture"))
+    write(source, "c.txt", "new\n")
+    git(source, "add", "c.txt")
+    git(source, "commit", "--quiet", "-m", "third",
+        when="2023-07-25T00:00:00+00:00")
+    # Clones are updated once per backend
+    assert backend.update(repo_id=1, url=source) == path
+    assert len(backend.get_log(path, "2023-06-01T00:00:00Z", False)) == 2
+    backend = git_backend.GitBackend(clone_path=backend.clone_path,
+                                     logger=backend.logger)
+    backend.update(repo_id=1, url=source)
+    assert len(backend.get_log(path, "2023-06-01T00:00:00Z", False)) == 3
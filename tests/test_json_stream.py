@@ -0,0 +1,118 @@
+import json
+import os
+
+import pytest
+
+import mdi_thesis.base.json_stream as json_stream
+import mdi_thesis.base.utils as utils
+
+DATA = {
+    "1": {"name": "ü€𝄞 multibyte", "stars": 1234567890},
+    "2": [1.5e10, -0.25, 12345, True, None, "x\"y\\z"],
+    "3": {},
+    "4": [],
+    "5": "€" * 50,
+    "6": 7
+}
+
+
+def members(buffer):
+    return [(key, value, buffer[start:end])
+            for key, value, start, end in json_stream.iter_members(buffer)]
+
+
+@pytest.mark.parametrize("indent", [None, 2])
+@pytest.mark.parametrize("chunk_size", list(range(1, 40)) + [64, 65536])
+def test_members_cut_at_chunk_end(monkeypatch, chunk_size, indent):
+    # Small chunks cut multibyte characters, numbers and strings
+    monkeypatch.setattr(json_stream, "CHUNK_SIZE", chunk_size)
+    buffer = json.dumps(DATA, indent=indent,
+                        ensure_ascii=False).encode("utf-8")
+    result = members(buffer)
+    assert [(key, value) for key, value, _ in result] == list(DATA.items())
+    for key, value, encoded in result:
+        assert json.loads(encoded) == value
+
+
+def test_member_larger_than_chunk():
+    data = {"1": ["ä" * 1000] * 300, "2": 1}
+    buffer = json.dumps(data, ensure_ascii=False).encode("utf-8")
+    assert len(buffer) > 4 * json_stream.CHUNK_SIZE
+    assert [(key, value) for key, value, _ in members(buffer)] == \
+        list(data.items())
+
+
+@pytest.mark.parametrize("buffer", [b"{}", b" \n{ \n}\n"])
+def test_empty_object(buffer):
+    assert members(buffer) == []
+
+
+@pytest.mark.parametrize("buffer", [b"[]", b'{"1" 2}', b'{"1": 2 "2": 3}',
+                                    b'{"1": [1, 2}'])
+def test_invalid_json(buffer):
+    with pytest.raises(ValueError):
+        members(buffer)
+
+
+def test_iter_items(tmpdir):
+    path = str(tmpdir.join("data.json"))
+    with open(path, "w", encoding="utf-8") as json_file:
+        json.dump(DATA, json_file, ensure_ascii=False)
+    assert list(json_stream.iter_items(path=path)) == list(DATA.items())
+    open(path, "w").close()
+    assert list(json_stream.iter_items(path=path)) == []
+
+
+@pytest.mark.parametrize("pretty", [False, True])
+def test_index_offsets(tmpdir, pretty):
+    utils.dict_to_json(data=DATA, data_path=str(tmpdir), feature="data",
+                       index=True, pretty=pretty)
+    path = str(tmpdir.join("data.json"))
+    members = json_stream.read_index(path)
+    assert list(members) == list(DATA)
+    with open(path, "rb") as json_file:
+        buffer = json_file.read()
+    assert json.loads(buffer) == DATA
+    for key, (start, length) in members.items():
+        assert json.loads(buffer[start:start + length]) == DATA[key]
+    # Offsets of the index match the members found by parsing
+    assert members == json_stream.build_index(path)
+    assert json_stream.get_items(path=path, keys=[6, "1", "7"]) == {
+        "6": DATA["6"], "1": DATA["1"]}
+    assert json_stream.get_item(path=path, key="3") == {}
+    assert json_stream.get_item(path=path, key="7") is None
+
+
+def test_stale_index_is_rebuilt(tmpdir):
+    utils.dict_to_json(data=DATA, data_path=str(tmpdir), feature="data",
+                       index=True)
+    path = str(tmpdir.join("data.json"))
+    # Rewritten without index, the size changes
+    changed = dict(DATA, **{"1": "changed"})
+    with open(path, "w", encoding="utf-8") as json_file:
+        json.dump(changed, json_file, indent=4)
+    assert json_stream.read_index(path) is None
+    assert json_stream.get_item(path=path, key="1") == "changed"
+    assert json_stream.read_index(path) == json_stream.build_index(path)
+    # Same size, other modification time
+    with open(path, "r", encoding="utf-8") as json_file:
+        content = json_file.read()
+    with open(path, "w", encoding="utf-8") as json_file:
+        json_file.write(content.replace('"changed"', '"CHANGED"'))
+    os.utime(path, ns=(0, 0))
+    assert json_stream.read_index(path) is None
+    assert json_stream.JsonMembers(path) == dict(DATA, **{"1": "CHANGED"})
+    assert json_stream.read_index(path) is not None
+
+
+def test_json_members(tmpdir):
+    utils.dict_to_json(data=DATA, data_path=str(tmpdir), feature="data",
+                       index=True, pretty=True)
+    data = json_stream.JsonMembers(str(tmpdir.join("data.json")))
+    assert len(data) == len(DATA) and list(data) == list(DATA)
+    assert data["5"] == DATA["5"] and data.get("8") is None
+    assert 3 not in data and "3" in data
+    assert list(data.items()) == list(DATA.items())
+    assert len(data.items()) == len(DATA)
+    with pytest.raises(KeyError):
+        data["8"]
@@ -0,0 +1,124 @@
+import json
+import logging
+import os
+import shutil
+from datetime import date
+
+import pytest
+
+import mdi_thesis.base.base as base
+import mdi_thesis.base.json_stream as json_stream
+import mdi_thesis.metrics_pipeline as metrics_pipeline
+
+# Short distinct strings take several times their json size in memory
+DATA = {str(repo): ["r%sv%s" % (repo, value) for value in range(2000)]
+        for repo in range(10)}
+
+
+@pytest.fixture
+def data_path(tmpdir, monkeypatch):
+    """
+    Working directory with the metrics mapping and outputs/data
+    """
+    monkeypatch.setattr(base, "get_logger", logging.getLogger)
+    os.makedirs(str(tmpdir.join("mdi_thesis")))
+    shutil.copy(os.path.join(os.path.dirname(metrics_pipeline.__file__),
+                             "metrics_data_mapping.json"),
+                str(tmpdir.join("mdi_thesis")))
+    path = str(tmpdir.join("outputs", "data"))
+    os.makedirs(path)
+    return path
+
+
+def write_data(path, objective, data):
+    with open(os.path.join(path, "python_" + objective + ".json"),
+              "w", encoding="utf-8") as json_file:
+        json.dump(data, json_file)
+
+
+def test_cache_drops_least_recently_used(data_path):
+    for objective in ["issue", "commits", "forks"]:
+        write_data(data_path, objective, DATA)
+    pipeline = metrics_pipeline.MetricsPipeline(filter_date=date(2023, 8, 1))
+    pipeline.get_data(objective="issue", language="python")
+    size_mb = pipeline.cache_sizes[("issue", "python")] / (1024 * 1024)
+    pipeline = metrics_pipeline.MetricsPipeline(filter_date=date(2023, 8, 1),
+                                                max_cache_mb=2.5 * size_mb)
+    for objective in ["issue", "commits", "issue", "forks"]:
+        assert pipeline.get_data(objective=objective,
+                                 language="python") == DATA
+    assert list(pipeline.cache) == [("issue", "python"),
+                                    ("forks", "python")]
+    assert set(pipeline.cache_sizes) == set(pipeline.cache)
+    pipeline.drop_language("python")
+    assert not pipeline.cache and not pipeline.cache_sizes
+
+
+def test_large_files_are_streamed(data_path):
+    write_data(data_path, "issue", DATA)
+    file_mb = os.path.getsize(
+        os.path.join(data_path, "python_issue.json")) / (1024 * 1024)
+    pipeline = metrics_pipeline.MetricsPipeline(
+        filter_date=date(2023, 8, 1),
+        max_cache_mb=file_mb * metrics_pipeline.JSON_MEMORY_FACTOR / 2)
+    data = pipeline.get_data(objective="issue", language="python")
+    assert isinstance(data, json_stream.JsonMembers)
+    assert data == DATA
+    assert not pipeline.cache
+
+
+def test_metrics_subset_reads_only_its_objectives(data_path):
+    for objective in ["repository", "issue", "release", "forks"]:
+        write_data(data_path, objective, {"1": []})
+    pipeline = metrics_pipeline.MetricsPipeline(
+        filter_date=date(2023, 8, 1), metrics_subset=["maturity_level"])
+    assert list(pipeline.metrics_objective_mapping) == ["maturity_level"]
+    assert set(pipeline.data_files) == {"repository", "issue", "release"}
+    with pytest.raises(ValueError):
+        metrics_pipeline.MetricsPipeline(filter_date=date(2023, 8, 1),
+                                         metrics_subset=["unknown"])
+
+
+def test_skipped_metrics_are_merged(data_path, tmpdir):
+    write_data(data_path, "skipped",
+               {"1": {"issue": ["archived"]}, "2": {"forks": ["min_stars"]}})
+    pipeline = metrics_pipeline.MetricsPipeline(
+        filter_date=date(2023, 8, 1), repo_ids=[1],
+        metrics_subset=["maturity_level"])
+    skipped_metrics = pipeline.get_skipped_metrics(language="python")
+    assert skipped_metrics == {"1": {"maturity_level": ["issue"]}}
+    pipeline.output_path = str(tmpdir)
+    write_data(str(tmpdir), "skipped_metrics",
+               {"1": {"maturity_level": ["release"],
+                      "technical_fork": ["forks"]},
+                "2": {"maturity_level": ["release"]}})
+    assert pipeline.merge_skipped_metrics(
+        language="python", skipped_metrics=skipped_metrics) == {
+            "1": {"maturity_level": ["issue"],
+                  "technical_fork": ["forks"]},
+            "2": {"maturity_level": ["release"]}}
+
+
+def test_prep_data_streams_unfiltered_objectives(data_path):
+    issues = {str(repo): [{"id": number,
+                           "updated_at": "2023-0%s-01T00:00:00Z" % month}
+                          for number, month in enumerate([1, 5, 7])]
+              for repo in range(5)}
+    write_data(data_path, "issue", issues)
+    write_data(data_path, "contributors", DATA)
+    write_data(data_path, "repository", {str(repo): {"id": repo}
+                                         for repo in range(5)})
+    objectives = {"issue": ["updated_at", "months=6"],
+                  "contributors": None, "repository": None}
+    results = []
+    for max_cache_mb in [4096, 0]:
+        pipeline = metrics_pipeline.MetricsPipeline(
+            filter_date=date(2023, 8, 1), repo_ids=[1, 3],
+            max_cache_mb=max_cache_mb)
+        results.append(pipeline.prep_data(language="python",
+                                          objectives=objectives))
+    cached, streamed = results
+    assert isinstance(streamed["contributors"], json_stream.JsonMembers)
+    assert streamed == cached
+    assert streamed["repository"] == {"1": {"id": 1}, "3": {"id": 3}}
+    assert [issue["id"] for issue in streamed["issue"]["2"]] == [1, 2]
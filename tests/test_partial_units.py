@@ -0,0 +1,63 @@
+import logging
+import os
+import time
+from datetime import date
+
+import mdi_thesis.base.base as base
+import mdi_thesis.base.utils as utils
+import mdi_thesis.base_data_miner as base_data_miner
+
+# Seconds each repository needs for the stage
+DURATIONS = {1: 5, 2: 0.2}
+
+
+def request_init(self, filter_date, request_budget=None):
+    self.logger = logging.getLogger(__name__)
+    self.filter_date = filter_date
+    self.owns_budget = False
+    self.selected_repos_dict = {}
+    self.partial_repos = set()
+    self.feature_pause = 0
+    self.branch_pause = 0
+
+
+class SlowPipeline(base_data_miner.DataMinePipeline):
+    def slow_to_json(self):
+        deadline = self.unit_deadline()
+        for repo in self.selected_repos_dict:
+            end = time.monotonic() + DURATIONS[repo]
+            while time.monotonic() < end:
+                if self.deadline_passed(deadline):
+                    self.mark_partial(repo, "slow")
+                    break
+                time.sleep(0.01)
+        self.write_output(data={repo: [repo]
+                                for repo in self.selected_repos_dict},
+                          feature="slow")
+
+
+def test_timed_out_unit_is_stored_as_partial(tmpdir, monkeypatch):
+    monkeypatch.setattr(base.Request, "__init__", request_init)
+    monkeypatch.setattr(SlowPipeline, "build_pipeline", lambda self: [])
+    monkeypatch.setattr(SlowPipeline, "search_to_json", lambda self: None)
+    pipeline = SlowPipeline(language="python",
+                            filter_date=date(2023, 8, 1),
+                            get_existing_repos=False,
+                            unit_time_budget=0.1)
+    assert pipeline.straggler_time_budget == (
+        base_data_miner.STRAGGLER_BUDGET_FACTOR * 0.1)
+    pipeline.output_path = str(tmpdir)
+    pipeline.selected_repos_dict = {1: {}, 2: {}}
+    for repo in pipeline.selected_repos_dict:
+        pipeline.query_unit(repo=repo, stage_name="slow_to_json")
+    assert pipeline.partial_units == {"slow_to_json": {1, 2}}
+    start = time.monotonic()
+    pipeline.retry_partial_units()
+    # The retry stops at the straggler time budget
+    assert time.monotonic() - start < DURATIONS[1]
+    partial_units = utils.json_to_dict(
+        path=os.path.join(str(tmpdir), "python_partial_units.json"))
+    assert partial_units == {"1": ["slow_to_json"]}
+    assert utils.json_to_dict(
+        path=os.path.join(str(tmpdir), "python_slow.json")) == {
+            "1": [1], "2": [2]}
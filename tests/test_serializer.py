@@ -0,0 +1,106 @@
+import io
+import json
+import math
+import os
+
+import numpy as np
+import pytest
+
+import mdi_thesis.base.serializer as serializer
+import mdi_thesis.base.utils as utils
+
+BACKENDS = ["json", "orjson"]
+
+DATA = {
+    1: {"stars": np.int64(12), "share": np.float64(0.5),
+        "archived": np.bool_(True), "weeks": np.arange(3)},
+    "2": {"nested": {"deeper": [1, {3: None}], "empty": {}}, "list": []},
+    False: "ü€𝄞",
+    None: [np.array([[1.5, 2.0], [3.0, 4.5]])]
+}
+
+EXPECTED = {
+    "1": {"stars": 12, "share": 0.5, "archived": True, "weeks": [0, 1, 2]},
+    "2": {"nested": {"deeper": [1, {"3": None}], "empty": {}}, "list": []},
+    "false": "ü€𝄞",
+    "null": [[[1.5, 2.0], [3.0, 4.5]]]
+}
+
+
+def use_backend(monkeypatch, backend):
+    if backend == "json":
+        monkeypatch.setattr(serializer, "orjson", None)
+        monkeypatch.setattr(serializer, "BACKEND", "json")
+        monkeypatch.setattr(serializer, "INDENT", 4)
+
+
+def dump(data, pretty):
+    buffer = io.BytesIO()
+    members = serializer.dump(data=data, file=buffer, pretty=pretty)
+    return buffer.getvalue(), members
+
+
+@pytest.mark.parametrize("pretty", [False, True])
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_round_trip(monkeypatch, backend, pretty):
+    use_backend(monkeypatch, backend)
+    buffer, members = dump(DATA, pretty=pretty)
+    assert serializer.loads(buffer) == EXPECTED
+    assert json.loads(buffer) == EXPECTED
+    assert list(members) == list(EXPECTED)
+    for key, (start, length) in members.items():
+        assert serializer.loads(buffer[start:start + length]) == \
+            EXPECTED[key]
+    # Nested levels are indented below their member
+    if pretty:
+        assert b"\n" + b" " * (2 * serializer.INDENT) + b'"stars"' in \
+            buffer
+    assert json.loads(serializer.dumps(DATA, pretty=pretty)) == EXPECTED
+
+
+@pytest.mark.parametrize("pretty", [False, True])
+@pytest.mark.parametrize("writer,reader", [("json", "orjson"),
+                                           ("orjson", "json")])
+def test_backends_read_each_other(monkeypatch, writer, reader, pretty):
+    with monkeypatch.context() as context:
+        use_backend(context, writer)
+        buffer, _ = dump(DATA, pretty=pretty)
+    use_backend(monkeypatch, reader)
+    assert serializer.loads(buffer) == EXPECTED
+
+
+@pytest.mark.parametrize("data", [[], {}, [1, np.int32(2)], "text", 3])
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_non_dict_data(monkeypatch, backend, data):
+    use_backend(monkeypatch, backend)
+    buffer, members = dump(data, pretty=True)
+    assert serializer.loads(buffer) == json.loads(
+        json.dumps(data, default=int))
+    assert members == {}
+
+
+def test_nan_written_by_json_is_read(monkeypatch):
+    with monkeypatch.context() as context:
+        use_backend(context, "json")
+        buffer, _ = dump({"1": float("nan")}, pretty=False)
+    assert buffer == b'{"1":NaN}'
+    assert math.isnan(serializer.loads(buffer)["1"])
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_unserializable_object(monkeypatch, backend):
+    use_backend(monkeypatch, backend)
+    with pytest.raises(TypeError):
+        serializer.dumps({"1": object()})
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_failed_dump_keeps_previous_file(tmpdir, monkeypatch, backend):
+    use_backend(monkeypatch, backend)
+    utils.dict_to_json(data={"1": [1]}, data_path=str(tmpdir),
+                       feature="data")
+    with pytest.raises(TypeError):
+        utils.dict_to_json(data={"1": [2], "2": object()},
+                           data_path=str(tmpdir), feature="data")
+    assert serializer.load(str(tmpdir.join("data.json"))) == {"1": [1]}
+    assert os.listdir(str(tmpdir)) == ["data.json"]